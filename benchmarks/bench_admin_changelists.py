@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Admin changelists on large tables, stock vs LargeTableMixin
+
+    python -m benchmarks.bench_admin_changelists --sessions 300000
+
+Against a throwaway test database, seeds `sessions` UserSession rows and
+loads the same UserSession / UserAccount changelist pages (first page,
+search by user prefix and by IP, IP filter, date drill-down) from the
+admins in main_app/admin.py and users/admin.py and from copies with the
+previous stock options on a second AdminSite, printing time and queries
+per page. Then checks that the new pages:
+
+* never run an unbounded COUNT (only LIMIT subqueries; on PostgreSQL the
+  unfiltered count is pg_class.reltuples),
+* never run DISTINCT or substring (LIKE '%...%') queries,
+* show the same date drill-down links as the stock ones where every day
+  has sessions, and the same rows for IP and user searches.
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+from datetime import timedelta
+
+from django.urls import path
+
+urlpatterns = []
+
+
+def legacy_site():
+    """The admins as they were: exact counts, icontains search, DISTINCT IP filter"""
+    from django.contrib import admin
+    from main_app.models import UserSession
+    from users.models import UserAccount
+
+    site = admin.AdminSite(name='legacy')
+
+    class UserSessionAdmin(admin.ModelAdmin):
+        list_display = ('user_account', 'session_start', 'session_end', 'ip_address')
+        list_filter = ('session_start', 'session_end', 'ip_address')
+        search_fields = ('user_account__user_id', 'ip_address')
+        date_hierarchy = 'session_start'
+
+        def get_queryset(self, request):
+            return super().get_queryset(request).select_related('user_account')
+
+    class UserAccountAdmin(admin.ModelAdmin):
+        list_display = ('user_id', 'status', 'is_logged_in', 'device_ip', 'last_login')
+        search_fields = ('user_id',)
+
+    site.register(UserSession, UserSessionAdmin)
+    site.register(UserAccount, UserAccountAdmin)
+    return site
+
+
+def seed(sessions, users, now, rng):
+    from main_app.models import UserSession
+    from users.models import UserAccount
+
+    UserAccount.objects.bulk_create([UserAccount(user_id=f'adm{n:06d}', password='x') for n in range(users)])
+    accounts = list(UserAccount.objects.values_list('pk', flat=True))
+    batch = []
+    for _ in range(sessions):
+        start = now - timedelta(seconds=rng.randrange(120 * 86400))
+        batch.append(UserSession(user_account_id=rng.choice(accounts), session_start=start,
+                                 session_end=start + timedelta(minutes=rng.randrange(1, 240)),
+                                 ip_address=f'10.{rng.randrange(4)}.{rng.randrange(250)}.{rng.randrange(1, 250)}'))
+        if len(batch) == 5000:
+            UserSession.objects.bulk_create(batch)
+            batch = []
+    UserSession.objects.bulk_create(batch)
+
+
+def fetch(client, url):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = client.get(url)
+        elapsed = time.perf_counter() - started
+    assert response.status_code == 200, (url, response.status_code)
+    return response, elapsed, [query['sql'] for query in queries.captured_queries]
+
+
+def drilldown(response):
+    from django.contrib.admin.templatetags.admin_list import date_hierarchy
+    return [choice['title'] for choice in date_hierarchy(response.context['cl'])['choices']]
+
+
+def unbounded_count(sql):
+    return 'COUNT(' in sql.upper() and ' LIMIT ' not in sql.upper()
+
+
+def run(sessions, users):
+    from django.contrib.auth.models import User
+    from django.test import Client, override_settings
+    from django.utils import timezone
+    from main_app.models import UserSession
+    from users.models import UserAccount
+
+    now = timezone.now()
+    seed(sessions, users, now, random.Random(5))
+    ip = UserSession.objects.values_list('ip_address', flat=True)[sessions // 2]
+    local = timezone.localtime(now - timedelta(days=40))
+    pages = {
+        'sessions':        'main_app/usersession/',
+        'session search':  'main_app/usersession/?q=adm00012',
+        'session ip':      f'main_app/usersession/?q={ip}',
+        'ip filter':       f'main_app/usersession/?ip={ip}',
+        'sessions month':  f'main_app/usersession/?session_start__year={local.year}'
+                           f'&session_start__month={local.month}',
+        'accounts':        'users/useraccount/',
+        'account search':  'users/useraccount/?q=adm0001',
+    }
+    legacy_pages = dict(pages, **{'ip filter': f'main_app/usersession/?ip_address={ip}'})
+
+    staff = User.objects.create_superuser('changelist-admin', 'changelist@example.com', 'x')
+    client = Client()
+    client.force_login(staff, backend='django.contrib.auth.backends.ModelBackend')
+    # SessionManagementMiddleware logs out users without an account holding this session
+    UserAccount.objects.create(user_id=staff.username, password='x', is_logged_in=True,
+                               current_session=client.session.session_key)
+
+    results, checks = {}, {}
+    bounded = distinct_free = substring_free = True
+    same_links = same_rows = True
+    with override_settings(ROOT_URLCONF=__name__):
+        fetch(client, '/admin/' + pages['sessions'])  # warm up
+        for name, page in pages.items():
+            new, new_s, new_sql = fetch(client, '/admin/' + page)
+            old, old_s, old_sql = fetch(client, '/legacy/' + legacy_pages[name])
+            results[name] = {'stock_ms': round(old_s * 1000, 1), 'stock_queries': len(old_sql),
+                             'new_ms': round(new_s * 1000, 1), 'new_queries': len(new_sql)}
+            bounded &= not any(unbounded_count(sql) for sql in new_sql)
+            distinct_free &= not any('DISTINCT' in sql.upper() for sql in new_sql)
+            substring_free &= not any(re.search(r"LIKE '%", sql) for sql in new_sql)
+            if name.startswith('sessions'):
+                same_links &= drilldown(new) == drilldown(old)
+            if name in ('session ip', 'ip filter', 'session search', 'account search'):
+                new_rows = [obj.pk for obj in new.context['cl'].result_list]
+                old_rows = [obj.pk for obj in old.context['cl'].result_list]
+                same_rows &= bool(new_rows) and new_rows == old_rows
+
+    checks['no unbounded COUNT'] = bounded
+    checks['no DISTINCT queries'] = distinct_free
+    checks['no substring searches'] = substring_free
+    checks['same date drill-down links'] = same_links
+    checks['same rows for searches and IP filter'] = same_rows
+    return results, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=300000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    from django.contrib import admin
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    urlpatterns[:] = [path('admin/', admin.site.urls), path('legacy/', legacy_site().urls)]
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        results, checks = run(args.sessions, args.users)
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        for name, values in results.items():
+            print(f"{name:<16} " + '  '.join(f'{k}={v}' for k, v in values.items()))
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Compare sync (gunicorn WSGI) and async (uvicorn ASGI, API_ASYNC=True)
+throughput for the AI Mailer Pro status poll at high concurrency.
+
+    python -m benchmarks.bench_async_api --concurrency 50 200 1000 --duration 10
+
+Both servers get the same worker count and the same freshly seeded database.
+Pass --database-url to benchmark against PostgreSQL instead of SQLite.
+"""
+import argparse
+import asyncio
+import json
+
+from .loadgen import fetch, run_load
+from .servers import bench_env, manage, start_server, stop_server, session_cookie
+
+USERNAME = 'bench'
+PASSWORD = 'bench-password'
+
+
+def login(base):
+    body = json.dumps({'username': USERNAME, 'password': PASSWORD}).encode()
+    status, headers, payload = fetch(f'{base}/app/api/login/', 'POST',
+                                     {'Content-Type': 'application/json'}, body)
+    cookie = session_cookie(headers)
+    if status != 200 or not cookie:
+        raise RuntimeError(f'login failed ({status}): {payload[:200]!r}')
+    return cookie
+
+
+def logout(base, cookie):
+    fetch(f'{base}/app/api/logout/', 'POST', {'Cookie': cookie})
+
+
+def bench_server(kind, port, env, args):
+    proc = start_server(kind, port, env, workers=args.workers)
+    base = f'http://127.0.0.1:{port}'
+    results = []
+    try:
+        cookie = login(base)
+        try:
+            for concurrency in args.concurrency:
+                result = asyncio.run(run_load(
+                    f'{base}/app/api/status/',
+                    headers={'Cookie': cookie},
+                    concurrency=concurrency,
+                    duration=args.duration,
+                ))
+                result.update({'server': kind, 'concurrency': concurrency})
+                results.append(result)
+                print(f"{kind:5} c={concurrency:<5} rps={result['rps']:<9} "
+                      f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+                      f"p99={result['p99_ms']}ms errors={result['errors']}")
+        finally:
+            logout(base, cookie)
+    finally:
+        stop_server(proc)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per run')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    env = bench_env(args.database_url)
+    manage(env, 'migrate', '--noinput')
+    manage(env, 'create_test_user', '--username', USERNAME, '--password', PASSWORD)
+
+    results = bench_server('wsgi', args.port, env, args)
+    results += bench_server('asgi', args.port + 1, {**env, 'API_ASYNC': 'True'}, args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Endpoint benchmark and load test
+
+    python -m benchmarks.bench_endpoints --concurrency 50 --duration 10 --output bench.json
+    python -m benchmarks.bench_endpoints --baseline bench-main.json
+
+1. Checks the per-endpoint query budgets (benchmarks/query_budgets.py).
+2. Seeds a realistic dataset (benchmarks/seed.py) into a fresh database.
+3. Starts the project under gunicorn (or uvicorn with --server asgi) and
+   drives every endpoint with concurrent clients, one phase per flow:
+   web login/logout, dashboard, JSON API login/status/logout, JWT token,
+   /api/me/ and JWT logout.
+4. Prints p50/p95/p99 latency and req/s per endpoint and writes everything,
+   plus the git commit, to JSON so runs can be compared with --baseline.
+
+Exits non-zero if a query budget is exceeded.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import subprocess
+import sys
+from urllib.parse import urlencode
+
+from .loadgen import fetch, run_flow
+from .seed import BENCH_PASSWORD, OPERATOR, client_user_id
+from .servers import BASE_DIR, bench_env, manage, start_server, stop_server, session_cookie
+
+JSON = {'Content-Type': 'application/json'}
+FORM = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def credentials(user_id):
+    return json.dumps({'username': user_id, 'password': BENCH_PASSWORD}).encode()
+
+
+# -- flows: one iteration of a virtual user -----------------------------------
+
+async def web_login_flow(client, index):
+    await client.request('GET /login/', 'GET', '/login/')
+    token = client.cookies.get('csrftoken', '')
+    body = urlencode({'username': client_user_id(index), 'password': BENCH_PASSWORD,
+                      'csrfmiddlewaretoken': token}).encode()
+    await client.request('POST /login/', 'POST', '/login/', FORM, body)
+    await client.request('GET /logout/', 'GET', '/logout/')
+
+
+async def api_login_flow(client, index):
+    await client.request('POST /app/api/login/', 'POST', '/app/api/login/', JSON, credentials(client_user_id(index)))
+    await client.request('POST /app/api/logout/', 'POST', '/app/api/logout/')
+
+
+async def jwt_flow(client, index):
+    _, _, payload = await client.request('POST /api/token/', 'POST', '/api/token/', JSON,
+                                         credentials(client_user_id(index)))
+    try:
+        access = json.loads(payload)['access']
+    except (ValueError, KeyError):
+        return
+    await client.request('POST /api/logout/', 'POST', '/api/logout/', {'Authorization': f'Bearer {access}'})
+
+
+def shared_get(step, path, cookies=None, headers=None):
+    """A flow where every client repeats one GET with the same credentials"""
+    async def flow(client, index):
+        if cookies and not client.cookies:
+            client.cookies.update(cookies)
+        await client.request(step, 'GET', path, headers)
+    return flow
+
+
+# -- setup helpers for the shared-credential phases ---------------------------
+
+def web_session(base):
+    _, headers, _ = fetch(f'{base}/login/')
+    csrf = next(v.split(';', 1)[0].split('=', 1)[1] for v in headers['set-cookie'] if v.startswith('csrftoken='))
+    body = urlencode({'username': OPERATOR, 'password': BENCH_PASSWORD, 'csrfmiddlewaretoken': csrf}).encode()
+    _, headers, _ = fetch(f'{base}/login/', 'POST', {**FORM, 'Cookie': f'csrftoken={csrf}'}, body)
+    return dict(c.split('=', 1) for c in [session_cookie(headers), f'csrftoken={csrf}'])
+
+
+def api_session(base):
+    _, headers, _ = fetch(f'{base}/app/api/login/', 'POST', JSON, credentials(OPERATOR))
+    return dict([session_cookie(headers).split('=', 1)])
+
+
+def jwt_token(base):
+    _, _, payload = fetch(f'{base}/api/token/', 'POST', JSON, credentials(OPERATOR))
+    return json.loads(payload)['access']
+
+
+def run_phases(base, concurrency, duration):
+    results = {}
+
+    def phase(flow):
+        results.update(asyncio.run(run_flow(base, flow, concurrency=concurrency, duration=duration)))
+
+    phase(web_login_flow)
+
+    cookies = web_session(base)
+    phase(shared_get('GET /dashboard/', '/dashboard/', cookies=cookies))
+    fetch(f'{base}/logout/', headers={'Cookie': '; '.join(f'{k}={v}' for k, v in cookies.items())})
+
+    phase(api_login_flow)
+
+    cookies = api_session(base)
+    phase(shared_get('GET /app/api/status/', '/app/api/status/', cookies=cookies))
+    fetch(f'{base}/app/api/logout/', 'POST', {'Cookie': '; '.join(f'{k}={v}' for k, v in cookies.items())})
+
+    phase(jwt_flow)
+
+    access = jwt_token(base)
+    bearer = {'Authorization': f'Bearer {access}'}
+    phase(shared_get('GET /api/me/', '/api/me/', headers=bearer))
+    fetch(f'{base}/api/logout/', 'POST', bearer)
+
+    return results
+
+
+# -- reporting -----------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(endpoints, baseline=None):
+    print(f"{'endpoint':<24} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for step, r in endpoints.items():
+        line = f"{step:<24} {r['rps']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['errors']:>7}"
+        before = (baseline or {}).get(step)
+        if before and before['p95_ms'] and before['rps']:
+            line += (f"   p95 {100.0 * (r['p95_ms'] - before['p95_ms']) / before['p95_ms']:+.0f}%"
+                     f" rps {100.0 * (r['rps'] - before['rps']) / before['rps']:+.0f}%")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per phase')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--accounts', type=int, default=20000)
+    parser.add_argument('--sessions', type=int, default=200000)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--skip-load', action='store_true', help='only check query budgets')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON from an earlier run to compare against')
+    args = parser.parse_args()
+
+    budgets = subprocess.run([sys.executable, '-m', 'benchmarks.query_budgets', '--json'], cwd=BASE_DIR,
+                             env=bench_env(args.database_url), capture_output=True, text=True)
+    query_budgets = json.loads(budgets.stdout.strip().splitlines()[-1])
+    for label, result in query_budgets.items():
+        if not result['ok']:
+            print(f"OVER BUDGET {label}: {result['queries']} queries (budget {result['budget']})")
+
+    endpoints = {}
+    if not args.skip_load:
+        extra = {'API_ASYNC': 'True'} if args.server == 'asgi' else {}
+        env = bench_env(args.database_url, **extra)
+        manage(env, 'migrate', '--noinput')
+        subprocess.run([sys.executable, '-m', 'benchmarks.seed', '--accounts', str(args.accounts),
+                        '--sessions', str(args.sessions), '--clients', str(args.concurrency)],
+                       cwd=BASE_DIR, env=env, check=True)
+
+        proc = start_server(args.server, args.port, env, workers=args.workers)
+        try:
+            endpoints = run_phases(f'http://127.0.0.1:{args.port}', args.concurrency, args.duration)
+        finally:
+            stop_server(proc)
+
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f).get('endpoints')
+        print_table(endpoints, baseline)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'server': args.server,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'duration_s': args.duration,
+            'accounts': args.accounts,
+            'sessions': args.sessions,
+        },
+        'query_budgets': query_budgets,
+        'endpoints': endpoints,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not all(result['ok'] for result in query_budgets.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Streaming exports: memory, first byte and throughput
+
+    python -m benchmarks.bench_exports --sessions 200000
+
+Against a throwaway test database, seeds `sessions` UserSession rows and
+streams the sessions export (CSV, NDJSON, gzipped CSV) through
+main_app.exports, printing rows/s and the peak Python memory of each
+(under tracemalloc, so rates run low), next to loading the same rows as
+model instances (what a shell loop over UserSession.objects.all() does).
+Then checks that:
+
+* the peak memory of an export doesn't grow with the number of rows,
+* the first piece of the HTTP response is sent before any query runs,
+* gzipped output decompresses to the plain output, and the ASGI stream
+  (astream) produces the same bytes,
+* since/until and user filters export exactly the matching rows,
+* non-staff requests are refused.
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+
+def seed(sessions, users, now, rng):
+    from main_app.models import UserSession
+    from users.models import UserAccount
+
+    UserAccount.objects.bulk_create([UserAccount(user_id=f'exp{n}', password='x') for n in range(users)])
+    accounts = list(UserAccount.objects.values_list('pk', flat=True))
+    batch = []
+    for index in range(sessions):
+        start = now - timedelta(seconds=rng.randrange(90 * 86400))
+        batch.append(UserSession(user_account_id=rng.choice(accounts), session_start=start,
+                                 session_end=start + timedelta(minutes=rng.randrange(1, 240)),
+                                 ip_address=f'10.{rng.randrange(250)}.{rng.randrange(250)}.{rng.randrange(1, 250)}',
+                                 user_agent='AI Mailer Pro/3.2 (Windows NT 10.0)'))
+        if len(batch) == 5000:
+            UserSession.objects.bulk_create(batch)
+            batch = []
+    UserSession.objects.bulk_create(batch)
+
+
+def consume(pieces):
+    size = 0
+    for piece in pieces:
+        size += len(piece)
+    return size
+
+
+def measured(rows, produce):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = produce()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'rows': rows, 'rows_per_s': round(rows / elapsed), 'mb': round(size / 1e6, 1),
+            'peak_kb': round(peak / 1024)}
+
+
+def exports_cost(total, now):
+    from main_app import exports
+    from main_app.models import UserSession
+
+    results = {}
+    # The last quarter of the 90 days seeded, vs all of them
+    since = now - timedelta(days=22, hours=12)
+    quarter = UserSession.objects.filter(session_start__gte=since).count()
+    results['csv 1/4 rows'] = measured(quarter, lambda: consume(exports.stream('sessions', since=since)))
+    results['csv'] = measured(total, lambda: consume(exports.stream('sessions')))
+    results['ndjson'] = measured(total, lambda: consume(exports.stream('sessions', 'ndjson')))
+    results['csv.gz'] = measured(total, lambda: consume(exports.stream('sessions', compress=True)))
+    results['model list()'] = measured(total, lambda: len(list(UserSession.objects.all())))
+    flat = results['csv']['peak_kb'] < results['csv 1/4 rows']['peak_kb'] * 1.5 + 256
+    return results, flat
+
+
+def http_checks(now):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+    from django.utils import timezone
+    from main_app import exports
+    from main_app.models import UserSession
+    from users.models import UserAccount
+
+    staff = User.objects.create_superuser('export-admin', 'export@example.com', 'x')
+    client = Client()
+    client.force_login(staff, backend='django.contrib.auth.backends.ModelBackend')
+    # SessionManagementMiddleware logs out users without an account holding this session
+    UserAccount.objects.create(user_id=staff.username, password='x', is_logged_in=True,
+                               current_session=client.session.session_key)
+    client.get('/app/api/export/accounts/?user=nobody')  # warm up (installs the metrics DB wrapper)
+
+    checks = {}
+    queries = []
+    response = client.get('/app/api/export/sessions/')
+    with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+        content = iter(response.streaming_content)
+        started = time.perf_counter()
+        first = next(content)
+        first_ms = (time.perf_counter() - started) * 1000
+        before_first = len(queries)
+        plain = first + b''.join(content)
+    checks['first piece sent before any query'] = (before_first == 0 and first.startswith(b'id,user_id')
+                                                   and len(queries) > 0)
+
+    zipped = b''.join(client.get('/app/api/export/sessions/?gzip=1').streaming_content)
+    checks['gzip output decompresses to the plain output'] = gzip.decompress(zipped) == plain
+
+    async def collect():
+        return b''.join([piece async for piece in exports.astream('sessions', 'ndjson', users=['exp1', 'exp2'])])
+    checks['astream matches stream'] = (asyncio.run(collect())
+                                        == b''.join(exports.stream('sessions', 'ndjson', users=['exp1', 'exp2'])))
+
+    since, until = now - timedelta(days=30), now - timedelta(days=20)
+    query = (f'?format=ndjson&user=exp3&user=exp4&since={since.date().isoformat()}'
+             f'&until={until.date().isoformat()}')
+    lines = b''.join(client.get('/app/api/export/sessions/' + query).streaming_content).splitlines()
+    exported = sorted(json.loads(line)['id'] for line in lines)
+    start = timezone.make_aware(datetime.combine(since.date(), datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(until.date(), datetime.min.time()))
+    expected = sorted(UserSession.objects.filter(user_account__user_id__in=['exp3', 'exp4'], session_start__gte=start,
+                                                 session_start__lt=end).values_list('pk', flat=True))
+    checks['filters export exactly the matching rows'] = bool(expected) and exported == expected
+
+    rows = list(csv.reader(io.StringIO(plain.decode())))
+    checks['csv has every row'] = len(rows) - 1 == UserSession.objects.count()
+
+    checks['non-staff refused'] = Client().get('/app/api/export/sessions/').status_code == 403
+    return {'first_piece_ms': round(first_ms, 2), 'bytes': len(plain), 'gzip_bytes': len(zipped)}, checks
+
+
+def run(sessions, users):
+    from django.utils import timezone
+
+    now = timezone.now()
+    seed(sessions, users, now, random.Random(11))
+    results, flat = exports_cost(sessions, now)
+    results['http'], checks = http_checks(now)
+    checks = {'export memory independent of rows': flat, **checks}
+    return results, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        results, checks = run(args.sessions, args.users)
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        for name, values in results.items():
+            print(f"{name:<14} " + '  '.join(f'{k}={v}' for k, v in values.items()))
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+What a log call costs the request thread, direct vs queued
+
+    python -m benchmarks.bench_logging --records 20000
+
+Logs `records` INFO lines through the old setup (a FileHandler and a
+StreamHandler called on the request thread) and through
+internet_art_tools.log.QueueHandler writing to the same targets, and
+prints the time per call and until everything was written. Then checks
+that:
+
+* with a writer stalled for 50 ms per record, log calls still return in
+  microseconds and records beyond the queue size are dropped and counted,
+* SampledDebug lets through one in `every` DEBUG records per call site,
+* oversized messages are cut to max_length,
+* a failed main app login runs the same number of queries with 10 or
+  2000 accounts in the database (test database).
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+class SlowHandler(logging.Handler):
+    """A disk that stalls for `delay` seconds per record"""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.records = []
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.records.append(self.format(record))
+
+
+def targets(path):
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(logging.Formatter('{levelname} {asctime} {module} {process:d} {message}', style='{'))
+    console = logging.StreamHandler(io.StringIO())
+    console.setFormatter(logging.Formatter('{levelname} {message}', style='{'))
+    return [file_handler, console]
+
+
+def timed_logger(name, handlers, records):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    for handler in handlers:
+        logger.addHandler(handler)
+    started = time.perf_counter()
+    for index in range(records):
+        logger.info('Login attempt for username: %s', f'user{index}')
+    return time.perf_counter() - started
+
+
+def throughput(records, workdir):
+    from internet_art_tools.log import QueueHandler
+
+    results = {}
+    direct = targets(os.path.join(workdir, 'direct.log'))
+    elapsed = timed_logger('bench.direct', direct, records)
+    results['direct'] = {'us_per_call': round(elapsed / records * 1e6, 1), 'ms_until_written': round(elapsed * 1000, 1)}
+
+    queued = QueueHandler(targets(os.path.join(workdir, 'queued.log')), maxsize=records + 1)
+    elapsed = timed_logger('bench.queued', [queued], records)
+    queued.stop()
+    drained = time.perf_counter()
+    results['queued'] = {'us_per_call': round(elapsed / records * 1e6, 1),
+                         'ms_until_written': round((elapsed + (time.perf_counter() - drained)) * 1000, 1)}
+    with open(os.path.join(workdir, 'queued.log')) as f:
+        written = sum(1 for _ in f)
+    return results, written == records
+
+
+def stalled_writer():
+    from internet_art_tools.log import QueueHandler
+
+    direct = logging.getLogger('bench.stalled.direct')
+    direct.propagate = False
+    direct.addHandler(SlowHandler(0.05))
+    started = time.perf_counter()
+    for index in range(20):
+        direct.warning('record %d', index)
+    direct_us = (time.perf_counter() - started) / 20 * 1e6
+
+    slow = SlowHandler(0.05)
+    handler = QueueHandler([slow], maxsize=100)
+    logger = logging.getLogger('bench.stalled')
+    logger.propagate = False
+    logger.addHandler(handler)
+    started = time.perf_counter()
+    for index in range(1000):
+        logger.warning('record %d', index)
+    elapsed = time.perf_counter() - started
+    dropped = handler.dropped
+    handler.stop()
+    result = {'direct_us_per_call': round(direct_us, 1), 'queued_us_per_call': round(elapsed / 1000 * 1e6, 1),
+              'dropped': dropped}
+    return result, elapsed < 0.5 and dropped >= 800
+
+
+def sampling_and_truncation():
+    from internet_art_tools.log import QueueHandler, SampledDebug
+
+    sink = SlowHandler(0)
+    handler = QueueHandler([sink], max_length=100)
+    handler.addFilter(SampledDebug(every=10))
+    logger = logging.getLogger('bench.sampled')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    for index in range(1000):
+        logger.debug('noisy %d', index)
+    for index in range(5):
+        logger.info('kept %d', index)
+    logger.info('x' * 10000)
+    handler.stop()
+    debug = [line for line in sink.records if line.startswith('noisy')]
+    info = [line for line in sink.records if line.startswith('kept')]
+    longest = max(len(line) for line in sink.records)
+    return len(debug) == 100 and len(info) == 5, longest < 200
+
+
+def failed_login_queries():
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import CaptureQueriesContext
+    from users.models import UserAccount
+
+    counts = []
+    for total in (10, 2000):
+        existing = UserAccount.objects.count()
+        UserAccount.objects.bulk_create(
+            [UserAccount(user_id=f'log{existing + n}', password='x') for n in range(total - existing)])
+        with override_settings(LOGIN_THROTTLE={'ENABLED': False}):
+            client = Client()
+            with CaptureQueriesContext(connection) as queries:
+                client.post('/app/login/', {'username': 'nobody', 'password': 'wrong'})
+        counts.append(len(queries))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    checks = {}
+    with tempfile.TemporaryDirectory(prefix='logging-') as workdir:
+        results, complete = throughput(args.records, workdir)
+    checks['queued records all written'] = complete
+    results['stalled writer'], checks['stalled writer never blocks callers'] = stalled_writer()
+    checks['debug sampled per call site'], checks['long messages cut'] = sampling_and_truncation()
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        counts = failed_login_queries()
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+    results['failed main login'] = {'queries_10_accounts': counts[0], 'queries_2000_accounts': counts[1]}
+    checks['failed login queries independent of accounts'] = counts[0] == counts[1]
+
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        for name, values in results.items():
+            print(f"{name:<18} " + '  '.join(f'{k}={v}' for k, v in values.items()))
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
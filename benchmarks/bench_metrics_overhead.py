@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Overhead of the /metrics instrumentation
+
+    python -m benchmarks.bench_metrics_overhead --requests 2000
+
+Comparing whole requests with and without MetricsMiddleware can't resolve
+a difference under 1%: run-to-run noise of test-client requests is several
+percent. So this times the instrumentation itself, best of several
+repeats:
+
+* MetricsMiddleware around a view that returns at once (the per-request
+  cost: contextvar, clock reads, one registry update), and
+* the DB execute_wrapper around a no-op execute (the per-query cost),
+
+and the hot endpoints in main_app.api_views and users.views (api_status,
+api_me) through the test client against a throwaway test database, with
+their query counts. Overhead per endpoint is
+(middleware + queries * wrapper) / request time. Also checks that /metrics
+is off without a token or allowed IP, and refuses a wrong token.
+
+Exits non-zero if any endpoint's overhead is 1% or more, or a check fails.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+LIMIT_PCT = 1.0
+
+
+def best_per_call(call, count, repeats=5):
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(count):
+            call()
+        elapsed = (time.perf_counter() - started) / count
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def instrumentation_cost(count):
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from django.urls import resolve
+    from internet_art_tools import metrics
+
+    response = HttpResponse()
+    request = RequestFactory().get('/app/api/status/')
+    request.resolver_match = resolve('/app/api/status/')
+    middleware = metrics.MetricsMiddleware(lambda request: response)
+    bare = best_per_call(lambda: response, count)
+    wrapped = best_per_call(lambda: middleware(request), count)
+
+    def execute(sql, params, many, context):
+        return None
+    token = metrics._current.set([0, 0.0])
+    try:
+        direct = best_per_call(lambda: execute('SELECT 1', None, False, None), count)
+        through = best_per_call(lambda: metrics._db_wrapper(execute, 'SELECT 1', None, False, None), count)
+    finally:
+        metrics._current.reset(token)
+    return max(0.0, wrapped - bare), max(0.0, through - direct)
+
+
+def endpoint_costs(requests):
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from users.backends import shadow_user
+    from users.models import UserAccount
+    from users.passwords import hash_password
+
+    hashed = hash_password('overhead-password')
+    for user_id in ('overhead', 'overhead-jwt'):
+        UserAccount.objects.create(user_id=user_id, password=hashed)
+    shadow_user('overhead-jwt')
+    web = Client()
+    web.post('/app/api/login/', json.dumps({'username': 'overhead', 'password': 'overhead-password'}),
+             content_type='application/json')
+    jwt = Client()
+    access = jwt.post('/api/token/', json.dumps({'username': 'overhead-jwt', 'password': 'overhead-password'}),
+                      content_type='application/json').json()['access']
+    endpoints = {
+        'GET /app/api/status/': lambda: web.get('/app/api/status/'),
+        'GET /api/me/': lambda: jwt.get('/api/me/', HTTP_AUTHORIZATION=f'Bearer {access}'),
+    }
+
+    costs = {}
+    for name, call in endpoints.items():
+        call()  # warm up
+        with CaptureQueriesContext(connection) as queries:
+            call()
+        count = len(queries)  # before the next request resets the query log
+        times = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - started)
+        costs[name] = (statistics.median(times), count)
+    return costs
+
+
+def access_checks():
+    from django.test import Client, override_settings
+
+    checks = {}
+    with override_settings(METRICS={}):
+        checks['/metrics off without token or allowed IPs'] = Client().get('/metrics').status_code == 404
+    with override_settings(METRICS={'TOKEN': 'scrape-token'}):
+        checks['/metrics refuses a wrong token'] = Client().get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code == 401
+        checks['/metrics serves the token'] = Client().get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer scrape-token').status_code == 200
+    with override_settings(METRICS={'ALLOWED_IPS': ['127.0.0.1']}):
+        checks['/metrics serves an allowed IP'] = Client(REMOTE_ADDR='127.0.0.1').get('/metrics').status_code == 200
+        checks['/metrics refuses other IPs'] = Client(REMOTE_ADDR='203.0.113.9').get('/metrics').status_code == 401
+    return checks
+
+
+def measure(requests):
+    middleware_s, query_s = instrumentation_cost(max(10000, requests * 20))
+    results = {'instrumentation': {'per_request_us': round(middleware_s * 1e6, 2),
+                                   'per_query_us': round(query_s * 1e6, 2)}}
+    checks = {}
+    for name, (request_s, queries) in endpoint_costs(requests).items():
+        overhead = middleware_s + queries * query_s
+        pct = 100.0 * overhead / request_s
+        results[name] = {'request_us': round(request_s * 1e6, 1), 'queries': queries,
+                         'overhead_us': round(overhead * 1e6, 2), 'overhead_pct': round(pct, 3)}
+        checks[f'{name} overhead under {LIMIT_PCT}%'] = pct < LIMIT_PCT
+    checks.update(access_checks())
+    return results, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        results, checks = measure(args.requests)
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        for name, values in results.items():
+            print(f"{name:<22} " + '  '.join(f'{k}={v}' for k, v in values.items()))
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
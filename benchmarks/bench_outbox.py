@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+panel_client.Outbox: recording/replay throughput and crash safety
+
+    python -m benchmarks.bench_outbox --events 10000 --users 2000
+
+Against the stand-in panel from bench_panel_client:
+
+* records `events` logout/presence events spread over `users` accounts
+  and checks that only the last state per user is queued,
+* replays while the panel is down (nothing may be sent or lost), then
+  while it is up, timing the replay and checking that at most
+  `concurrency` requests were in flight and that the panel ended up
+  with the last state of every user,
+* SIGKILLs a child process while it records, and checks that every event
+  it reported as recorded survived,
+* SIGKILLs a child process in the middle of a slow replay, and checks
+  that a second replay delivers everything still queued.
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .bench_panel_client import StandInPanel
+
+TOKEN = 'gateway-token'
+
+
+def events(count, users, seed=7):
+    rng = random.Random(seed)
+    for _ in range(count):
+        user_id = f'user{rng.randrange(users)}'
+        yield user_id, rng.choice(('logout', 'online', 'offline'))
+
+
+def record(outbox, user_id, state):
+    if state == 'logout':
+        outbox.record_logout(user_id, 'secret')
+    else:
+        outbox.record_presence(user_id, state)
+
+
+def start_panel():
+    panel = StandInPanel()
+    threading.Thread(target=panel.serve_forever, daemon=True).start()
+    return panel
+
+
+def child_record(path, count):
+    # Prints each event only after record() returned, i.e. after it was committed
+    from panel_client import Outbox
+    outbox = Outbox(path)
+    for user_id, state in events(count, count):
+        record(outbox, user_id, state)
+        print(f'{user_id} {state}', flush=True)
+
+
+def child_replay(path, url):
+    from panel_client import Outbox, PanelClient
+    Outbox(path, batch_size=10, concurrency=2).replay(PanelClient(url), TOKEN)
+
+
+def spawn(*args):
+    return subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_outbox', *args],
+                            stdout=subprocess.PIPE, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def crash_while_recording(workdir):
+    path = os.path.join(workdir, 'crash-record.sqlite3')
+    proc = spawn('--child-record', path, '--events', '100000')
+    acknowledged = {}
+    deadline = time.monotonic() + 0.5
+    while time.monotonic() < deadline:
+        line = proc.stdout.readline()
+        if not line:
+            break
+        user_id, state = line.split()
+        acknowledged[user_id] = state
+    proc.send_signal(signal.SIGKILL)
+    proc.wait()
+
+    from panel_client import Outbox
+    import sqlite3
+    Outbox(path)  # must open cleanly after the crash
+    with sqlite3.connect(path) as db:
+        rows = {user_id: (kind, json.loads(payload)) for user_id, kind, payload in
+                db.execute('SELECT user_id, kind, payload FROM outbox')}
+    survived = all(
+        user_id in rows and (rows[user_id][0] == 'logout' if state == 'logout' else True)
+        for user_id, state in acknowledged.items()
+    )
+    return len(acknowledged), survived
+
+
+def crash_while_replaying(workdir, users):
+    from panel_client import Outbox, PanelClient
+    path = os.path.join(workdir, 'crash-replay.sqlite3')
+    outbox = Outbox(path)
+    expected = {}
+    for user_id, state in events(users, users, seed=11):
+        record(outbox, user_id, state)
+        expected[user_id] = state
+
+    panel = start_panel()
+    panel.delay = 0.02
+    proc = spawn('--child-replay', path, '--url', panel.url)
+    time.sleep(0.3)
+    proc.send_signal(signal.SIGKILL)
+    proc.wait()
+    delivered_before = dict(panel.received)
+    left = outbox.pending()
+
+    panel.delay = 0.0
+    outbox.replay(PanelClient(panel.url), TOKEN)
+    complete = outbox.pending() == 0 and panel.received == expected
+    panel.shutdown()
+    panel.server_close()
+    return len(delivered_before), left, complete
+
+
+def run(count, users, concurrency):
+    from panel_client import Outbox, PanelClient, RetryPolicy
+
+    checks = {}
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='outbox-') as workdir:
+        outbox = Outbox(os.path.join(workdir, 'outbox.sqlite3'), concurrency=concurrency)
+        expected = {}
+        started = time.perf_counter()
+        for user_id, state in events(count, users):
+            record(outbox, user_id, state)
+            expected[user_id] = state
+        elapsed = time.perf_counter() - started
+        results['record'] = {'events': count, 'ms': round(elapsed * 1000, 1),
+                             'events_per_s': round(count / elapsed)}
+        checks['only last state per user queued'] = outbox.pending() == len(expected)
+
+        panel = start_panel()
+        client = PanelClient(panel.url, pool_size=concurrency, retry=RetryPolicy(attempts=1))
+        panel.down = True
+        report = outbox.replay(client, TOKEN)
+        checks['nothing sent while panel down'] = report['sent'] == 0 and not panel.received
+        checks['nothing lost while panel down'] = outbox.pending() == len(expected)
+
+        panel.down = False
+        requests_before = panel.requests
+        started = time.perf_counter()
+        report = outbox.replay(client, TOKEN)
+        elapsed = time.perf_counter() - started
+        results['replay'] = {'users': len(expected), 'ms': round(elapsed * 1000, 1),
+                             'requests': panel.requests - requests_before,
+                             'max_in_flight': panel.max_in_flight}
+        checks['replay delivered last state per user'] = panel.received == expected
+        checks['replay emptied outbox'] = outbox.pending() == 0
+        checks['bounded concurrency'] = panel.max_in_flight <= concurrency
+        client.close()
+        panel.shutdown()
+        panel.server_close()
+
+        acknowledged, survived = crash_while_recording(workdir)
+        results['crash while recording'] = {'acknowledged': acknowledged}
+        checks['recorded events survive SIGKILL'] = acknowledged > 0 and survived
+
+        delivered, left, complete = crash_while_replaying(workdir, 300)
+        results['crash while replaying'] = {'delivered_before_kill': delivered, 'left_queued': left}
+        checks['replay resumes after SIGKILL'] = complete
+    return results, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--child-record', help=argparse.SUPPRESS)
+    parser.add_argument('--child-replay', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_record:
+        return child_record(args.child_record, args.events)
+    if args.child_replay:
+        return child_replay(args.child_replay, args.url)
+
+    results, checks = run(args.events, args.users, args.concurrency)
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        for name, values in results.items():
+            print(f"{name:<24} " + '  '.join(f'{k}={v}' for k, v in values.items()))
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
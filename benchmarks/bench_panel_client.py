@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+panel_client against a local stand-in panel
+
+    python -m benchmarks.bench_panel_client --calls 500
+
+Starts a threaded HTTP/1.1 server on localhost that answers /api/logout/
+like the panel (single and {"users": [...]} batches) and counts the TCP
+connections it accepts. Then:
+
+* times `calls` logouts with a fresh connection per call (what
+  panel_logout.py used to do) and with PanelClient's pool,
+* times the same logouts with AsyncPanelClient, and one logout_many(),
+* checks that 503s are retried, that a refused connection is retried and
+  then trips the circuit breaker, and that an open circuit fails fast.
+
+Nothing here needs Django or a database.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInPanel(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.connections = 0
+        self.requests = 0
+        self.fail_next = 0      # answer this many requests with 503
+        self.down = False       # answer everything with 503
+        self.delay = 0.0        # seconds to hold each request
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.received = {}      # user_id -> last state sent ('logout', 'online', 'offline')
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def handle_error(self, request, client_address):
+        # Clients killed mid-request (bench_outbox crash checks) are expected
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def take_failure(self):
+        with self._lock:
+            self.requests += 1
+            if self.down:
+                return True
+            if self.fail_next:
+                self.fail_next -= 1
+                return True
+            return False
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if self.delay:
+            time.sleep(self.delay)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def receive(self, states):
+        with self._lock:
+            self.received.update(states)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; don't let Nagle hold the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.server.take_failure():
+            self._send(503, {'status': 'error', 'message': 'unavailable'})
+        elif self.path == '/app/api/health/live/':
+            self._send(200, {'status': 'alive'})
+        else:
+            self._send(404, {'status': 'error', 'message': 'not found'})
+
+    def do_POST(self):
+        self.server.enter()
+        try:
+            self._post()
+        finally:
+            self.server.leave()
+
+    def _post(self):
+        data = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        if self.server.take_failure():
+            self._send(503, {'status': 'error', 'message': 'unavailable'})
+        elif self.path == '/api/users/presence/':
+            self.server.receive({item['user_id']: item['status'] for item in data})
+            results = [{'user_id': item['user_id'], 'status': item['status'], 'result': 'ok'} for item in data]
+            self._send(200, {'applied': len(results), 'results': results})
+        elif self.path != '/api/logout/':
+            self._send(404, {'status': 'error', 'message': 'not found'})
+        elif 'users' in data:
+            self.server.receive({item['username']: 'logout' for item in data['users']})
+            results = [{'username': item['username'], 'result': 'ok'} for item in data['users']]
+            self._send(200, {'status': 'success', 'logged_out': len(results), 'results': results})
+        elif data.get('password') == 'wrong':
+            self._send(401, {'status': 'error', 'message': 'Invalid password'})
+        else:
+            self._send(200, {'status': 'success', 'message': f"User {data.get('username')} logged out successfully"})
+
+
+def fresh_connection_logout(server, username):
+    # The old scripts: a new TCP connection for every call
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+    try:
+        conn.request('POST', '/api/logout/', json.dumps({'username': username, 'password': 'x'}),
+                     {'Content-Type': 'application/json', 'Connection': 'close'})
+        return conn.getresponse().read()
+    finally:
+        conn.close()
+
+
+def measure(server, label, run):
+    before = server.connections
+    started = time.perf_counter()
+    run()
+    return {'run': label, 'ms': round((time.perf_counter() - started) * 1000, 1),
+            'connections': server.connections - before}
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def check_policies(server):
+    from panel_client import CircuitBreaker, PanelClient, PanelUnavailable, RetryPolicy
+
+    checks = {}
+    retry = RetryPolicy(attempts=3, backoff=0.01)
+    with PanelClient(server.url, retry=retry) as panel:
+        server.fail_next = 2
+        checks['503 retried'] = panel.logout('u', 'x') is True
+        checks['refused credentials'] = panel.logout('u', 'wrong') is False
+
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    down = PanelClient(f'http://127.0.0.1:{unused_port()}', retry=retry, breaker=breaker)
+    try:
+        down.logout('u', 'x')
+        checks['refused connection raises'] = False
+    except PanelUnavailable:
+        checks['refused connection raises'] = True
+    checks['circuit opened'] = breaker.state == CircuitBreaker.OPEN
+    started = time.perf_counter()
+    try:
+        down.logout('u', 'x')
+    except PanelUnavailable:
+        pass
+    checks['open circuit fails fast'] = time.perf_counter() - started < 0.005
+
+    clock = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=lambda: clock[0])
+    breaker.record_failure()
+    clock[0] = 5.0
+    checks['half-open lets one trial through'] = breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    checks['success closes circuit'] = breaker.state == CircuitBreaker.CLOSED
+    return checks
+
+
+def run(calls):
+    from panel_client import AsyncPanelClient, PanelClient
+
+    server = StandInPanel()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    users = {f'user{i}': 'x' for i in range(calls)}
+    try:
+        results = [measure(server, 'fresh connection per call',
+                           lambda: [fresh_connection_logout(server, u) for u in users])]
+
+        with PanelClient(server.url) as panel:
+            results.append(measure(server, 'PanelClient (pooled)',
+                                   lambda: [panel.logout(u, p) for u, p in users.items()]))
+            results.append(measure(server, 'PanelClient.logout_many', lambda: panel.logout_many(users)))
+
+        async def concurrent_logouts():
+            async with AsyncPanelClient(server.url, pool_size=8) as panel:
+                await asyncio.gather(*(panel.logout(u, p) for u, p in users.items()))
+
+        async def batched_logouts():
+            async with AsyncPanelClient(server.url, pool_size=8) as panel:
+                assert set((await panel.logout_many(users)).values()) == {'ok'}
+
+        results.append(measure(server, 'AsyncPanelClient (8 conns)', lambda: asyncio.run(concurrent_logouts())))
+        results.append(measure(server, 'AsyncPanelClient.logout_many', lambda: asyncio.run(batched_logouts())))
+        checks = check_policies(server)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results, checks = run(args.calls)
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        print(f"{'run':<32} {'ms':>9} {'connections':>12}")
+        for r in results:
+            print(f"{r['run']:<32} {r['ms']:>9} {r['connections']:>12}")
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
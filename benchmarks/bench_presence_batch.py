@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Batch presence endpoint throughput
+
+    python -m benchmarks.bench_presence_batch --users 10000 --repeat 3
+
+Seeds `users` accounts and a staff gateway User, then POSTs one request to
+/api/users/presence/ setting every account online (JSON array) and one
+setting every account offline (NDJSON), `repeat` times each. Reports the
+wall time and DB query count per request; compare with --single, which
+sends the same number of updates through the per-user PUT endpoint
+instead (capped at 1000 requests; it is extrapolated from there).
+"""
+import argparse
+import json
+import os
+import time
+
+SINGLE_CAP = 1000
+
+
+def timed(client, path, body, content_type, **headers):
+    from django.db import connection
+
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    with connection.execute_wrapper(record):
+        response = client.post(path, body, content_type=content_type, **headers)
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response.content[:200]
+    return elapsed, len(queries), response.json()
+
+
+def run(users, repeat, single):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from rest_framework_simplejwt.tokens import AccessToken
+    from users.models import UserAccount
+
+    settings.PRESENCE_HEARTBEAT = {**settings.PRESENCE_HEARTBEAT, 'BACKGROUND': False}
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        user_ids = [f'presence-bench-{i}' for i in range(users)]
+        UserAccount.objects.bulk_create(
+            [UserAccount(user_id=user_id, password='x') for user_id in user_ids], batch_size=1000,
+        )
+        gateway = User.objects.create(username='presence-gateway', is_staff=True)
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(gateway)}'}
+        client = Client()
+
+        online = json.dumps([{'user_id': user_id, 'status': 'online'} for user_id in user_ids])
+        offline = '\n'.join(json.dumps([user_id, 'offline']) for user_id in user_ids)
+        results = {'json online': [], 'ndjson offline': []}
+        for _ in range(repeat):
+            for label, body, content_type in (('json online', online, 'application/json'),
+                                              ('ndjson offline', offline, 'application/x-ndjson')):
+                elapsed, queries, data = timed(client, '/api/users/presence/', body, content_type, **auth)
+                assert data['applied'] == users, data['applied']
+                results[label].append((elapsed, queries))
+
+        summary = {
+            label: {
+                'updates': users,
+                'best_ms': round(min(e for e, _ in runs) * 1000, 1),
+                'queries': runs[-1][1],
+            }
+            for label, runs in results.items()
+        }
+
+        if single:
+            # The per-user endpoint only lets a user update themselves
+            count = min(users, SINGLE_CAP)
+            shadows = User.objects.bulk_create([User(username=user_id) for user_id in user_ids[:count]])
+            started = time.perf_counter()
+            for user in User.objects.filter(username__in=user_ids[:count]):
+                client.put(f'/api/users/{user.id}/presence/', json.dumps({'status': 'online'}),
+                           content_type='application/json',
+                           HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+            elapsed = (time.perf_counter() - started) * users / count
+            summary['single PUTs'] = {'updates': users, 'best_ms': round(elapsed * 1000, 1),
+                                      'queries': None, 'extrapolated_from': len(shadows)}
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--single', action='store_true', help='also time the per-user PUT endpoint')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.users, args.repeat, args.single)
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(f"{'request':<16} {'updates':>8} {'best ms':>9} {'queries':>8}")
+    for label, r in results.items():
+        queries = '-' if r['queries'] is None else r['queries']
+        print(f"{label:<16} {r['updates']:>8} {r['best_ms']:>9} {queries:>8}")
+
+
+if __name__ == '__main__':
+    main()
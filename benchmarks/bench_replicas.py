@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Read replica routing and read-your-writes stickiness
+
+    python -m benchmarks.bench_replicas
+
+Uses two SQLite files standing in for a primary and a replica: the
+primary is migrated and seeded, then copied to the replica, which from
+then on never sees another write (a replica that stopped replicating is
+the worst case of lag). With DATABASE_REPLICA_URLS pointing at the copy
+and STICKY_SECONDS=1, it drives the app with the test client and counts
+the queries each database runs, then checks that:
+
+* api_status, the dashboard, api_me, the admin changelists and exports
+  read their rows from the replica,
+* logins and logouts write to the primary only,
+* right after a login the same client (pin cookie) and a cookie-less JWT
+  client (user pin) read from the primary and see the login, and once the
+  window has passed they read from the replica again,
+* a request that wrote reads its own writes from the primary,
+* migrations are never applied to the replica.
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+PASSWORD = 'replica-password'
+STICKY_SECONDS = 1
+
+
+def configure(directory):
+    primary = os.path.join(directory, 'primary.sqlite3')
+    replica = os.path.join(directory, 'replica.sqlite3')
+    os.environ.update({
+        'DJANGO_SETTINGS_MODULE': 'internet_art_tools.settings',
+        'DATABASE_URL': f'sqlite:///{primary}',
+        'DATABASE_REPLICA_URLS': f'sqlite:///{replica}',
+        'DATABASE_REPLICA_STICKY_SECONDS': str(STICKY_SECONDS),
+        'LOGIN_THROTTLE_ENABLED': 'False',
+        'SESSION_AUDIT_MODE': 'sync',
+    })
+    return primary, replica
+
+
+def seed():
+    from django.contrib.auth.models import User
+    from main_app.models import UserSession
+    from users.backends import shadow_user
+    from users.models import UserAccount
+    from users.passwords import hash_password
+
+    hashed = hash_password(PASSWORD)
+    accounts = UserAccount.objects.bulk_create([UserAccount(user_id=user_id, password=hashed)
+                                                for user_id in ('web', 'api', 'jwt', 'rw')])
+    UserSession.objects.bulk_create([UserSession(user_account=account, ip_address='10.0.0.1')
+                                     for account in accounts])
+    shadow_user('jwt')
+    User.objects.create_superuser('replica-admin', 'replica@example.com', PASSWORD)
+    UserAccount.objects.create(user_id='replica-admin', password=hashed)
+
+
+class Counter:
+    """Queries per database while active"""
+
+    def __init__(self):
+        from django.db import connections
+        from django.test.utils import CaptureQueriesContext
+        self.contexts = {alias: CaptureQueriesContext(connections[alias]) for alias in ('default', 'replica1')}
+
+    def __enter__(self):
+        for context in self.contexts.values():
+            context.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        for context in self.contexts.values():
+            context.__exit__(*exc)
+
+    def tables(self, alias):
+        return ' '.join(query['sql'] for query in self.contexts[alias].captured_queries)
+
+    def writes(self, alias):
+        return [query['sql'] for query in self.contexts[alias].captured_queries
+                if query['sql'].lstrip().split()[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+
+    def counts(self):
+        return {alias: len(context) for alias, context in self.contexts.items()}
+
+
+def on(counter, alias, table):
+    return f'"{table}"' in counter.tables(alias)
+
+
+def run():
+    from django.contrib.auth.models import User
+    from django.db import router
+    from django.test import Client
+    from internet_art_tools import replicas
+    from main_app import exports
+    from users.models import UserAccount
+
+    checks, results = {}, {}
+
+    def measured(name, call):
+        with Counter() as counter:
+            response = call()
+        results[name] = counter.counts()
+        return response, counter
+
+    # A session that logged in before the replica was copied: no pins left
+    web = Client()
+    web.post('/app/api/login/', json.dumps({'username': 'web', 'password': PASSWORD}),
+             content_type='application/json')
+    time.sleep(STICKY_SECONDS + 0.2)
+    web.cookies.pop(replicas.setting('COOKIE'), None)
+    response, counter = measured('status (settled)', lambda: web.get('/app/api/status/'))
+    checks['api_status reads the account from the replica'] = (
+        response.json()['success'] and on(counter, 'replica1', 'users_useraccount')
+        and not on(counter, 'default', 'users_useraccount'))
+
+    # Login (writes) then status right away: pinned to the primary
+    api = Client()
+    body = json.dumps({'username': 'api', 'password': PASSWORD})
+    response, login = measured('login', lambda: api.post('/app/api/login/', body, content_type='application/json'))
+    cookie = api.cookies.get(replicas.setting('COOKIE'))
+    checks['login writes to the primary only'] = (response.status_code == 200 and bool(login.writes('default'))
+                                                 and not login.writes('replica1'))
+    checks['login response sets the pin cookie'] = cookie is not None and int(cookie['max-age']) == STICKY_SECONDS
+    response, counter = measured('status (just logged in)', lambda: api.get('/app/api/status/'))
+    checks['status right after login reads the primary'] = (response.json()['success']
+                                                           and not on(counter, 'replica1', 'users_useraccount'))
+    response, counter = measured('dashboard (settled)', lambda: web.get('/app/dashboard/'))
+    checks['dashboard reads account and session from the replica'] = (
+        response.status_code == 200 and on(counter, 'replica1', 'users_useraccount')
+        and on(counter, 'replica1', 'main_app_usersession'))
+
+    # JWT clients keep no cookies: the user pin set at login covers them
+    jwt = Client()
+    body = json.dumps({'username': 'jwt', 'password': PASSWORD})
+    token = jwt.post('/api/token/', body, content_type='application/json').json()['access']
+    jwt.cookies.clear()
+    auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+    fresh, counter = measured('me (just logged in)', lambda: jwt.get('/api/me/', **auth))
+    checks['api_me right after login sees the login (primary)'] = (fresh.json()['is_logged_in'] is True
+                                                                  and not on(counter, 'replica1', 'users_useraccount'))
+    time.sleep(STICKY_SECONDS + 0.2)
+    stale, counter = measured('me (after window)', lambda: jwt.get('/api/me/', **auth))
+    # The replica stopped at the copy, before this login
+    checks['api_me after the window reads the replica'] = (stale.json()['is_logged_in'] is False
+                                                          and on(counter, 'replica1', 'users_useraccount'))
+
+    # Read-your-writes inside one request
+    with Counter() as counter, replicas.reading():
+        before = UserAccount.objects.get(user_id='rw').status
+        UserAccount.objects.filter(user_id='rw').update(status=False)
+        after = UserAccount.objects.get(user_id='rw').status
+    checks['reads after a write in the same request use the primary'] = (
+        before is True and after is False and len(counter.contexts['replica1']) == 1)
+    UserAccount.objects.filter(user_id='rw').update(status=True)
+
+    # Staff pages and exports
+    staff = Client()
+    staff.force_login(User.objects.get(username='replica-admin'),
+                      backend='django.contrib.auth.backends.ModelBackend')
+    # SessionManagementMiddleware logs out users without an account holding this session
+    UserAccount.objects.filter(user_id='replica-admin').update(is_logged_in=True,
+                                                               current_session=staff.session.session_key)
+    pages_ok = True
+    for page, table in (('/admin/users/useraccount/', 'users_useraccount'),
+                        ('/admin/main_app/usersession/', 'main_app_usersession')):
+        response, counter = measured(page, lambda: staff.get(page))
+        # (the session check in SessionManagementMiddleware still reads the staff account from the primary)
+        pages_ok &= response.status_code == 200 and on(counter, 'replica1', table)
+    checks['admin changelists read from the replica'] = pages_ok
+    with Counter() as counter:
+        response = staff.get('/app/api/export/sessions/')
+        content = b''.join(response.streaming_content)
+    results['export'] = counter.counts()
+    checks['exports read from the replica'] = (response.status_code == 200 and content.count(b'\n') == 5
+                                               and on(counter, 'replica1', 'main_app_usersession'))
+    checks['read_alias outside requests is the replica'] = (replicas.read_alias() == 'replica1'
+                                                               and exports.rows('accounts').db == 'default'
+                                                               and exports.rows('accounts', using='replica1').db
+                                                               == 'replica1')
+
+    # Logout: a write, on the primary
+    response, logout = measured('logout', lambda: api.post('/app/api/logout/'))
+    checks['logout writes to the primary only'] = bool(logout.writes('default')) and not logout.writes('replica1')
+
+    checks['no migrations on the replica'] = (router.allow_migrate_model('replica1', UserAccount) is False
+                                              and router.allow_migrate_model('default', UserAccount) is True)
+    return results, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-replicas-')
+    primary, replica = configure(directory)
+    try:
+        import django
+        django.setup()
+        from django.core.management import call_command
+        from django.db import connections
+
+        call_command('migrate', verbosity=0)
+        seed()
+        connections.close_all()
+        shutil.copyfile(primary, replica)
+        results, checks = run()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        for name, values in results.items():
+            print(f"{name:<28} " + '  '.join(f'{k}={v}' for k, v in values.items()))
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Session rollups: backfill cost, incremental updates and read paths
+
+    python -m benchmarks.bench_rollups --days 30 --sessions 50000
+
+Against a throwaway test database, seeds `sessions` UserSession rows over
+the last `days` days, backfills SessionRollup with 1 and with `workers`
+threads (SQLite always backfills one day at a time), and prints the time
+and the peak Python memory of each (under tracemalloc, so times run
+high), and the time of the analytics API against the rollups vs the same
+numbers aggregated from UserSession. Then checks that:
+
+* every hourly and daily rollup matches the sessions counted in Python,
+* backfill memory stays flat when the history doubles,
+* after new logins and logouts of older sessions, update() recomputes
+  only the days they touch and the rollups match again,
+* the analytics API and the admin changelist don't query UserSession.
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import json
+import os
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import timedelta
+
+
+def seed(days, sessions, users, now, rng):
+    from django.utils import timezone
+    from main_app.models import UserSession
+    from users.models import UserAccount
+
+    existing = UserAccount.objects.count()
+    UserAccount.objects.bulk_create(
+        [UserAccount(user_id=f'roll{n}', password='x') for n in range(existing, users)])
+    accounts = list(UserAccount.objects.values_list('pk', flat=True))
+    first = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    span = int((now - first).total_seconds()) - 3600
+    rows = []
+    for _ in range(sessions):
+        start = first + timedelta(seconds=rng.randrange(span))
+        # One in five sessions is still open
+        end = start + timedelta(seconds=rng.randrange(60, 4 * 3600)) if rng.random() < 0.8 else None
+        if end is not None and end > now:
+            end = None
+        rows.append(UserSession(user_account_id=rng.choice(accounts), session_start=start, session_end=end,
+                                ip_address=f'10.{rng.randrange(4)}.{rng.randrange(250)}.{rng.randrange(1, 250)}'))
+    UserSession.objects.bulk_create(rows, batch_size=2000)
+    return first
+
+
+def expected():
+    """Rollups computed in Python from every UserSession row"""
+    from django.utils import timezone
+    from main_app.models import SessionRollup, UserSession
+
+    buckets = defaultdict(lambda: {'logins': 0, 'users': set(), 'ips': set(), 'completed': 0, 'duration': 0})
+    for account, start, end, ip in UserSession.objects.values_list(
+            'user_account_id', 'session_start', 'session_end', 'ip_address').iterator():
+        local = timezone.localtime(start)
+        hour = local.replace(minute=0, second=0, microsecond=0)
+        for key in ((SessionRollup.HOUR, hour), (SessionRollup.DAY, hour.replace(hour=0))):
+            bucket = buckets[key]
+            bucket['logins'] += 1
+            bucket['users'].add(account)
+            bucket['ips'].add(ip)
+            if end is not None:
+                bucket['completed'] += 1
+                bucket['duration'] += int((end - start).total_seconds())
+    return {key: (b['logins'], len(b['users']), len(b['ips']), b['completed'], b['duration'])
+            for key, b in buckets.items()}
+
+
+def stored():
+    from main_app.models import SessionRollup
+    return {(period, start): rest for period, start, *rest in SessionRollup.objects.values_list(
+        'period', 'start', 'logins', 'unique_users', 'distinct_ips', 'completed_sessions', 'total_duration')}
+
+
+def matches():
+    return {key: tuple(values) for key, values in stored().items()} == expected()
+
+
+def timed_backfill(since, workers, now):
+    from main_app import rollups
+    from main_app.models import SessionRollup
+
+    SessionRollup.objects.all().delete()
+    tracemalloc.start()
+    started = time.perf_counter()
+    days = rollups.backfill(since, workers=workers, now=now)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'days': days, 'workers': workers, 's': round(elapsed, 2), 'peak_kb': round(peak / 1024)}
+
+
+class TableWatch:
+    """DB execute_wrapper recording whether any query touched main_app_usersession"""
+
+    def __init__(self):
+        self.queries = 0
+        self.touched = False
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        self.touched = self.touched or 'main_app_usersession' in sql
+        return execute(sql, params, many, context)
+
+
+def read_paths(first, now):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.db.models import Count
+    from django.db.models.functions import TruncHour
+    from django.test import Client
+    from django.utils import timezone
+    from main_app.models import UserSession
+    from users.models import UserAccount
+
+    staff = User.objects.create_superuser('rollup-admin', 'rollup@example.com', 'x')
+    client = Client()
+    client.force_login(staff, backend='django.contrib.auth.backends.ModelBackend')
+    # SessionManagementMiddleware logs out users without an account holding this session
+    UserAccount.objects.create(user_id=staff.username, password='x', is_logged_in=True,
+                               current_session=client.session.session_key)
+    url = f'/app/api/analytics/sessions/?period=hour&since={first.isoformat()}&until={now.isoformat()}'
+    url = url.replace('+', '%2B')
+
+    # Warm up; this also installs MetricsMiddleware's own DB wrapper for good
+    client.get(url)
+    api = TableWatch()
+    with connection.execute_wrapper(api):
+        started = time.perf_counter()
+        response = client.get(url)
+        api_ms = (time.perf_counter() - started) * 1000
+    buckets = response.json().get('buckets', [])
+
+    started = time.perf_counter()
+    list(UserSession.objects.filter(session_start__gte=first, session_start__lt=now)
+         .annotate(bucket=TruncHour('session_start', tzinfo=timezone.get_default_timezone()))
+         .values('bucket').annotate(logins=Count('pk'), users=Count('user_account', distinct=True),
+                                    ips=Count('ip_address', distinct=True)).order_by('bucket'))
+    scan_ms = (time.perf_counter() - started) * 1000
+
+    admin = TableWatch()
+    with connection.execute_wrapper(admin):
+        changelist = client.get('/admin/main_app/sessionrollup/?period__exact=hour')
+    denied = Client().get(url).status_code
+
+    result = {'api_ms': round(api_ms, 1), 'api_queries': api.queries, 'buckets': len(buckets),
+              'usersession_scan_ms': round(scan_ms, 1), 'admin_queries': admin.queries}
+    ok = (response.status_code == 200 and buckets and not api.touched
+          and changelist.status_code == 200 and not admin.touched and denied == 403)
+    return result, ok
+
+
+def incremental(now, rng):
+    from django.utils import timezone
+    from main_app import rollups
+    from main_app.models import UserSession
+
+    later = now + timedelta(hours=2)
+    # New logins after the marks, and logouts of sessions that started days ago
+    accounts = list(UserSession.objects.values_list('user_account_id', flat=True)[:50])
+    new = [UserSession(user_account_id=account, session_start=now + timedelta(minutes=10 + index),
+                       ip_address='10.200.0.1') for index, account in enumerate(accounts)]
+    UserSession.objects.bulk_create(new)
+    open_rows = list(UserSession.objects.filter(session_end__isnull=True, session_start__lt=now - timedelta(days=3))
+                     .order_by('?')[:20])
+    for session in open_rows:
+        session.session_end = now + timedelta(minutes=30)
+    UserSession.objects.bulk_update(open_rows, ['session_end'])
+    touched = {timezone.localtime(session.session_start).date() for session in open_rows + new}
+
+    started = time.perf_counter()
+    days = rollups.update(now=later)
+    elapsed = time.perf_counter() - started
+    again = rollups.update(now=later)
+    result = {'days_recomputed': len(days), 'days_touched': len(touched), 'ms': round(elapsed * 1000, 1)}
+    return result, set(days) == touched and not again and matches()
+
+
+def run(days, sessions, users, workers):
+    from django.test import override_settings
+    from django.utils import timezone
+
+    rng = random.Random(7)
+    now = timezone.now().replace(microsecond=0)
+    results = {}
+    checks = {}
+    with override_settings(SESSION_RETENTION={'DAYS': days * 3}):
+        first = seed(days, sessions, users, now, rng)
+        since = timezone.localtime(first).date()
+        results['backfill 1'] = timed_backfill(since, 1, now)
+        results[f'backfill {workers}'] = timed_backfill(since, workers, now)
+        checks['rollups match the sessions'] = matches()
+
+        seed(days, sessions, users, now, rng)
+        results['backfill 2x rows'] = timed_backfill(since, workers, now)
+        checks['backfill memory independent of history'] = (
+            results['backfill 2x rows']['peak_kb'] < results[f'backfill {workers}']['peak_kb'] * 1.5 + 256)
+
+        results['incremental'], checks['update recomputes only touched days'] = incremental(now, rng)
+        results['read'], checks['api and admin read only rollups'] = read_paths(first, now)
+    return results, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--sessions', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        results, checks = run(args.days, args.sessions, args.users, args.workers)
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        for name, values in results.items():
+            print(f"{name:<18} " + '  '.join(f'{k}={v}' for k, v in values.items()))
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Request-path cost of the UserSession audit trail, sync vs write-behind
+
+    python -m benchmarks.bench_session_audit --logins 5000
+
+Against a throwaway test database, records `logins` session starts and
+their ends through main_app.audit in 'sync' mode (one INSERT and one
+UPDATE on the request path, as before) and in 'buffered' mode, and prints
+the time and queries each event costs the request, plus what the flush
+costs. Then checks that:
+
+* the buffered rows match what sync mode writes (start, end, IP, agent),
+* an end for a session written by an earlier flush closes the newest
+  open session of the account,
+* a flush that fails keeps its events and the next one writes them,
+* a worker that exits normally flushes what it buffered (child process
+  against a temporary SQLite database).
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+AGENT = 'AI Mailer Pro/audit-bench'
+
+
+def events(accounts, logins):
+    for index in range(logins):
+        account_pk, user_id = accounts[index % len(accounts)]
+        yield account_pk, user_id, f'10.0.{index // 250 % 250}.{index % 250 + 1}'
+
+
+class QueryCounter:
+    """DB execute_wrapper that only counts (CaptureQueriesContext caps its log)"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def record(audit, accounts, logins, base):
+    from django.db import connection
+
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        started = time.perf_counter()
+        for offset, (account_pk, user_id, ip) in enumerate(events(accounts, logins)):
+            when = base + timedelta(seconds=offset)
+            audit.session_started(account_pk, user_id, ip, AGENT, when=when)
+            audit.session_ended(user_id, when=when + timedelta(milliseconds=500))
+        elapsed = time.perf_counter() - started
+    return elapsed, counter.count
+
+
+def snapshot(base):
+    from main_app.models import UserSession
+    return sorted(UserSession.objects.filter(session_start__gte=base).values_list(
+        'user_account_id', 'session_start', 'session_end', 'ip_address', 'user_agent'))
+
+
+def run(logins, users):
+    from django.db import connection
+    from django.test import override_settings
+    from django.utils import timezone
+    from main_app import audit
+    from main_app.models import UserSession
+    from users.models import UserAccount
+
+    UserAccount.objects.bulk_create([UserAccount(user_id=f'audit{n}', password='x') for n in range(users)])
+    accounts = list(UserAccount.objects.values_list('pk', 'user_id'))
+    results = {}
+    checks = {}
+    events_count = logins * 2
+
+    sync_base = timezone.now().replace(microsecond=0) - timedelta(days=30)
+    with override_settings(SESSION_AUDIT={'MODE': 'sync'}):
+        elapsed, queries = record(audit, accounts, logins, sync_base)
+    results['sync'] = {'events': events_count, 'us_per_event': round(elapsed / events_count * 1e6, 1),
+                       'request_queries': queries}
+    sync_rows = snapshot(sync_base)
+    UserSession.objects.all().delete()
+
+    buffered_base = sync_base
+    with override_settings(SESSION_AUDIT={'MODE': 'buffered', 'BACKGROUND': False, 'FLUSH_SIZE': events_count + 1}):
+        elapsed, queries = record(audit, accounts, logins, buffered_base)
+        flush_queries = QueryCounter()
+        with connection.execute_wrapper(flush_queries):
+            started = time.perf_counter()
+            written = audit.flush()
+            flush_elapsed = time.perf_counter() - started
+    results['buffered'] = {'events': events_count, 'us_per_event': round(elapsed / events_count * 1e6, 1),
+                           'request_queries': queries}
+    results['flush'] = {'rows': written, 'ms': round(flush_elapsed * 1000, 1), 'queries': flush_queries.count}
+    checks['buffered requests run no query'] = queries == 0
+    checks['buffered rows match sync rows'] = snapshot(buffered_base) == sync_rows
+
+    with override_settings(SESSION_AUDIT={'MODE': 'buffered', 'BACKGROUND': False}):
+        # Two open sessions on record; a later logout closes the newer one
+        account_pk, user_id = accounts[0]
+        older, newer = sync_base + timedelta(days=1), sync_base + timedelta(days=2)
+        for when in (older, newer):
+            audit.session_started(account_pk, user_id, '10.9.9.9', AGENT, when=when)
+        audit.flush()
+        audit.session_ended(user_id, when=newer + timedelta(hours=1))
+        audit.flush()
+        ends = dict(UserSession.objects.filter(user_account_id=account_pk, session_start__in=(older, newer))
+                    .values_list('session_start', 'session_end'))
+        checks['end closes newest open session'] = ends == {older: None, newer: newer + timedelta(hours=1)}
+
+        # A flush whose INSERT fails keeps the events for the next one
+        def refuse_inserts(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith('INSERT'):
+                raise RuntimeError('database unavailable')
+            return execute(sql, params, many, context)
+
+        failed_base = sync_base + timedelta(days=3)
+        audit.session_started(account_pk, user_id, '10.9.9.10', AGENT, when=failed_base)
+        try:
+            with connection.execute_wrapper(refuse_inserts):
+                audit.flush()
+            failed = False
+        except RuntimeError:
+            failed = True
+        kept = audit.pending()
+        audit.session_ended(user_id, when=failed_base + timedelta(minutes=5))
+        audit.flush()
+        row = UserSession.objects.filter(user_account_id=account_pk, session_start=failed_base).values_list(
+            'session_end', flat=True)
+        checks['failed flush keeps its events'] = failed and kept == 1 and list(row) == [failed_base + timedelta(minutes=5)]
+
+    checks['worker exit flushes the buffer'] = exit_flushes()
+    return results, checks
+
+
+def child(count):
+    from main_app import audit
+    from users.models import UserAccount
+    account = UserAccount.objects.create(user_id='exit-flush', password='x')
+    for index in range(count):
+        audit.session_started(account.pk, account.user_id, '10.8.0.1', AGENT)
+    # No explicit flush: the atexit hook must write them
+
+
+def exit_flushes(count=25):
+    from .servers import bench_env, manage
+    workdir = tempfile.mkdtemp(prefix='audit-')
+    env = bench_env('sqlite:///' + os.path.join(workdir, 'audit.sqlite3'), SESSION_AUDIT_FLUSH_INTERVAL=3600)
+    manage(env, 'migrate', '--noinput')
+    subprocess.run([sys.executable, '-m', 'benchmarks.bench_session_audit', '--child', str(count)],
+                   env=env, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import sqlite3
+    with sqlite3.connect(os.path.join(workdir, 'audit.sqlite3')) as db:
+        return db.execute('SELECT COUNT(*) FROM main_app_usersession').fetchone()[0] == count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    if args.child:
+        return child(args.child)
+
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        results, checks = run(args.logins, args.users)
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        for name, values in results.items():
+            print(f"{name:<10} " + '  '.join(f'{k}={v}' for k, v in values.items()))
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
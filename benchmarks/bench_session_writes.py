@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Session-table writes per request, by session engine
+
+    python -m benchmarks.bench_session_writes --polls 500
+
+Logs in through the JSON API and polls /app/api/status/ `polls` times with
+each session engine, counting INSERT/UPDATE/DELETE statements against
+django_session (and all queries) with a DB execute_wrapper. Compares
+Django's db and cached_db engines with users.session_store, which only
+writes when the data changed or the expiry is SESSION_REFRESH_THRESHOLD
+stale.
+"""
+import argparse
+import json
+import os
+import time
+
+ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+    'users.session_store',
+)
+
+PASSWORD = 'session-bench-password'
+
+
+def is_session_write(sql):
+    head = sql.lstrip().split(None, 1)[0].upper()
+    return head in ('INSERT', 'UPDATE', 'DELETE') and 'django_session' in sql
+
+
+def measure(engine, user_id, polls):
+    from django.db import connection
+    from django.test import Client, override_settings
+
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    body = json.dumps({'username': user_id, 'password': PASSWORD})
+    with override_settings(SESSION_ENGINE=engine):
+        # A fresh Client so SessionMiddleware picks up the engine
+        client = Client()
+        client.post('/app/api/login/', body, content_type='application/json')
+        started = time.perf_counter()
+        with connection.execute_wrapper(record):
+            for _ in range(polls):
+                client.get('/app/api/status/')
+        elapsed = time.perf_counter() - started
+        client.post('/app/api/logout/')
+
+    writes = sum(1 for sql in queries if is_session_write(sql))
+    return {
+        'polls': polls,
+        'session_writes': writes,
+        'queries': len(queries),
+        'us_per_poll': round(elapsed / polls * 1e6, 1),
+    }
+
+
+def run(polls):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from users.models import UserAccount
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        results = {}
+        for i, engine in enumerate(ENGINES):
+            user_id = f'session-bench-{i}'
+            UserAccount.objects.create(user_id=user_id, password=PASSWORD)
+            results[engine] = measure(engine, user_id, polls)
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--polls', type=int, default=500)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.polls)
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(f"{'engine':<44} {'session writes':>15} {'queries':>8} {'us/poll':>9}")
+    for engine, r in results.items():
+        print(f"{engine:<44} {r['session_writes']:>15} {r['queries']:>8} {r['us_per_poll']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Cost of a throttled login, and the limits LoginThrottleMiddleware enforces
+
+    python -m benchmarks.bench_throttle --requests 5000
+
+Against a throwaway test database and the configured cache:
+
+* times Throttle.check() on its own and a full rejected request through
+  Django's test client (every middleware, 429 included), and compares the
+  latter with an unthrottled login that gets as far as the password check,
+* checks that a rejected request runs no DB query and loads no session,
+* checks that a burst is cut off at the configured limit per username and
+  per IP, that the two buckets are independent, and that a bucket lets
+  requests through again once its period has slid by.
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+PASSWORD = 'throttle-password'
+LIMITS = {'/app/api/login/': {'methods': ('POST',), 'ip': '50/m', 'user': '5/m', 'json': True}}
+
+
+def per_request_us(call, count):
+    started = time.perf_counter()
+    for index in range(count):
+        call(index)
+    return round((time.perf_counter() - started) / count * 1e6, 1)
+
+
+def run(count):
+    from django.core.cache import caches
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import CaptureQueriesContext
+    from users import throttle
+    from users.models import UserAccount
+    from users.passwords import hash_password
+
+    UserAccount.objects.create(user_id='victim', password=hash_password(PASSWORD))
+    cache = caches['default']
+    results = {}
+    checks = {}
+
+    def body(username, password='wrong-password'):
+        return json.dumps({'username': username, 'password': password})
+
+    with override_settings(LOGIN_THROTTLE={'ENDPOINTS': LIMITS, 'KEY_PREFIX': 'bench-throttle:'}):
+        client = Client(REMOTE_ADDR='203.0.113.7')
+
+        # Burst against one username: the user bucket runs dry after 5
+        codes = [client.post('/app/api/login/', body('victim'), content_type='application/json').status_code
+                 for _ in range(20)]
+        checks['user bucket allows exactly its limit'] = codes[:5] == [401] * 5 and set(codes[5:]) == {429}
+
+        # Same address, other usernames: still limited by the IP bucket (50,
+        # of which the burst above already used 5)
+        codes = [client.post('/app/api/login/', body(f'spray{n}'), content_type='application/json').status_code
+                 for n in range(60)]
+        checks['ip bucket caps username spraying'] = codes.count(429) == 15 and 429 not in codes[:45]
+
+        # A locked username stays locked from every address
+        other = Client(REMOTE_ADDR='198.51.100.9')
+        response = other.post('/app/api/login/', body('victim'), content_type='application/json')
+        checks['user bucket shared across addresses'] = response.status_code == 429
+        checks['429 carries Retry-After'] = int(response.get('Retry-After', 0)) >= 1
+        response = other.post('/app/api/login/', body('someone-else'), content_type='application/json')
+        checks['other address, other user unaffected'] = response.status_code == 401
+
+        # Rejections never reach the session or the database
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/app/api/login/', body('victim'), content_type='application/json')
+        checks['rejected request runs no query'] = response.status_code == 429 and len(queries) == 0
+        checks['rejected request sets no session'] = 'sessionid' not in response.cookies
+
+        rejected_us = per_request_us(
+            lambda _: client.post('/app/api/login/', body('victim'), content_type='application/json'), count)
+        with override_settings(LOGIN_THROTTLE={'ENABLED': False}):
+            victim = Client(REMOTE_ADDR='192.0.2.1')
+            password_us = per_request_us(
+                lambda _: victim.post('/app/api/login/', body('victim'), content_type='application/json'),
+                max(1, count // 1000))
+
+    # The limiter itself, on an exhausted bucket and on a fresh one
+    limiter = throttle.Throttle(LIMITS, cache, 'bench-throttle-core:')
+    _, buckets, _ = limiter.endpoints['/app/api/login/']
+    for _ in range(10):
+        limiter.check(buckets, {'ip': '203.0.113.50', 'user': 'locked'})
+    check_rejected_us = per_request_us(
+        lambda _: limiter.check(buckets, {'ip': '203.0.113.50', 'user': 'locked'}), count)
+    check_allowed_us = per_request_us(
+        lambda n: limiter.check(buckets, {'ip': f'10.2.{n // 250}.{n % 250}', 'user': f'u{n}'}), count)
+
+    # A bucket refills as the period slides: half a period after the last
+    # full window, half the previous window still counts
+    bucket = throttle.Bucket('slide', 4, 60)
+    core = throttle.Throttle({}, cache, 'bench-throttle-slide:')
+    start = (int(time.time() // 60) + 1000) * 60.0  # aligned to a window nobody has used
+    allowed = [core.check({'user': bucket}, {'user': 'u'}, now=start + 1) is None for _ in range(6)]
+    later = [core.check({'user': bucket}, {'user': 'u'}, now=start + 90) is None for _ in range(4)]
+    checks['bucket refills as the period slides'] = allowed == [True] * 4 + [False] * 2 and later == [True, True, False, False]
+
+    results['Throttle.check'] = {'rejected_us': check_rejected_us, 'allowed_us': check_allowed_us}
+    results['POST /app/api/login/'] = {'rejected_us': rejected_us, 'wrong_password_us': password_us}
+    checks['rejection far cheaper than a password check'] = rejected_us * 10 < password_us
+    return results, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    logging.disable(logging.WARNING)  # one line per refused login otherwise
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        results, checks = run(args.requests)
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    if args.json:
+        print(json.dumps({'results': results, 'checks': checks}))
+    else:
+        for name, values in results.items():
+            print(f"{name:<24} " + '  '.join(f'{k}={v}' for k, v in values.items()))
+        print()
+        for name, ok in checks.items():
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Minimal asyncio HTTP/1.1 load generator (stdlib only)
+
+Each virtual client keeps its own connection open while the server allows
+keep-alive and reconnects when it doesn't (gunicorn sync workers close after
+every response), so the numbers reflect the server, not the client.
+"""
+import asyncio
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, errors, elapsed):
+    latencies = sorted(latencies)
+    total = len(latencies)
+    return {
+        'requests': total,
+        'errors': errors,
+        'statuses': dict(statuses),
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(total / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+class HttpConnection:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=b''):
+        """Send one request, returns (status, headers, body)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                 f'Content-Length: {len(body)}']
+        for name, value in (headers or {}).items():
+            lines.append(f'{name}: {value}')
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        status = int(status_line.split()[1])
+
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers.setdefault(name.strip().lower(), []).append(value.strip())
+
+        if 'content-length' in response_headers:
+            payload = await self.reader.readexactly(int(response_headers['content-length'][0]))
+        else:
+            payload = await self.reader.read()
+
+        connection = response_headers.get('connection', [''])[0].lower()
+        if connection == 'close' or 'content-length' not in response_headers:
+            await self.close()
+        return status, response_headers, payload
+
+
+async def run_load(url, method='GET', headers=None, body=b'', concurrency=50, duration=10.0):
+    """
+    Drive url with `concurrency` clients for `duration` seconds.
+    Returns the summary dict from summarize().
+    """
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    port = parts.port or 80
+
+    latencies = []
+    statuses = Counter()
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        conn = HttpConnection(parts.hostname, port)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status, _, _ = await conn.request(method, path, headers, body)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                errors += 1
+                await conn.close()
+                await asyncio.sleep(0.01)
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+        await conn.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, statuses, errors, time.perf_counter() - started)
+
+
+class FlowClient:
+    """
+    One virtual user for run_flow: keeps a connection and a cookie jar and
+    records the latency of every request under the step name it was given.
+    """
+
+    def __init__(self, host, port, record):
+        self.conn = HttpConnection(host, port)
+        self.cookies = {}
+        self._record = record
+
+    async def request(self, step, method, path, headers=None, body=b''):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        started = time.perf_counter()
+        try:
+            status, response_headers, payload = await self.conn.request(method, path, headers, body)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            await self.conn.close()
+            self._record(step, None, None)
+            raise
+        self._record(step, time.perf_counter() - started, status)
+        for value in response_headers.get('set-cookie', []):
+            name, _, rest = value.partition('=')
+            cookie_value = rest.split(';', 1)[0]
+            if cookie_value and 'max-age=0' not in value.lower():
+                self.cookies[name.strip()] = cookie_value
+            else:
+                self.cookies.pop(name.strip(), None)
+        return status, response_headers, payload
+
+
+async def run_flow(base_url, flow, concurrency=50, duration=10.0):
+    """
+    Run `flow(client, index)` in a loop on `concurrency` FlowClients for
+    `duration` seconds. Returns {step: summary} for every step name used.
+    """
+    parts = urlsplit(base_url)
+    port = parts.port or 80
+    latencies = {}
+    statuses = {}
+    errors = Counter()
+    deadline = time.perf_counter() + duration
+
+    def record(step, latency, status):
+        if latency is None:
+            errors[step] += 1
+            return
+        latencies.setdefault(step, []).append(latency)
+        statuses.setdefault(step, Counter())[status] += 1
+
+    async def client(index):
+        user = FlowClient(parts.hostname, port, record)
+        while time.perf_counter() < deadline:
+            try:
+                await flow(user, index)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                await asyncio.sleep(0.01)
+        await user.conn.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    steps = set(latencies) | set(errors)
+    return {
+        step: summarize(latencies.get(step, []), statuses.get(step, {}), errors[step], elapsed)
+        for step in sorted(steps)
+    }
+
+
+def fetch(url, method='GET', headers=None, body=b''):
+    """One-off request helper for setup steps (login, seeding)"""
+    parts = urlsplit(url)
+
+    async def once():
+        conn = HttpConnection(parts.hostname, parts.port or 80)
+        try:
+            path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+            return await conn.request(method, path, headers, body)
+        finally:
+            await conn.close()
+
+    return asyncio.run(once())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Per-endpoint DB query budgets
+
+    python -m benchmarks.query_budgets [--json]
+
+Runs each endpoint once in steady state against a throwaway test database
+with Django's test client, counts queries with CaptureQueriesContext and
+exits non-zero if any endpoint goes over its budget. Lower a budget whenever
+an optimization lands so it can't silently regress.
+"""
+import argparse
+import json
+import os
+import sys
+
+# Max queries per request, steady state (caches warm, session established).
+# With the default per-process cache every request reads its session from
+# django_session (see users/session_store.py); a shared cache saves that one.
+BUDGETS = {
+    'POST /login/': 9,
+    'GET /dashboard/': 3,
+    'POST /app/api/login/': 6,
+    'GET /app/api/status/': 2,
+    'POST /app/api/logout/': 5,
+    'POST /api/token/': 3,
+    'GET /api/me/': 2,
+    'POST /api/logout/': 2,
+}
+
+PASSWORD = 'budget-password'
+
+
+def measure():
+    """Returns {endpoint: query count}"""
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from users.backends import shadow_user
+    from users.models import UserAccount
+    from users.passwords import hash_password
+
+    hashed = hash_password(PASSWORD)
+    for user_id in ('web', 'api', 'jwt'):
+        UserAccount.objects.create(user_id=user_id, password=hashed)
+    shadow_user('jwt')
+
+    counts = {}
+
+    def count(label, call):
+        with CaptureQueriesContext(connection) as queries:
+            response = call()
+        counts[label] = len(queries)
+        return response
+
+    web = Client()
+    count('POST /login/', lambda: web.post('/login/', {'username': 'web', 'password': PASSWORD}))
+    web.get('/dashboard/')  # warm the presence cache
+    count('GET /dashboard/', lambda: web.get('/dashboard/'))
+
+    api = Client()
+    body = json.dumps({'username': 'api', 'password': PASSWORD})
+    count('POST /app/api/login/', lambda: api.post('/app/api/login/', body, content_type='application/json'))
+    count('GET /app/api/status/', lambda: api.get('/app/api/status/'))
+    count('POST /app/api/logout/', lambda: api.post('/app/api/logout/'))
+
+    jwt = Client()
+    body = json.dumps({'username': 'jwt', 'password': PASSWORD})
+    response = count('POST /api/token/', lambda: jwt.post('/api/token/', body, content_type='application/json'))
+    auth = {'HTTP_AUTHORIZATION': f"Bearer {response.json()['access']}"}
+    count('GET /api/me/', lambda: jwt.get('/api/me/', **auth))
+    count('POST /api/logout/', lambda: jwt.post('/api/logout/', **auth))
+
+    return counts
+
+
+def run():
+    """Set up a test database, measure, tear down. Returns the report dict."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        counts = measure()
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+    return {
+        label: {'queries': counts.get(label), 'budget': budget,
+                'ok': counts.get(label) is not None and counts[label] <= budget}
+        for label, budget in BUDGETS.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = run()
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for label, result in report.items():
+            mark = 'ok  ' if result['ok'] else 'OVER'
+            print(f"{mark} {label:<24} {result['queries']}/{result['budget']} queries")
+    if not all(result['ok'] for result in report.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
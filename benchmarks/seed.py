@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Seed a realistic dataset for the benchmarks
+
+    python -m benchmarks.seed --accounts 20000 --sessions 200000 --clients 200
+
+Creates `clients` login-capable accounts named bench-00000.. (with matching
+Django users for the JWT endpoints), one admin-panel operator, plus filler
+accounts and closed session history so the tables have production-like size.
+Run against the database in DATABASE_URL.
+"""
+import argparse
+import os
+import random
+from datetime import timedelta
+
+BENCH_PASSWORD = 'bench-password'
+OPERATOR = 'bench-operator'
+
+
+def client_user_id(index):
+    return f'bench-{index:05d}'
+
+
+def seed(accounts, sessions, clients, batch_size=2000):
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from users.models import UserAccount
+    from main_app.models import UserSession
+
+    rng = random.Random(42)
+    now = timezone.now()
+    # One hash shared by every bench account keeps seeding fast
+    hashed = make_password(BENCH_PASSWORD)
+
+    named = [client_user_id(i) for i in range(clients)] + [OPERATOR]
+    filler = [f'acct-{i:07d}' for i in range(max(accounts - len(named), 0))]
+    for start in range(0, len(named) + len(filler), batch_size):
+        chunk = (named + filler)[start:start + batch_size]
+        UserAccount.objects.bulk_create(
+            [UserAccount(user_id=uid, password=hashed, status=True) for uid in chunk],
+            ignore_conflicts=True,
+        )
+
+    # Shadow users for login()/JWT; credentials live on UserAccount
+    User.objects.bulk_create(
+        [User(username=uid, password=make_password(None), email=f'{uid}@example.com') for uid in named],
+        ignore_conflicts=True,
+    )
+
+    pks = list(UserAccount.objects.values_list('pk', flat=True))
+    created = 0
+    while created < sessions:
+        batch = []
+        for _ in range(min(batch_size, sessions - created)):
+            start = now - timedelta(minutes=rng.randint(60, 60 * 24 * 180))
+            batch.append(UserSession(
+                user_account_id=rng.choice(pks),
+                session_start=start,
+                session_end=start + timedelta(minutes=rng.randint(1, 600)),
+                ip_address=f'10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}',
+                user_agent='AI Mailer Pro/benchmark',
+            ))
+        UserSession.objects.bulk_create(batch)
+        created += len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts', type=int, default=20000)
+    parser.add_argument('--sessions', type=int, default=200000)
+    parser.add_argument('--clients', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internet_art_tools.settings')
+    import django
+    django.setup()
+    seed(args.accounts, args.sessions, args.clients)
+
+
+if __name__ == '__main__':
+    main()
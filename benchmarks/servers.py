@@ -0,0 +1,84 @@
+"""
+Helpers to run the project under a real server for benchmarks
+
+Each benchmark gets a throwaway SQLite database (or the DATABASE_URL you pass)
+that is migrated and seeded before the server starts.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .loadgen import fetch
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def bench_env(database_url=None, **extra):
+    env = os.environ.copy()
+    if database_url is None:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.sqlite3')
+    env['DATABASE_URL'] = database_url
+    env.setdefault('DEBUG', 'False')
+    env.setdefault('PYTHONPATH', str(BASE_DIR))
+    # Load tests log in thousands of times from one address
+    env.setdefault('LOGIN_THROTTLE_ENABLED', 'False')
+    (BASE_DIR / 'logs').mkdir(exist_ok=True)
+    env.update({key: str(value) for key, value in extra.items()})
+    return env
+
+
+def manage(env, *args):
+    subprocess.run([sys.executable, 'manage.py', *args], cwd=BASE_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def start_server(kind, port, env, workers=2):
+    """kind is 'wsgi' (gunicorn sync workers) or 'asgi' (uvicorn)"""
+    if kind == 'wsgi':
+        cmd = [sys.executable, '-m', 'gunicorn', 'internet_art_tools.wsgi:application',
+               '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    elif kind == 'asgi':
+        cmd = [sys.executable, '-m', 'uvicorn', 'internet_art_tools.asgi:application',
+               '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+               '--log-level', 'warning', '--no-access-log']
+    else:
+        raise ValueError(f'unknown server kind: {kind}')
+
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR, env=env)
+    wait_ready(f'http://127.0.0.1:{port}/app/api/health/', proc)
+    return proc
+
+
+def wait_ready(url, proc, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited with code {proc.returncode}')
+        try:
+            status, _, _ = fetch(url)
+            if status < 500:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f'server at {url} did not become ready')
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def session_cookie(headers):
+    """Extract 'sessionid=...' from a response's Set-Cookie headers"""
+    for value in headers.get('set-cookie', []):
+        if value.startswith('sessionid='):
+            return value.split(';', 1)[0]
+    return None
@@ -36,8 +36,8 @@ while true; do
         echo "⚠️ Django process not found. Restarting at $(date)..."
         start_django
     else
-        # Check if Django is responding
-        if ! curl -s http://localhost:8000 > /dev/null; then
+        # Check if Django is responding (liveness probe, no database work)
+        if ! curl -sf http://localhost:8000/app/api/health/live/ > /dev/null; then
             echo "⚠️ Django not responding. Restarting at $(date)..."
             start_django
         else
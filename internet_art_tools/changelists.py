@@ -0,0 +1,215 @@
+"""
+Admin changelists for tables with millions of rows
+
+The stock changelist runs an exact COUNT(*) for the paginator and another
+for "N total", substring (icontains) searches that no index can serve,
+and a date hierarchy whose links come from a DISTINCT over every row in
+range. LargeTableMixin replaces each of these:
+
+* EstimatedCountPaginator: an unfiltered list on PostgreSQL takes the
+  planner's row estimate (pg_class.reltuples) once the table is past
+  EXACT_BELOW rows, and an exact count below that; any other list counts
+  at most COUNT_LIMIT rows (COUNT over a LIMIT subquery), so a broad
+  filter can't scan the table just to print a number. Pages past an
+  estimate or the limit stay reachable (?p=N), and past the real end are
+  empty rather than an error.
+* show_full_result_count = False: no second count of the whole table.
+* Search is a prefix match on `search_prefix_fields` (exact with a leading
+  '='), or an exact match on `search_ip_fields` when the term is an IP
+  address: lookups a B-tree index answers.
+* The date hierarchy offers every year, month or day between the first
+  and last row in the current filter (an indexed MIN/MAX) instead of only
+  those that have rows, so some links may show an empty page.
+* GET changelists read from a replica when there is one (see
+  internet_art_tools/replicas.py); actions (POST) stay on the primary.
+
+Settings: ADMIN_CHANGELISTS = {'EXACT_BELOW': ..., 'COUNT_LIMIT': ...}.
+"""
+from datetime import date, datetime
+
+from django.conf import settings
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Paginator
+from django.core.validators import validate_ipv46_address
+from django.db import connections
+from django.db.models import Max, Min, Q, QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .replicas import reading
+
+DEFAULTS = {
+    'EXACT_BELOW': 100000,  # tables estimated smaller than this are counted exactly
+    'COUNT_LIMIT': 10000,   # filtered lists count at most this many rows
+}
+
+
+def setting(name):
+    return getattr(settings, 'ADMIN_CHANGELISTS', {}).get(name, DEFAULTS[name])
+
+
+def estimated_rows(model, using='default'):
+    """The planner's row estimate for model's table, or None (not PostgreSQL, never analyzed)"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)',
+                       [connection.ops.quote_name(model._meta.db_table)])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    count may be a planner estimate or capped at COUNT_LIMIT; when it isn't
+    exact, page numbers past it are still served (an empty page once they
+    pass the real end) instead of raising EmptyPage.
+    """
+
+    @cached_property
+    def _counted(self):
+        """(count, whether it is exact)"""
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count, True
+        if not queryset.query.where:
+            estimate = estimated_rows(queryset.model, queryset.db)
+            if estimate is not None:
+                if estimate >= setting('EXACT_BELOW'):
+                    return estimate, False
+                return queryset.count(), True
+        limit = setting('COUNT_LIMIT')
+        count = queryset.order_by()[:limit].count()
+        return count, count < limit
+
+    @property
+    def count(self):
+        return self._counted[0]
+
+    @property
+    def count_is_exact(self):
+        return self._counted[1]
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if self.count_is_exact or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        if self.count_is_exact:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+def _truncate(value, kind):
+    return date(value.year, 1 if kind == 'year' else value.month, value.day if kind == 'day' else 1)
+
+
+def _next(day, kind):
+    if kind == 'year':
+        return day.replace(year=day.year + 1)
+    if kind == 'month':
+        return day.replace(year=day.year + 1, month=1) if day.month == 12 else day.replace(month=day.month + 1)
+    return date.fromordinal(day.toordinal() + 1)
+
+
+class RangeDatesQuerySet:
+    """Mixed into a changelist's queryset class: dates()/datetimes() from MIN/MAX alone"""
+
+    def _range(self, field_name, kind, to_value):
+        bounds = self.order_by().aggregate(first=Min(field_name), last=Max(field_name))
+        first, last = bounds['first'], bounds['last']
+        if first is None:
+            return []
+        if isinstance(first, datetime) and timezone.is_aware(first):
+            first, last = timezone.localtime(first), timezone.localtime(last)
+        current, end = _truncate(first, kind), _truncate(last, kind)
+        values = []
+        while current <= end:
+            values.append(to_value(current))
+            current = _next(current, kind)
+        return values
+
+    def dates(self, field_name, kind, order='ASC'):
+        values = self._range(field_name, kind, lambda day: day)
+        return values[::-1] if order == 'DESC' else values
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        zone = tzinfo or timezone.get_current_timezone()
+        values = self._range(field_name, kind, lambda day: datetime(day.year, day.month, day.day, tzinfo=zone))
+        return values[::-1] if order == 'DESC' else values
+
+
+_range_classes = {}
+
+
+def _with_range_dates(queryset):
+    cls = type(queryset)
+    if not issubclass(cls, RangeDatesQuerySet):
+        if cls not in _range_classes:
+            _range_classes[cls] = type(f'RangeDates{cls.__name__}', (RangeDatesQuerySet, cls), {})
+        queryset = queryset._chain()
+        queryset.__class__ = _range_classes[cls]
+    return queryset
+
+
+class LargeTableChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        return _with_range_dates(queryset) if self.date_hierarchy else queryset
+
+
+class LargeTableMixin:
+    """ModelAdmin mixin for big tables; see the module docstring"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_prefix_fields = ()
+    search_ip_fields = ()
+    search_help_text = 'Starts with (prefix with = for an exact match)'
+
+    def get_changelist(self, request, **kwargs):
+        return LargeTableChangeList
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with reading(request):
+            response = super().changelist_view(request, extra_context)
+            # The page's rows are only read while the template renders
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+    def get_search_fields(self, request):
+        return tuple(self.search_prefix_fields) + tuple(self.search_ip_fields)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if self.search_ip_fields:
+            try:
+                validate_ipv46_address(term)
+            except ValidationError:
+                pass
+            else:
+                query = Q()
+                for field in self.search_ip_fields:
+                    query |= Q(**{field: term})
+                return queryset.filter(query), False
+        if not self.search_prefix_fields:
+            return queryset.none(), False
+        lookup = 'startswith'
+        if term.startswith('='):
+            lookup, term = 'exact', term[1:].strip()
+        query = Q()
+        for field in self.search_prefix_fields:
+            query |= Q(**{f'{field}__{lookup}': term})
+        return queryset.filter(query), False
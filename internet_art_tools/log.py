@@ -0,0 +1,128 @@
+"""
+Non-blocking logging for request threads
+
+settings.LOGGING routes every logger through QueueHandler: a log call only
+renders the message and puts the record on a bounded in-memory queue, and
+a listener thread per process does the writing to the log file and to
+stderr. A request thread never waits on disk or on the console; if
+the writer falls behind and the queue fills up, records are dropped and
+counted instead of blocking (the count is logged once the queue drains).
+
+SampledDebug passes only one in `every` DEBUG records per call site, so
+debug logging can stay on in production, and QueueHandler caps each
+message at `max_length` characters so no single call can flood the log.
+"""
+import atexit
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room: on a full queue the writer is still draining
+        self.queue.put(self._sentinel)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    dictConfig handler that hands records to `handlers` on a listener thread:
+
+        'queue': {
+            '()': 'internet_art_tools.log.QueueHandler',
+            'handlers': ['cfg://handlers.file', 'cfg://handlers.console'],
+        }
+    """
+
+    def __init__(self, handlers, maxsize=10000, max_length=4000):
+        super().__init__(queue.Queue(maxsize))
+        # cfg:// entries resolve on item access, not on iteration
+        self.targets = [handlers[index] for index in range(len(handlers))]
+        self.max_length = max_length
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._running = False
+        self._start()
+        # Forked workers (gunicorn --preload) don't inherit the listener thread
+        os.register_at_fork(after_in_child=self._restart)
+        atexit.register(self.stop)
+
+    def _start(self):
+        self.listener = _Listener(self.queue, *self.targets, respect_handler_level=True)
+        self.listener.start()
+        self._running = True
+
+    def _restart(self):
+        self.queue = queue.Queue(self.queue.maxsize)
+        self._dropped_lock = threading.Lock()
+        self._start()
+
+    def stop(self):
+        """Write out everything queued (called at exit)"""
+        if self._running:
+            self._running = False
+            self.listener.stop()
+
+    def prepare(self, record):
+        # Render the message here, where its args are still valid, but leave
+        # formatting (timestamps, levels) to each target's own formatter
+        record = super().prepare(record)
+        record.stack_info = None  # already part of the message
+        if len(record.msg) > self.max_length:
+            record.msg = record.msg[:self.max_length] + f'... [{len(record.msg) - self.max_length} chars cut]'
+        record.message = record.msg
+        return record
+
+    def format(self, record):
+        # super().prepare() calls this for the message text only
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            message = f'{message}\n{record.exc_text}'
+        if record.stack_info:
+            message = f'{message}\n{record.stack_info}'
+        return message
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+        if self.dropped and self.queue.qsize() < self.queue.maxsize // 2:
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                notice = logging.LogRecord('internet_art_tools.log', logging.WARNING, __file__, 0,
+                                           'Log queue was full, dropped %d records', (dropped,), None)
+                try:
+                    self.queue.put_nowait(self.prepare(notice))
+                except queue.Full:
+                    with self._dropped_lock:
+                        self.dropped += dropped
+
+
+class SampledDebug(logging.Filter):
+    """
+    Let through every record at INFO and above, and the first of every
+    `every` DEBUG records from each call site (logger, file, line).
+    """
+
+    def __init__(self, every=1):
+        super().__init__()
+        self.every = max(1, int(every))
+        self._counters = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.INFO or self.every == 1:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters.setdefault(key, itertools.count())
+        return next(counter) % self.every == 0
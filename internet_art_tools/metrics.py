@@ -0,0 +1,365 @@
+"""
+Per-view request and DB query metrics, exported in Prometheus text format
+
+MetricsMiddleware times every request and, through a DB execute_wrapper
+installed on each connection, counts the queries and DB time spent inside
+it. Numbers are kept in a plain in-process registry with one shard per
+thread, so recording a request takes no lock (a few dict updates, about
+5 us in all; see benchmarks/bench_metrics_overhead.py). To aggregate across
+gunicorn workers, each process writes a JSON snapshot of its registry to
+METRICS['DIR'] every few seconds from a background thread, and /metrics
+merges all snapshots on scrape. A scrape also deletes the snapshots of
+workers that are gone: files not rewritten for STALE_AFTER seconds, or
+whose process no longer exists and that missed their last two flushes.
+
+/metrics is off unless METRICS['TOKEN'] (a bearer token) or
+METRICS['ALLOWED_IPS'] (scraper addresses) is set.
+"""
+import contextvars
+import hmac
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+DEFAULTS = {
+    'DIR': None,             # directory for per-worker snapshots; None = this process only
+    'FLUSH_INTERVAL': 5,     # seconds between snapshot writes
+    'STALE_AFTER': 60,       # seconds after which a snapshot's worker counts as gone
+    'TOKEN': None,           # serve /metrics to "Authorization: Bearer <token>"
+    'ALLOWED_IPS': (),       # serve /metrics to these REMOTE_ADDRs; with neither, /metrics is off
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+}
+
+
+def _conf(name):
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+# [query count, DB seconds] for the request running in this context
+_current = contextvars.ContextVar('request_db_stats', default=None)
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    # connection_created fires again on reconnect; install only once
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+connection_created.connect(install_db_wrapper)
+
+
+class _Shard:
+    """One thread's counters; only that thread writes them"""
+
+    def __init__(self):
+        self.requests = {}   # (view, method, status) -> count
+        self.latency = {}    # view -> [bucket counts..., +Inf count, sum]
+        self.db = {}         # view -> [queries, seconds]
+
+
+class Registry:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()  # guards the list of shards
+        self.shards = []
+        self._local = threading.local()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def observe(self, view, method, status, seconds, queries, db_seconds):
+        shard = self._shard()
+        key = (view, method, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+
+        hist = shard.latency.get(view)
+        if hist is None:
+            hist = shard.latency[view] = [0] * (len(self.buckets) + 2)
+        # First bucket with seconds <= bound; len(buckets) is +Inf
+        hist[bisect_left(self.buckets, seconds)] += 1
+        hist[-1] += seconds
+
+        db = shard.db.get(view)
+        if db is None:
+            db = shard.db[view] = [0, 0.0]
+        db[0] += queries
+        db[1] += db_seconds
+
+    def snapshot(self):
+        # Copies of other threads' dicts and lists are atomic under the GIL;
+        # a request recorded mid-copy shows up in the next snapshot
+        with self.lock:
+            shards = list(self.shards)
+        requests, latency, db = {}, {}, {}
+        for shard in shards:
+            for key, count in dict(shard.requests).items():
+                requests[key] = requests.get(key, 0) + count
+            for view, hist in dict(shard.latency).items():
+                merged = latency.setdefault(view, [0] * (len(self.buckets) + 2))
+                for i, value in enumerate(list(hist)):
+                    merged[i] += value
+            for view, (queries, seconds) in dict(shard.db).items():
+                merged = db.setdefault(view, [0, 0.0])
+                merged[0] += queries
+                merged[1] += seconds
+        return {
+            'buckets': list(self.buckets),
+            'requests': [[*key, count] for key, count in requests.items()],
+            'latency': latency,
+            'db': db,
+        }
+
+
+REGISTRY = Registry(_conf('BUCKETS'))
+
+
+# -- cross-worker aggregation ---------------------------------------------------
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _snapshot_path(directory):
+    return os.path.join(directory, f'metrics-{os.getpid()}.json')
+
+
+def flush():
+    """Write this process's snapshot atomically (no-op without a DIR)"""
+    directory = _conf('DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _flush_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _ensure_flusher():
+    # Started lazily so it runs in each forked gunicorn worker, not the master
+    global _flusher
+    if _flusher is not None and _flusher[0] == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher is not None and _flusher[0] == os.getpid():
+            return
+        thread = threading.Thread(target=_flush_loop, args=(_conf('FLUSH_INTERVAL'),),
+                                  name='metrics-flush', daemon=True)
+        thread.start()
+        _flusher = (os.getpid(), thread)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by someone else
+    return True
+
+
+def _is_stale(path, name, now):
+    """A snapshot (or leftover .tmp) whose worker is gone"""
+    try:
+        age = now - os.stat(path).st_mtime
+    except OSError:
+        return False
+    if age > _conf('STALE_AFTER'):
+        return True
+    # A recent write means a live writer, even if the pid is another host's
+    # or container's; a dead local worker is dropped after two missed flushes
+    pid = name[len('metrics-'):].split('.', 1)[0]
+    return age > 2 * _conf('FLUSH_INTERVAL') and pid.isdigit() and not _pid_alive(int(pid))
+
+
+def collect():
+    """Merge the snapshots of every worker (or just this process), deleting those of gone workers"""
+    directory = _conf('DIR')
+    if not directory:
+        return [REGISTRY.snapshot()]
+
+    flush()
+    snapshots = []
+    now = time.time()
+    for name in os.listdir(directory):
+        if not name.startswith('metrics-'):
+            continue
+        path = os.path.join(directory, name)
+        if _is_stale(path, name, now):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        if name.endswith('.json'):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return snapshots
+
+
+def merge(snapshots):
+    requests, latency, db = {}, {}, {}
+    buckets = list(_conf('BUCKETS'))
+    for snap in snapshots:
+        if snap.get('buckets') != buckets:
+            continue
+        for view, method, status, count in snap['requests']:
+            key = (view, method, status)
+            requests[key] = requests.get(key, 0) + count
+        for view, hist in snap['latency'].items():
+            merged = latency.setdefault(view, [0] * len(hist))
+            for i, value in enumerate(hist):
+                merged[i] += value
+        for view, (queries, seconds) in snap['db'].items():
+            merged = db.setdefault(view, [0, 0.0])
+            merged[0] += queries
+            merged[1] += seconds
+    return buckets, requests, latency, db
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(snapshots):
+    buckets, requests, latency, db = merge(snapshots)
+    lines = [
+        '# HELP http_requests_total Requests handled, by view, method and status.',
+        '# TYPE http_requests_total counter',
+    ]
+    for (view, method, status), count in sorted(requests.items()):
+        lines.append(f'http_requests_total{{view="{_label(view)}",method="{method}",status="{status}"}} {count}')
+
+    lines += [
+        '# HELP http_request_duration_seconds Request latency by view.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for view, hist in sorted(latency.items()):
+        name = _label(view)
+        cumulative = 0
+        for bound, count in zip(buckets, hist):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{view="{name}",le="{bound}"}} {cumulative}')
+        cumulative += hist[len(buckets)]
+        lines.append(f'http_request_duration_seconds_bucket{{view="{name}",le="+Inf"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{{view="{name}"}} {hist[-1]:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{view="{name}"}} {cumulative}')
+
+    lines += [
+        '# HELP db_queries_total DB queries executed while handling requests, by view.',
+        '# TYPE db_queries_total counter',
+    ]
+    for view, (queries, _) in sorted(db.items()):
+        lines.append(f'db_queries_total{{view="{_label(view)}"}} {queries}')
+
+    lines += [
+        '# HELP db_query_duration_seconds_total Time spent in DB queries, by view.',
+        '# TYPE db_query_duration_seconds_total counter',
+    ]
+    for view, (_, seconds) in sorted(db.items()):
+        lines.append(f'db_query_duration_seconds_total{{view="{_label(view)}"}} {seconds:.6f}')
+
+    return '\n'.join(lines) + '\n'
+
+
+# -- middleware and view --------------------------------------------------------
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or 'unnamed'
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported missed the signal
+        for connection in connections.all(initialized_only=True):
+            install_db_wrapper(None, connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        _ensure_flusher()
+        stats = [0, 0.0]
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        REGISTRY.observe(_view_name(request), request.method, response.status_code,
+                         time.perf_counter() - started, stats[0], stats[1])
+        return response
+
+    async def __acall__(self, request):
+        _ensure_flusher()
+        stats = [0, 0.0]
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        REGISTRY.observe(_view_name(request), request.method, response.status_code,
+                         time.perf_counter() - started, stats[0], stats[1])
+        return response
+
+
+def metrics_view(request):
+    token, allowed_ips = _conf('TOKEN'), _conf('ALLOWED_IPS')
+    if not token and not allowed_ips:
+        raise Http404('metrics are disabled')
+    authorized = (
+        request.META.get('REMOTE_ADDR') in allowed_ips
+        or bool(token) and hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+    )
+    if not authorized:
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,221 @@
+"""
+Read replicas for read-heavy endpoints
+
+Every database in DATABASES other than 'default' that is listed in
+DATABASE_REPLICAS['ALIASES'] (one per DATABASE_REPLICA_URLS entry, see
+settings.py) is a read replica. ReplicaRouter sends reads there only
+inside a read-only scope: a view wrapped in @read_only, or a block under
+`with reading(request):`. Everything else, and every write, stays on the
+primary, so login, logout and admin edits behave as before.
+
+Inside a scope reads still go to the primary (read-your-writes) when:
+
+* the request already wrote (the router saw a db_for_write),
+* the request carries the pin cookie, which ReplicaMiddleware sets for
+  STICKY_SECONDS on the response of any request that wrote,
+* the user was pinned with pin() in the last STICKY_SECONDS; session_state
+  pins every login and logout, so a JWT client without cookies that just
+  logged in doesn't read stale presence from a lagging replica,
+* the model is in PRIMARY_MODELS (auth users and Django sessions: the
+  identity a request is authenticated against is never stale).
+
+Querysets outside a request (exports, commands) pick a database with
+read_alias() and .using().
+
+With no replicas configured the router, the middleware and the scopes do
+nothing and every query goes to 'default'.
+
+Settings: DATABASE_REPLICAS = {'ALIASES': [...], 'STICKY_SECONDS': ...}.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+DEFAULTS = {
+    'ALIASES': [],                # database aliases serving reads
+    'STICKY_SECONDS': 5,          # reads stay on the primary this long after a write; above replica lag
+    'COOKIE': 'replica_pin',      # cookie marking a client that just wrote
+    'PRIMARY_MODELS': ('auth.user', 'sessions.session'),
+}
+
+PIN_KEY = 'replicas:pin:{}'
+
+
+def setting(name):
+    return getattr(settings, 'DATABASE_REPLICAS', {}).get(name, DEFAULTS[name])
+
+
+def aliases():
+    return setting('ALIASES')
+
+
+class _State:
+    """Per-request routing state, shared by the threads a request's ORM calls run in"""
+
+    def __init__(self, request=None, pinned=False):
+        self.request = request
+        self.pinned = pinned
+        self.wrote = False
+        self.reading = False
+        self.user_pinned = None  # looked up on the first replica read
+        self.alias = random.choice(aliases())
+
+    def read_alias(self):
+        if self.pinned or self.wrote:
+            return DEFAULT_DB_ALIAS
+        if self.user_pinned is None:
+            self.user_pinned = False  # the lookup below may read (on the primary)
+            self.user_pinned = is_pinned(_user_id(self.request))
+        return DEFAULT_DB_ALIAS if self.user_pinned else self.alias
+
+
+_state = ContextVar('replica_state', default=None)
+
+
+def _user_id(request):
+    if request is None:
+        return None
+    session = getattr(request, 'session', None)
+    user_id = session.get('user_id') if session is not None else None
+    if not user_id:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            user_id = user.get_username()
+    return user_id
+
+
+def _cookie_pinned(request):
+    return request is not None and setting('COOKIE') in request.COOKIES
+
+
+def pin(*user_ids):
+    """Keep reads for these users on the primary for STICKY_SECONDS"""
+    if aliases() and user_ids:
+        cache.set_many({PIN_KEY.format(user_id): 1 for user_id in user_ids}, setting('STICKY_SECONDS'))
+
+
+async def apin(*user_ids):
+    if aliases() and user_ids:
+        await cache.aset_many({PIN_KEY.format(user_id): 1 for user_id in user_ids}, setting('STICKY_SECONDS'))
+
+
+def is_pinned(user_id):
+    return bool(user_id) and cache.get(PIN_KEY.format(user_id)) is not None
+
+
+def read_alias():
+    """Database for an explicit .using() read: a replica unless the current request is pinned"""
+    if not aliases():
+        return DEFAULT_DB_ALIAS
+    state = _state.get()
+    return state.read_alias() if state is not None else random.choice(aliases())
+
+
+@contextmanager
+def reading(request=None):
+    """Route reads in this block to a replica (subject to the pins above)"""
+    if not aliases():
+        yield
+        return
+    state = _state.get()
+    token = None
+    if state is None:
+        state = _State(request, _cookie_pinned(request))
+        token = _state.set(state)
+    previous, state.reading = state.reading, True
+    try:
+        yield
+    finally:
+        state.reading = previous
+        if token is not None:
+            _state.reset(token)
+
+
+def read_only(view):
+    """View decorator: the view's reads may go to a replica"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            with reading(request):
+                return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with reading(request):
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.reading or model._meta.label_lower in setting('PRIMARY_MODELS'):
+            return None
+        return state.read_alias()
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return False if db in aliases() else None
+
+
+class ReplicaMiddleware:
+    """
+    Tracks whether a request wrote and sets the pin cookie on its response;
+    place it before SessionMiddleware so session saves count as writes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not aliases():
+            return self.get_response(request)
+        state = _State(request, _cookie_pinned(request))
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    async def __acall__(self, request):
+        if not aliases():
+            return await self.get_response(request)
+        state = _State(request, _cookie_pinned(request))
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    def _finish(self, state, response):
+        if state.wrote:
+            response.set_cookie(setting('COOKIE'), '1', max_age=setting('STICKY_SECONDS'),
+                                httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE)
+        return response
@@ -1,7 +1,8 @@
 from pathlib import Path
 import os
-from decouple import config
+from decouple import Csv, config
 import dj_database_url
+from panel_client.client import LOGOUT_BATCH_SIZE
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = config('SECRET_KEY', default='django-insecure-change-this')
@@ -21,6 +22,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'internet_art_tools.metrics.MetricsMiddleware',  # Per-view latency / query metrics
+    'users.throttle.LoginThrottleMiddleware',  # 429s for login floods before any session/DB work
+    'internet_art_tools.replicas.ReplicaMiddleware',  # Read-your-writes pin for replica reads
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # For static files
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -54,6 +58,12 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'internet_art_tools.wsgi.application'
+ASGI_APPLICATION = 'internet_art_tools.asgi.application'
+
+# Serve the AI Mailer Pro JSON API with native async views. Only enable this
+# when running under an ASGI server, e.g.:
+#   uvicorn internet_art_tools.asgi:application --workers 4
+API_ASYNC = config('API_ASYNC', default=False, cast=bool)
 
 # Database configuration
 if config('DATABASE_URL', default=None):
@@ -68,6 +78,17 @@ else:
         }
     }
 
+# Read replicas (see internet_art_tools/replicas.py): comma-separated URLs,
+# used only by read-only views and querysets. Tests mirror them to 'default'.
+DATABASE_REPLICA_URLS = config('DATABASE_REPLICA_URLS', default='', cast=Csv())
+for _index, _url in enumerate(DATABASE_REPLICA_URLS, 1):
+    DATABASES[f'replica{_index}'] = dict(dj_database_url.parse(_url), TEST={'MIRROR': 'default'})
+DATABASE_REPLICAS = {
+    'ALIASES': [f'replica{index}' for index in range(1, len(DATABASE_REPLICA_URLS) + 1)],
+    'STICKY_SECONDS': config('DATABASE_REPLICA_STICKY_SECONDS', default=5, cast=int),
+}
+DATABASE_ROUTERS = ['internet_art_tools.replicas.ReplicaRouter']
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -83,6 +104,13 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Panel users authenticate against UserAccount (users/backends.py); staff keep
+# using their django User password through ModelBackend
+AUTHENTICATION_BACKENDS = [
+    'users.backends.UserAccountBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'Asia/Kolkata'
 USE_I18N = True
@@ -100,9 +128,23 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 
+# Admin dashboard keyset pagination
+DASHBOARD_PAGE_SIZE = config('DASHBOARD_PAGE_SIZE', default=50, cast=int)
+DASHBOARD_MAX_PAGE_SIZE = 500
+
+# Live dashboard stream (/dashboard/events/, ASGI only; see users/events.py)
+DASHBOARD_LIVE = {
+    'MAX_USERS': config('DASHBOARD_LIVE_MAX_USERS', default=5000, cast=int),
+    'KEEPALIVE': config('DASHBOARD_LIVE_KEEPALIVE', default=15, cast=int),
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-# Logging configuration
+# Logging configuration. Loggers only write to 'queue' (see
+# internet_art_tools/log.py); a listener thread in each process writes the
+# records to the size-rotated file and the console, so request threads never
+# block on either. DEBUG records are sampled: one in LOG_DEBUG_SAMPLE per call site.
+(BASE_DIR / 'logs').mkdir(exist_ok=True)
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -116,11 +158,21 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        'sampled_debug': {
+            '()': 'internet_art_tools.log.SampledDebug',
+            'every': config('LOG_DEBUG_SAMPLE', default=1 if DEBUG else 100, cast=int),
+        },
+    },
     'handlers': {
         'file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
-            'filename': BASE_DIR / 'logs' / 'django.log',
+            # Shared by every worker: rotated by logrotate, never by a worker
+            # (each would rename the file under the others); a moved file is
+            # reopened on the next record
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': config('LOG_FILE', default=str(BASE_DIR / 'logs' / 'django.log')),
+            'delay': True,
             'formatter': 'verbose',
         },
         'console': {
@@ -128,16 +180,27 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
+        'queue': {
+            '()': 'internet_art_tools.log.QueueHandler',
+            'handlers': ['cfg://handlers.file', 'cfg://handlers.console'],
+            'maxsize': config('LOG_QUEUE_SIZE', default=10000, cast=int),
+            'filters': ['sampled_debug'],
+        },
     },
     'loggers': {
         'django': {
-            'handlers': ['file', 'console'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': True,
         },
         'main_app': {
-            'handlers': ['file', 'console'],
-            'level': 'DEBUG',
+            'handlers': ['queue'],
+            'level': config('LOG_LEVEL', default='DEBUG'),
+            'propagate': True,
+        },
+        'users': {
+            'handlers': ['queue'],
+            'level': config('LOG_LEVEL', default='DEBUG'),
             'propagate': True,
         },
     },
@@ -146,8 +209,112 @@ LOGGING = {
 # Session configuration for better stability
 SESSION_COOKIE_AGE = 86400  # 24 hours
 SESSION_SAVE_EVERY_REQUEST = True
+# Cache-fronted sessions that skip the DB write unless the data changed or the
+# stored expiry is more than SESSION_REFRESH_THRESHOLD seconds stale
+SESSION_ENGINE = 'users.session_store'
+SESSION_REFRESH_THRESHOLD = config('SESSION_REFRESH_THRESHOLD', default=3600, cast=int)
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
+# UserSession retention (see main_app/retention.py and archive_sessions)
+SESSION_RETENTION = {
+    'DAYS': config('SESSION_RETENTION_DAYS', default=90, cast=int),
+    'ARCHIVE_DAYS': config('SESSION_ARCHIVE_DAYS', default=None, cast=lambda v: int(v) if v else None),
+    'BATCH_SIZE': config('SESSION_RETENTION_BATCH_SIZE', default=1000, cast=int),
+}
+
+# Cache configuration. Point CACHE_BACKEND/CACHE_LOCATION at a shared backend
+# (memcached, redis, file) so all gunicorn workers see the same entries.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='internet-art-tools'),
+    }
+}
+
+# UserSession audit rows are written behind the request in batches (see
+# main_app/audit.py); SESSION_AUDIT_MODE=sync writes them on the request path.
+SESSION_AUDIT = {
+    'MODE': config('SESSION_AUDIT_MODE', default='buffered'),
+    'FLUSH_INTERVAL': config('SESSION_AUDIT_FLUSH_INTERVAL', default=2, cast=int),
+    'FLUSH_SIZE': config('SESSION_AUDIT_FLUSH_SIZE', default=500, cast=int),
+}
+
+# Hourly/daily session analytics kept up to date by `manage.py rollup_sessions
+# --loop` (see main_app/rollups.py). LAG must exceed the audit flush delay.
+SESSION_ROLLUPS = {
+    'LAG': config('SESSION_ROLLUPS_LAG', default=300, cast=int),
+    'INTERVAL': config('SESSION_ROLLUPS_INTERVAL', default=300, cast=int),
+    'WORKERS': config('SESSION_ROLLUPS_WORKERS', default=4, cast=int),
+}
+
+# Admin changelists of UserAccount/UserSession (see internet_art_tools/changelists.py):
+# unfiltered lists on PostgreSQL show the planner's estimate past EXACT_BELOW
+# rows, filtered lists count at most COUNT_LIMIT rows
+ADMIN_CHANGELISTS = {
+    'EXACT_BELOW': config('ADMIN_EXACT_COUNT_BELOW', default=100000, cast=int),
+    'COUNT_LIMIT': config('ADMIN_COUNT_LIMIT', default=10000, cast=int),
+}
+
+# Streaming CSV/NDJSON exports (see main_app/exports.py)
+DATA_EXPORTS = {
+    'CHUNK_SIZE': config('EXPORT_CHUNK_SIZE', default=2000, cast=int),
+    'GZIP_LEVEL': config('EXPORT_GZIP_LEVEL', default=5, cast=int),
+}
+
+# Presence cache used by SessionManagementMiddleware (see users/presence.py)
+PRESENCE_CACHE = {
+    'LOCAL_MAXSIZE': config('PRESENCE_LOCAL_MAXSIZE', default=10000, cast=int),
+    'LOCAL_TTL': config('PRESENCE_LOCAL_TTL', default=5, cast=int),
+    'TTL': config('PRESENCE_TTL', default=300, cast=int),
+}
+
+# Health probes (see main_app/health.py)
+HEALTH_CHECKS = {
+    'READY_TTL': config('HEALTH_READY_TTL', default=5, cast=int),
+    'MIGRATIONS_TTL': config('HEALTH_MIGRATIONS_TTL', default=300, cast=int),
+    'STATS_TTL': config('HEALTH_STATS_TTL', default=60, cast=int),
+}
+
+# Request metrics served at /metrics (see internet_art_tools/metrics.py).
+# Set METRICS_DIR to a directory shared by the gunicorn workers to aggregate them.
+# /metrics is off until METRICS_TOKEN or METRICS_ALLOWED_IPS is set.
+METRICS = {
+    'DIR': config('METRICS_DIR', default=None),
+    'FLUSH_INTERVAL': config('METRICS_FLUSH_INTERVAL', default=5, cast=int),
+    'STALE_AFTER': config('METRICS_STALE_AFTER', default=60, cast=int),
+    'TOKEN': config('METRICS_TOKEN', default=None),
+    'ALLOWED_IPS': config('METRICS_ALLOWED_IPS', default='', cast=Csv()),
+}
+
+# Heartbeat presence for API clients (see users/heartbeat.py). A client that
+# stops pinging for PRESENCE_TIMEOUT seconds is logged out by the reaper.
+PRESENCE_HEARTBEAT = {
+    'TIMEOUT': config('PRESENCE_TIMEOUT', default=90, cast=int),
+    'REFRESH': config('PRESENCE_REFRESH', default=30, cast=int),
+    'FLUSH_INTERVAL': config('PRESENCE_FLUSH_INTERVAL', default=10, cast=int),
+    'REAP_INTERVAL': config('PRESENCE_REAP_INTERVAL', default=30, cast=int),
+    'BACKGROUND': config('PRESENCE_BACKGROUND', default=True, cast=bool),
+}
+
+# Largest body accepted by the batch presence endpoint (/api/users/presence/)
+PRESENCE_BATCH_MAX_ITEMS = config('PRESENCE_BATCH_MAX_ITEMS', default=10000, cast=int)
+
+# Largest batch accepted by /api/logout/ ({"users": [...]}). Each item costs a
+# password hash check (~0.5 s), so keep batches well inside the gunicorn and
+# client timeouts; panel_client reads the same variable for its batch size.
+LOGOUT_BATCH_MAX_ITEMS = config('LOGOUT_BATCH_MAX_ITEMS', default=LOGOUT_BATCH_SIZE, cast=int)
+
+# Per-endpoint rate limits for login and credentialed logout (see users/throttle.py).
+# Override 'ENDPOINTS' here to change limits, e.g.
+# {'/app/api/login/': {'methods': ('POST',), 'ip': '120/m', 'user': '10/m', 'json': True}}.
+# Requests from LOGIN_THROTTLE_TRUSTED_PROXIES (nginx on this host by default)
+# are keyed by their X-Real-IP / X-Forwarded-For address.
+LOGIN_THROTTLE = {
+    'ENABLED': config('LOGIN_THROTTLE_ENABLED', default=True, cast=bool),
+    'TRUSTED_PROXIES': config('LOGIN_THROTTLE_TRUSTED_PROXIES', default='127.0.0.1,::1', cast=Csv()),
+    'IP_HEADER': config('LOGIN_THROTTLE_IP_HEADER', default='') or None,
+}
+
 # DRF / SimpleJWT configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
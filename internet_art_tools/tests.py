@@ -0,0 +1,294 @@
+import json
+import logging
+import logging.config
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from asgiref.sync import async_to_sync
+from benchmarks import query_budgets
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from users.models import UserAccount
+from users.passwords import hash_password
+
+from . import log, metrics, replicas
+from .changelists import EstimatedCountPaginator
+
+# No replica database exists under test: these check where the router would
+# send each query, and never run a read inside a scope that goes to one.
+REPLICAS = {'ALIASES': ['replica1'], 'STICKY_SECONDS': 1}
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def request_for(user_id=None, cookies=None):
+    request = RequestFactory().get('/')
+    request.session = {'user_id': user_id} if user_id else {}
+    request.COOKIES.update(cookies or {})
+    return request
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS)
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_outside_a_scope_use_the_primary(self):
+        self.assertEqual(router.db_for_read(UserAccount), 'default')
+
+    def test_reads_in_a_scope_use_the_replica(self):
+        with replicas.reading(request_for('alice')):
+            self.assertEqual(router.db_for_read(UserAccount), 'replica1')
+
+    def test_primary_models_never_read_from_the_replica(self):
+        with replicas.reading(request_for('alice')):
+            self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_writes_use_the_primary(self):
+        with replicas.reading(request_for('alice')):
+            self.assertEqual(router.db_for_write(UserAccount), 'default')
+
+    def test_reads_after_a_write_use_the_primary(self):
+        with replicas.reading(request_for('alice')):
+            router.db_for_write(UserAccount)
+            self.assertEqual(router.db_for_read(UserAccount), 'default')
+        with replicas.reading(request_for('alice')):
+            self.assertEqual(router.db_for_read(UserAccount), 'replica1')
+
+    def test_pin_cookie_reads_from_the_primary(self):
+        with replicas.reading(request_for('alice', {replicas.setting('COOKIE'): '1'})):
+            self.assertEqual(router.db_for_read(UserAccount), 'default')
+
+    def test_pinned_user_reads_from_the_primary(self):
+        replicas.pin('alice')
+        with replicas.reading(request_for('alice')):
+            self.assertEqual(router.db_for_read(UserAccount), 'default')
+        with replicas.reading(request_for('bob')):
+            self.assertEqual(router.db_for_read(UserAccount), 'replica1')
+
+    def test_user_pin_expires(self):
+        replicas.pin('alice')
+        time.sleep(REPLICAS['STICKY_SECONDS'] + 0.1)
+        self.assertFalse(replicas.is_pinned('alice'))
+        with replicas.reading(request_for('alice')):
+            self.assertEqual(router.db_for_read(UserAccount), 'replica1')
+
+    def test_async_pin(self):
+        async_to_sync(replicas.apin)('alice')
+        self.assertTrue(replicas.is_pinned('alice'))
+
+    def test_read_alias(self):
+        self.assertEqual(replicas.read_alias(), 'replica1')
+        with replicas.reading(request_for('alice', {replicas.setting('COOKIE'): '1'})):
+            self.assertEqual(replicas.read_alias(), 'default')
+
+    def test_no_migrations_on_replicas(self):
+        self.assertIs(router.allow_migrate_model('replica1', UserAccount), False)
+        self.assertIs(router.allow_migrate_model('default', UserAccount), True)
+
+    def test_read_only_view(self):
+        @replicas.read_only
+        def view(request):
+            return router.db_for_read(UserAccount)
+        self.assertEqual(view(request_for('alice')), 'replica1')
+
+    @override_settings(DATABASE_REPLICAS={'ALIASES': []})
+    def test_no_replicas(self):
+        with replicas.reading(request_for('alice')):
+            self.assertEqual(router.db_for_read(UserAccount), 'default')
+        self.assertEqual(replicas.read_alias(), 'default')
+        replicas.pin('alice')
+        self.assertFalse(replicas.is_pinned('alice'))
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS)
+class ReplicaMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def respond(self, view):
+        return replicas.ReplicaMiddleware(view)(request_for('alice'))
+
+    def test_request_that_wrote_sets_pin_cookie(self):
+        def view(request):
+            router.db_for_write(UserAccount)
+            return HttpResponse()
+        cookie = self.respond(view).cookies[replicas.setting('COOKIE')]
+        self.assertEqual(cookie['max-age'], REPLICAS['STICKY_SECONDS'])
+        self.assertTrue(cookie['httponly'])
+
+    def test_read_only_request_sets_no_cookie(self):
+        def view(request):
+            with replicas.reading(request):
+                router.db_for_read(UserAccount)
+            return HttpResponse()
+        self.assertNotIn(replicas.setting('COOKIE'), self.respond(view).cookies)
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS, PASSWORD_HASHERS=FAST_HASHERS, SESSION_AUDIT={'MODE': 'sync'})
+class ReadYourWritesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        UserAccount.objects.create(user_id='alice', password=hash_password('secret'))
+
+    def test_login_pins_cookie_and_user(self):
+        response = self.client.post('/app/api/login/', json.dumps({'username': 'alice', 'password': 'secret'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(replicas.setting('COOKIE'), response.cookies)
+        self.assertTrue(replicas.is_pinned('alice'))
+        # Status right after the login reads the primary and sees it
+        status = self.client.get('/app/api/status/')
+        self.assertTrue(status.json()['success'])
+
+
+@override_settings(ADMIN_CHANGELISTS={'COUNT_LIMIT': 20})
+class ChangelistPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        UserAccount.objects.bulk_create([UserAccount(user_id=f'user{n:02}', password='x') for n in range(50)])
+        cls.admin = User.objects.create_superuser('changelist-admin', 'admin@example.com', 'x')
+        UserAccount.objects.create(user_id='changelist-admin', password='x')
+
+    def paginator(self, queryset=None):
+        return EstimatedCountPaginator(queryset or UserAccount.objects.filter(user_id__startswith='user')
+                                       .order_by('user_id'), 10)
+
+    def test_filtered_count_is_capped(self):
+        paginator = self.paginator()
+        self.assertEqual(paginator.count, 20)
+        self.assertFalse(paginator.count_is_exact)
+
+    def test_pages_past_the_cap_are_served(self):
+        paginator = self.paginator()
+        self.assertEqual([account.user_id for account in paginator.page(3)], [f'user{n}' for n in range(20, 30)])
+        self.assertEqual(len(paginator.page(5)), 10)
+        self.assertEqual(len(paginator.page(6)), 0)
+        with self.assertRaises(EmptyPage):
+            paginator.page(0)
+
+    def test_exact_count_keeps_bounds(self):
+        paginator = self.paginator(UserAccount.objects.filter(user_id__startswith='user0').order_by('user_id'))
+        self.assertEqual(paginator.count, 10)
+        self.assertTrue(paginator.count_is_exact)
+        with self.assertRaises(EmptyPage):
+            paginator.page(2)
+
+    def test_admin_page_past_the_cap(self):
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+        # SessionManagementMiddleware wants an account holding this session
+        UserAccount.objects.filter(user_id='changelist-admin').update(
+            is_logged_in=True, current_session=self.client.session.session_key)
+        response = self.client.get('/admin/users/useraccount/', {'q': 'user', 'p': 4})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'user35')
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class QueryBudgetTests(TransactionTestCase):
+    # Outside a test transaction, like the benchmark: atomic blocks don't add savepoints
+    def setUp(self):
+        cache.clear()
+
+    def test_endpoints_stay_within_budget(self):
+        counts = query_budgets.measure()
+        self.assertEqual(counts.keys(), query_budgets.BUDGETS.keys())
+        for label, budget in query_budgets.BUDGETS.items():
+            self.assertLessEqual(counts[label], budget, label)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LoggingTests(SimpleTestCase):
+    def record(self, level=logging.DEBUG, msg='message', lineno=1):
+        return logging.LogRecord('users', level, __file__, lineno, msg, (), None)
+
+    def test_sampled_debug_per_call_site(self):
+        sampled = log.SampledDebug(every=3)
+        self.assertEqual([sampled.filter(self.record()) for _ in range(6)], [True, False, False] * 2)
+        self.assertTrue(sampled.filter(self.record(lineno=2)))
+        self.assertTrue(all(sampled.filter(self.record(logging.INFO)) for _ in range(3)))
+
+    def test_queue_handler_writes_on_its_thread(self):
+        target = ListHandler()
+        handler = log.QueueHandler([target], max_length=10)
+        handler.handle(self.record(logging.INFO, 'x' * 25))
+        handler.stop()
+        [record] = target.records
+        self.assertEqual(record.getMessage(), 'x' * 10 + '... [15 chars cut]')
+
+    def test_log_file_reopened_after_external_rotation(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'django.log')
+        config = dict(settings.LOGGING['handlers']['file'], filename=path)
+        logger = logging.getLogger('internet_art_tools.tests.rotation')
+        logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False,
+                                   'formatters': settings.LOGGING['formatters'],
+                                   'handlers': {'file': config},
+                                   'loggers': {logger.name: {'handlers': ['file'], 'level': 'INFO'}}})
+        self.addCleanup(logger.handlers.clear)
+        logger.info('before')
+        os.rename(path, path + '.1')  # logrotate
+        logger.info('after')
+        logger.handlers[0].close()
+        with open(path) as current, open(path + '.1') as rotated:
+            self.assertIn('after', current.read())
+            self.assertIn('before', rotated.read())
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def snapshot(self, name, age=0):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            json.dump({'buckets': list(metrics._conf('BUCKETS')), 'requests': [['other', 'GET', 200, 7]],
+                       'latency': {}, 'db': {}}, f)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    @override_settings(METRICS={'TOKEN': 'secret'})
+    def test_scrape_counts_requests_and_queries(self):
+        self.client.get('/login/')
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertRegex(body, r'http_requests_total\{view="login",method="GET",status="200"\} [1-9]')
+        self.assertIn('http_request_duration_seconds_bucket{view="login",le="+Inf"}', body)
+
+    def test_metrics_off_without_token_or_ips(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_snapshots_of_gone_workers_are_deleted(self):
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                capture_output=True, text=True).stdout.strip()
+        with override_settings(METRICS={'DIR': self.directory, 'FLUSH_INTERVAL': 5, 'STALE_AFTER': 60}):
+            live = self.snapshot(f'metrics-{os.getppid()}.json', age=30)
+            just_exited = self.snapshot(f'metrics-{exited}.json', age=5)
+            dead = self.snapshot(f'metrics-{exited}0.json', age=30)
+            stale = self.snapshot('metrics-1.json', age=61)
+            leftover = self.snapshot('metrics-1.json.tmp', age=61)
+            snapshots = metrics.collect()
+        self.assertTrue(os.path.exists(live))
+        self.assertTrue(os.path.exists(just_exited))
+        for path in (dead, stale, leftover):
+            self.assertFalse(os.path.exists(path), path)
+        # This process's own snapshot, plus the two kept above
+        self.assertEqual(len(snapshots), 3)
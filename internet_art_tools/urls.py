@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('users.urls')),  # Admin panel routes
     path('app/', include('main_app.urls')),  # Main app routes
+    path('metrics', metrics_view, name='metrics'),  # Prometheus scrape target
 ]
@@ -1,51 +1,96 @@
-import requests
-import json
+import time
+
+from panel_client import Outbox, PanelClient, PanelError, PanelUnavailable
+
+# One pooled client per process; the panel URL comes from PANEL_URL
+_panel = None
+# Logouts the panel didn't receive (file from PANEL_OUTBOX, default ~/.panel_outbox.sqlite3)
+_outbox = None
+
+def _client():
+    global _panel
+    if _panel is None:
+        _panel = PanelClient()
+    return _panel
+
+def _queue():
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox()
+        # Keep retrying in the background until the panel is back
+        _outbox.start(_client())
+    return _outbox
+
+def replay_outbox():
+    """Send queued logouts now (e.g. at startup); returns the replay report"""
+    return _queue().replay(_client())
 
 def logout_from_panel(username, password):
     """
     Call the panel API to logout user automatically
     This function should be called when user logs out from AI Mailer Pro
     """
+    started = time.time()
     try:
-        # Panel API endpoint
-        url = "http://16.170.250.233:8000/api/logout/"
-        
-        # Method 1: GET request with parameters
-        params = {
-            'username': username,
-            'password': password
-        }
-        
         print(f"🔄 Calling panel logout API for user: {username}")
-        
-        # Make API call
-        response = requests.get(url, params=params, timeout=10)
-        
-        print(f"📡 API Response Status: {response.status_code}")
-        print(f"📡 API Response: {response.text}")
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'success':
-                print(f"✅ User {username} logged out from panel successfully")
-                return True
-            else:
-                print(f"❌ Panel logout failed: {data.get('message')}")
-                return False
-        else:
-            print(f"❌ Panel logout failed with status code: {response.status_code}")
-            return False
-            
-    except requests.exceptions.Timeout:
-        print("❌ Panel logout API timeout - panel might be down")
+        if _client().logout(username, password):
+            print(f"✅ User {username} logged out from panel successfully")
+            _forget(username, started)
+            return True
+        print(f"❌ Panel logout refused for user {username}")
         return False
-    except requests.exceptions.ConnectionError:
-        print("❌ Panel logout API connection error - check network")
+    except PanelError as e:
+        if not _retryable(e):
+            print(f"❌ Error calling panel logout API: {e}")
+            return False
+        print(f"❌ Panel logout API unreachable or overloaded - panel might be down ({e})")
+        _queue().record_logout(username, password)
+        print(f"📥 Logout for {username} queued; it will be sent when the panel is back")
         return False
-    except Exception as e:
+    except ValueError as e:
         print(f"❌ Error calling panel logout API: {e}")
         return False
 
+def logout_many_from_panel(credentials):
+    """
+    Logout many users in as few requests as possible
+    credentials: {username: password}
+    """
+    started = time.time()
+    try:
+        results = _client().logout_many(credentials)
+    except PanelError as e:
+        print(f"❌ Error calling panel logout API: {e}")
+        if _retryable(e):
+            outbox = _queue()
+            for username, password in credentials.items():
+                outbox.record_logout(username, password)
+            print(f"📥 Logouts for {len(credentials)} users queued; they will be sent when the panel is back")
+        return {}
+    except ValueError as e:
+        print(f"❌ Error calling panel logout API: {e}")
+        return {}
+    print(f"✅ Logged out {sum(1 for r in results.values() if r == 'ok')}/{len(results)} users from panel")
+    for username, result in results.items():
+        if result == 'ok':
+            _forget(username, started)
+    return results
+
+def record_login(username):
+    """
+    Call when the user logs in to AI Mailer Pro: logouts still queued for
+    them from before this login must not end the new session
+    """
+    _queue().record_login(username)
+
+def _retryable(error):
+    # Unreachable, rate limited or failing server side: worth sending again later
+    return isinstance(error, PanelUnavailable) or error.status == 429 or (error.status or 0) >= 500
+
+def _forget(username, before):
+    # This logout reached the panel; an older queued one would only repeat it
+    _queue().discard(username, before)
+
 # Test function - you can call this to test the API
 def test_panel_logout():
     """
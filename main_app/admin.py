@@ -1,12 +1,101 @@
+from datetime import timedelta
+
 from django.contrib import admin
-from .models import UserSession
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_ipv46_address
+from django.db.models import Count
+from django.utils import timezone
+
+from internet_art_tools.changelists import LargeTableMixin
+from .models import SessionRollup, UserSession, UserSessionArchive
+
+class RecentIPFilter(admin.SimpleListFilter):
+    """
+    Exact IP filter. The choices are the busiest IPs of the last day
+    (one GROUP BY over the session_start index range, cached for
+    CACHE_TTL seconds) rather than a DISTINCT over the whole table; any
+    other address can still be given as ?ip=.
+    """
+    title = 'IP address (busiest, last 24 h)'
+    parameter_name = 'ip'
+    CHOICES = 20
+    CACHE_TTL = 300
+    CACHE_KEY = 'admin:usersession:recent-ips'
+
+    def lookups(self, request, model_admin):
+        ips = cache.get(self.CACHE_KEY)
+        if ips is None:
+            ips = list(UserSession.objects
+                       .filter(session_start__gte=timezone.now() - timedelta(days=1))
+                       .values('ip_address')
+                       .annotate(sessions=Count('pk'))
+                       .order_by('-sessions')
+                       .values_list('ip_address', 'sessions')[:self.CHOICES])
+            cache.set(self.CACHE_KEY, ips, self.CACHE_TTL)
+        choices = [(ip, f'{ip} ({sessions})') for ip, sessions in ips]
+        value = self.value()
+        if value and value not in dict(choices):
+            choices.insert(0, (value, value))
+        return choices
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        try:
+            validate_ipv46_address(value)
+        except ValidationError as e:
+            raise IncorrectLookupParameters(e)
+        return queryset.filter(ip_address=value)
 
 @admin.register(UserSession)
-class UserSessionAdmin(admin.ModelAdmin):
+class UserSessionAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ('user_account', 'session_start', 'session_end', 'ip_address')
-    list_filter = ('session_start', 'session_end', 'ip_address')
-    search_fields = ('user_account__user_id', 'ip_address')
+    list_filter = ('session_start', 'session_end', RecentIPFilter)
+    date_hierarchy = 'session_start'
+    search_prefix_fields = ('user_account__user_id',)
+    search_ip_fields = ('ip_address',)
+    search_help_text = 'User ID starts with (=alice for an exact match), or an exact IP address'
     readonly_fields = ('session_start', 'ip_address', 'user_agent')
-    
+    # A select of every account would be rendered into the change form
+    raw_id_fields = ('user_account',)
+
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user_account')
+
+@admin.register(UserSessionArchive)
+class UserSessionArchiveAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('user_id', 'session_start', 'session_end', 'ip_address', 'archived_at')
+    search_prefix_fields = ('user_id',)
+    search_help_text = 'User ID starts with (=alice for an exact match)'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(SessionRollup)
+class SessionRollupAdmin(admin.ModelAdmin):
+    """Session analytics from the rollup tables; never touches UserSession"""
+    list_display = ('start', 'period', 'logins', 'unique_users', 'distinct_ips',
+                    'completed_sessions', 'average_duration')
+    list_filter = ('period',)
+    date_hierarchy = 'start'
+    ordering = ('-start',)
+
+    @admin.display(description='Avg duration (s)')
+    def average_duration(self, obj):
+        average = obj.avg_duration
+        return None if average is None else round(average)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -2,20 +2,53 @@
 API Views for AI Mailer Pro Integration
 Handles connection issues and provides stable endpoints
 """
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.contrib.sessions.models import Session
+from internet_art_tools.replicas import read_alias, read_only
+from datetime import datetime, timedelta
 import json
 import logging
 
 from users.models import UserAccount
-from .models import UserSession
+from users import heartbeat, session_state
+from . import audit, exports, health, rollups
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+LOGIN_REFUSALS = {
+    session_state.NOT_FOUND: (401, 'Invalid username or password', 'USER_NOT_FOUND'),
+    session_state.DISABLED: (403, 'Account is disabled', 'ACCOUNT_DISABLED'),
+    session_state.ALREADY_LOGGED_IN: (409, 'User already logged in elsewhere', 'ALREADY_LOGGED_IN'),
+    session_state.INVALID_PASSWORD: (401, 'Invalid username or password', 'INVALID_CREDENTIALS'),
+}
+
+def _login_refused(username, outcome):
+    status, error, code = LOGIN_REFUSALS[outcome]
+    logger.warning(f"API Login refused ({outcome}): {username}")
+    return JsonResponse({
+        'success': False,
+        'error': error,
+        'code': code
+    }, status=status)
+
+def _login_success(username, claim, session_key):
+    return JsonResponse({
+        'success': True,
+        'message': 'Login successful',
+        'user': {
+            'id': username,
+            'status': True,
+            'last_login': claim.last_login.isoformat()
+        },
+        'session_id': session_key
+    })
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def api_login(request):
@@ -42,77 +75,37 @@ def api_login(request):
                 'code': 'MISSING_CREDENTIALS'
             }, status=400)
         
-        try:
-            # Check if user exists
-            user_account = UserAccount.objects.get(user_id=username)
-            
-            # Check if user is active
-            if not user_account.status:
-                return JsonResponse({
-                    'success': False,
-                    'error': 'Account is disabled',
-                    'code': 'ACCOUNT_DISABLED'
-                }, status=403)
-            
-            # Enforce single session
-            if user_account.is_logged_in and user_account.current_session:
-                logger.warning(f"API Login blocked - already logged in elsewhere: {username}")
-                return JsonResponse({
-                    'success': False,
-                    'error': 'User already logged in elsewhere',
-                    'code': 'ALREADY_LOGGED_IN'
-                }, status=409)
-            
-            # Check password
-            if user_account.password == password:
-                # Update login info
-                user_account.is_logged_in = True
-                user_account.last_login = timezone.now()
-                user_account.device_ip = request.META.get('REMOTE_ADDR')
-                # Use session_key as logical session id for API caller context
-                user_account.current_session = request.session.session_key or 'api'
-                user_account.session_key = user_account.current_session
-                user_account.save()
-                
-                # Create session tracking record
-                UserSession.objects.create(
-                    user_account=user_account,
-                    ip_address=request.META.get('REMOTE_ADDR'),
-                    user_agent=request.META.get('HTTP_USER_AGENT', '')
-                )
-                
-                # Store in session
-                request.session['user_id'] = user_account.user_id
-                request.session['user_status'] = user_account.status
-                request.session.save()
-                
-                logger.info(f"API Login successful: {username}")
-                
-                return JsonResponse({
-                    'success': True,
-                    'message': 'Login successful',
-                    'user': {
-                        'id': user_account.user_id,
-                        'status': user_account.status,
-                        'last_login': user_account.last_login.isoformat() if user_account.last_login else None
-                    },
-                    'session_id': request.session.session_key
-                })
-            else:
-                logger.warning(f"API Login failed - wrong password: {username}")
-                return JsonResponse({
-                    'success': False,
-                    'error': 'Invalid username or password',
-                    'code': 'INVALID_CREDENTIALS'
-                }, status=401)
-                
-        except UserAccount.DoesNotExist:
-            logger.warning(f"API Login failed - user not found: {username}")
-            return JsonResponse({
-                'success': False,
-                'error': 'Invalid username or password',
-                'code': 'USER_NOT_FOUND'
-            }, status=401)
+        # Status, single session and password are all enforced by the
+        # conditional UPDATE that records the login
+        session_id = request.session.session_key or 'api'
+        claim = session_state.claim_session(
+            username,
+            password=password,
+            session_id=session_id,
+            device_ip=request.META.get('REMOTE_ADDR'),
+            heartbeat=True,
+        )
+
+        if claim.outcome != session_state.OK:
+            return _login_refused(username, claim.outcome)
+
+        # Create session tracking record (written behind the request)
+        started = audit.session_started(
+            claim.pk,
+            username,
+            ip_address=request.META.get('REMOTE_ADDR'),
+            user_agent=request.META.get('HTTP_USER_AGENT', '')
+        )
+
+        # Store in session
+        request.session['user_id'] = username
+        request.session['user_status'] = True
+        request.session['session_start'] = started.isoformat()
+        request.session.save()
+
+        logger.info(f"API Login successful: {username}")
+
+        return _login_success(username, claim, request.session.session_key)
             
     except json.JSONDecodeError:
         return JsonResponse({
@@ -130,6 +123,7 @@ def api_login(request):
 
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
+@read_only
 def api_status(request):
     """
     API endpoint to check login status
@@ -151,7 +145,9 @@ def api_status(request):
                     'authenticated': False,
                     'message': 'Account disabled'
                 })
-            
+
+            # Status polls double as heartbeats
+            heartbeat.beat(user_id)
             return JsonResponse({
                 'success': True,
                 'authenticated': True,
@@ -176,6 +172,27 @@ def api_status(request):
             'error': 'Internal server error'
         }, status=500)
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_heartbeat(request):
+    """
+    Heartbeat for AI Mailer Pro: call at least every `timeout` seconds while
+    logged in. Buffered in memory, so it never waits on the database.
+    """
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not logged in',
+            'code': 'NOT_LOGGED_IN'
+        }, status=401)
+
+    heartbeat.beat(user_id)
+    return JsonResponse({
+        'success': True,
+        'timeout': heartbeat.setting('TIMEOUT')
+    })
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def api_logout(request):
@@ -185,25 +202,10 @@ def api_logout(request):
     try:
         user_id = request.session.get('user_id')
         if user_id:
-            try:
-                user_account = UserAccount.objects.get(user_id=user_id)
-                user_account.is_logged_in = False
-                user_account.current_session = None
-                user_account.session_key = None
-                user_account.save()
-                
-                # End current session
-                current_session = UserSession.objects.filter(
-                    user_account=user_account,
-                    session_end__isnull=True
-                ).order_by('-session_start').first()
-                
-                if current_session:
-                    current_session.session_end = timezone.now()
-                    current_session.save()
-                    
-            except UserAccount.DoesNotExist:
-                pass
+            session_state.release_session(user_id)
+
+            # End current session
+            audit.session_ended(user_id, started=request.session.get('session_start'))
         
         # Clear session
         request.session.flush()
@@ -222,26 +224,185 @@ def api_logout(request):
 
 @csrf_exempt
 @require_http_methods(["GET"])
+def api_liveness(request):
+    """
+    Liveness probe: the process is up and serving requests. No DB access.
+    """
+    return JsonResponse({
+        'success': True,
+        'status': 'alive',
+        'timestamp': timezone.now().isoformat()
+    })
+
+def api_readiness(request):
+    """
+    Readiness probe: databases answer SELECT 1 and migrations are applied.
+    Results are memoized for a few seconds (see main_app/health.py).
+    """
+    ready, checks = health.readiness()
+    if not ready:
+        logger.error(f"Readiness check failed: {checks}")
+    return JsonResponse({
+        'success': ready,
+        'status': 'ready' if ready else 'unavailable',
+        'checks': checks,
+        'timestamp': timezone.now().isoformat()
+    }, status=200 if ready else 503)
+
 def api_health(request):
     """
-    Health check endpoint
+    Health check endpoint (readiness plus cached stats)
     """
+    ready, checks = health.readiness()
+    if not ready:
+        logger.error(f"Health check error: {checks}")
+        return JsonResponse({
+            'success': False,
+            'status': 'unhealthy',
+            'checks': checks
+        }, status=503)
+
+    # Counted in the background and shared through the cache; None right after startup
+    stats = health.cached_stats() or {}
+    return JsonResponse({
+        'success': True,
+        'status': 'healthy',
+        'database': 'connected',
+        'user_count': stats.get('user_count'),
+        'logged_in_count': stats.get('logged_in_count'),
+        'stats_computed_at': stats.get('computed_at'),
+        'timestamp': timezone.now().isoformat()
+    })
+
+ROLLUP_PERIODS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+
+def _time_bound(value, default):
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+@require_http_methods(["GET"])
+def api_session_analytics(request):
+    """
+    Session analytics for staff, read from SessionRollup only (see
+    main_app/rollups.py): ?period=hour|day&since=...&until=... (ISO dates
+    or datetimes; default the last 48 hours / 30 days).
+    """
+    if not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'error': 'Staff login required',
+            'code': 'FORBIDDEN'
+        }, status=403)
+
+    period = request.GET.get('period', 'hour')
+    if period not in ROLLUP_PERIODS:
+        return JsonResponse({
+            'success': False,
+            'error': 'period must be hour or day',
+            'code': 'INVALID_PERIOD'
+        }, status=400)
+
+    step = ROLLUP_PERIODS[period]
+    now = timezone.now()
     try:
-        # Check database connection
-        user_count = UserAccount.objects.count()
-        
+        until = _time_bound(request.GET.get('until'), now)
+        since = _time_bound(request.GET.get('since'), until - step * (48 if period == 'hour' else 30))
+    except ValueError:
         return JsonResponse({
-            'success': True,
-            'status': 'healthy',
-            'database': 'connected',
-            'user_count': user_count,
-            'timestamp': timezone.now().isoformat()
-        })
-        
-    except Exception as e:
-        logger.error(f"Health check error: {e}")
+            'success': False,
+            'error': 'since/until must be ISO dates or datetimes',
+            'code': 'INVALID_RANGE'
+        }, status=400)
+    limit = rollups.setting('MAX_BUCKETS')
+    if since >= until or (until - since) / step > limit:
         return JsonResponse({
             'success': False,
-            'status': 'unhealthy',
-            'error': str(e)
-        }, status=500)
+            'error': f'Range must be positive and at most {limit} buckets',
+            'code': 'INVALID_RANGE'
+        }, status=400)
+
+    rows = rollups.buckets(period, since, until).only(
+        'start', 'logins', 'unique_users', 'distinct_ips', 'completed_sessions', 'total_duration')
+    return JsonResponse({
+        'success': True,
+        'period': period,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'buckets': [{
+            'start': timezone.localtime(row.start).isoformat(),
+            'logins': row.logins,
+            'unique_users': row.unique_users,
+            'distinct_ips': row.distinct_ips,
+            'completed_sessions': row.completed_sessions,
+            'total_duration': row.total_duration,
+            'avg_duration': row.avg_duration,
+        } for row in rows],
+    })
+
+@require_http_methods(["GET"])
+def api_export(request, dataset):
+    """
+    Streaming export for staff (see main_app/exports.py)
+    GET /app/api/export/<accounts|sessions|session-archive>/
+        ?format=csv|ndjson&gzip=1&since=...&until=...&user=<user_id>&user=...
+    since/until bound last_login for accounts and session_start otherwise.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'error': 'Staff login required',
+            'code': 'FORBIDDEN'
+        }, status=403)
+    if dataset not in exports.DATASETS:
+        return JsonResponse({
+            'success': False,
+            'error': f"dataset must be one of {', '.join(exports.DATASETS)}",
+            'code': 'INVALID_DATASET'
+        }, status=404)
+
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return JsonResponse({
+            'success': False,
+            'error': 'format must be csv or ndjson',
+            'code': 'INVALID_FORMAT'
+        }, status=400)
+    try:
+        since = _time_bound(request.GET.get('since'), None)
+        until = _time_bound(request.GET.get('until'), None)
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'error': 'since/until must be ISO dates or datetimes',
+            'code': 'INVALID_RANGE'
+        }, status=400)
+    users = request.GET.getlist('user')
+    max_users = exports.setting('MAX_USERS')
+    if len(users) > max_users:
+        return JsonResponse({
+            'success': False,
+            'error': f'At most {max_users} users per export',
+            'code': 'TOO_MANY_USERS'
+        }, status=400)
+
+    compress = request.GET.get('gzip') in ('1', 'true', 'yes')
+    logger.info("Export %s (%s%s) by %s", dataset, fmt, ', gzip' if compress else '', request.user.username)
+    # Under ASGI a sync iterator would be read into a list before sending
+    stream = exports.astream if isinstance(request, ASGIRequest) else exports.stream
+    response = StreamingHttpResponse(
+        stream(dataset, fmt, compress, since=since, until=until, users=users, using=read_alias()),
+        content_type='application/gzip' if compress else exports.FORMATS[fmt][0],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{exports.filename(dataset, fmt, compress)}"'
+    response['Cache-Control'] = 'no-store'
+    response['X-Accel-Buffering'] = 'no'  # let Nginx pass chunks through as they come
+    return response
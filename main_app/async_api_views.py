@@ -0,0 +1,196 @@
+"""
+Async API Views for AI Mailer Pro Integration
+Same contract as api_views.py, but built on the async ORM and async session
+API so a single ASGI worker can keep thousands of requests in flight while
+waiting on the database. Routed in place of the sync views when
+settings.API_ASYNC is enabled (see main_app/urls.py).
+"""
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+import json
+import logging
+
+from internet_art_tools.replicas import read_only
+from users.models import UserAccount
+from users import heartbeat, session_state
+from . import audit
+from .api_views import _login_refused, _login_success
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def api_login(request):
+    """
+    API endpoint for AI Mailer Pro login
+    Returns JSON response to avoid redirect issues
+    """
+    try:
+        # Get data from request
+        if request.content_type == 'application/json':
+            data = json.loads(request.body)
+            username = data.get('username', '').strip()
+            password = data.get('password', '').strip()
+        else:
+            username = request.POST.get('username', '').strip()
+            password = request.POST.get('password', '').strip()
+
+        logger.info(f"API Login attempt: username={username}")
+
+        if not username or not password:
+            return JsonResponse({
+                'success': False,
+                'error': 'Username and password are required',
+                'code': 'MISSING_CREDENTIALS'
+            }, status=400)
+
+        # Status, single session and password are all enforced by the
+        # conditional UPDATE that records the login
+        session_id = request.session.session_key or 'api'
+        claim = await session_state.aclaim_session(
+            username,
+            password=password,
+            session_id=session_id,
+            device_ip=request.META.get('REMOTE_ADDR'),
+            heartbeat=True,
+        )
+
+        if claim.outcome != session_state.OK:
+            return _login_refused(username, claim.outcome)
+
+        # Create session tracking record (written behind the request)
+        started = await audit.asession_started(
+            claim.pk,
+            username,
+            ip_address=request.META.get('REMOTE_ADDR'),
+            user_agent=request.META.get('HTTP_USER_AGENT', '')
+        )
+
+        # Store in session
+        await request.session.aset('user_id', username)
+        await request.session.aset('user_status', True)
+        await request.session.aset('session_start', started.isoformat())
+        await request.session.asave()
+
+        logger.info(f"API Login successful: {username}")
+
+        return _login_success(username, claim, request.session.session_key)
+
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON data',
+            'code': 'INVALID_JSON'
+        }, status=400)
+    except Exception as e:
+        logger.error(f"API Login error: {e}")
+        return JsonResponse({
+            'success': False,
+            'error': 'Internal server error',
+            'code': 'SERVER_ERROR'
+        }, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+@read_only
+async def api_status(request):
+    """
+    API endpoint to check login status
+    """
+    try:
+        user_id = await request.session.aget('user_id')
+        if not user_id:
+            return JsonResponse({
+                'success': False,
+                'authenticated': False,
+                'message': 'Not logged in'
+            })
+
+        user_account = await (UserAccount.objects
+                              .filter(user_id=user_id)
+                              .only('user_id', 'status', 'last_login')
+                              .afirst())
+        if user_account is None:
+            return JsonResponse({
+                'success': False,
+                'authenticated': False,
+                'message': 'User not found'
+            })
+
+        if not user_account.status:
+            return JsonResponse({
+                'success': False,
+                'authenticated': False,
+                'message': 'Account disabled'
+            })
+
+        # Status polls double as heartbeats
+        await heartbeat.abeat(user_id)
+        return JsonResponse({
+            'success': True,
+            'authenticated': True,
+            'user': {
+                'id': user_account.user_id,
+                'status': user_account.status,
+                'last_login': user_account.last_login.isoformat() if user_account.last_login else None
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"API Status error: {e}")
+        return JsonResponse({
+            'success': False,
+            'error': 'Internal server error'
+        }, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def api_heartbeat(request):
+    """
+    Heartbeat for AI Mailer Pro: call at least every `timeout` seconds while
+    logged in. Buffered in memory, so it never waits on the database.
+    """
+    user_id = await request.session.aget('user_id')
+    if not user_id:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not logged in',
+            'code': 'NOT_LOGGED_IN'
+        }, status=401)
+
+    await heartbeat.abeat(user_id)
+    return JsonResponse({
+        'success': True,
+        'timeout': heartbeat.setting('TIMEOUT')
+    })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def api_logout(request):
+    """
+    API endpoint for logout
+    """
+    try:
+        user_id = await request.session.aget('user_id')
+        if user_id:
+            await session_state.arelease_session(user_id)
+
+            # End current session
+            await audit.asession_ended(user_id, started=await request.session.aget('session_start'))
+
+        # Clear session
+        await request.session.aflush()
+
+        return JsonResponse({
+            'success': True,
+            'message': 'Logged out successfully'
+        })
+
+    except Exception as e:
+        logger.error(f"API Logout error: {e}")
+        return JsonResponse({
+            'success': False,
+            'error': 'Internal server error'
+        }, status=500)
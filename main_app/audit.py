@@ -0,0 +1,308 @@
+"""
+Write-behind audit trail for UserSession
+
+A login used to INSERT its UserSession row on the request path, and under
+a login storm those INSERTs were the main write contention. In 'buffered'
+mode (the default) session starts and ends only go into a per-process
+buffer here; a background thread writes them every FLUSH_INTERVAL seconds,
+or as soon as FLUSH_SIZE events are waiting: one bulk_create for the
+starts and one bulk_update for the ends, in a single transaction. The
+buffer is also flushed when the worker exits. 'sync' mode writes each
+event on the request path, as before.
+
+session_started() returns the session's start time, which the views keep
+in request.session and pass back to session_ended() as `started`: with
+several sessions open for one account (the main app login isn't
+exclusive) a logout closes its own row, not whichever started last. An end
+for a session whose start is still buffered just closes the buffered row,
+so the pair is written once; other ends close the row with that start when
+flushed. An end without a start closes the newest open session, like
+UserSession.objects.end_current. An end that matches no row, when its start
+may still be buffered in another worker, is kept for later flushes for up
+to END_WAIT seconds; one whose row is already closed is dropped.
+A failed flush puts its events back and is retried (up to MAX_PENDING
+events are kept). Rows reach the database up to FLUSH_INTERVAL seconds
+after the login; pending_session() lets this process see its own.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import UserSession
+
+DEFAULTS = {
+    'MODE': 'buffered',     # or 'sync': write each event on the request path
+    'FLUSH_INTERVAL': 2,    # seconds between flushes
+    'FLUSH_SIZE': 500,      # events that trigger a flush right away
+    'MAX_PENDING': 50000,   # events kept while the database is unreachable
+    'END_WAIT': 60,         # seconds an end waits for its start to be written
+    'BACKGROUND': True,     # flush from a thread in each worker
+}
+
+logger = logging.getLogger(__name__)
+
+
+def setting(name):
+    return getattr(settings, 'SESSION_AUDIT', {}).get(name, DEFAULTS[name])
+
+
+def buffered():
+    return setting('MODE') != 'sync'
+
+
+# -- buffer -------------------------------------------------------------------
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()   # flushes run one at a time, in event order
+_starts = []                     # unsaved UserSession rows
+_open = {}                       # (user_id, session_start) -> buffered start, while open
+_ends = []                       # (user_id, started or None, when) for sessions already written
+_wake = threading.Event()
+
+
+def _add_start(account_pk, user_id, ip_address, user_agent, when):
+    session = UserSession(user_account_id=account_pk, session_start=when,
+                          ip_address=ip_address, user_agent=user_agent or '')
+    session.audit_user_id = user_id
+    with _lock:
+        _starts.append(session)
+        _open[(user_id, when)] = session
+        return len(_starts) + len(_ends) >= setting('FLUSH_SIZE')
+
+
+def _add_end(user_id, started, when):
+    with _lock:
+        if started is None:
+            # No identity: the newest buffered start, if any
+            key = max((key for key in _open if key[0] == user_id), default=None, key=lambda key: key[1])
+        else:
+            key = (user_id, started)
+        session = _open.pop(key, None)
+        if session is not None:
+            session.session_end = when
+            return False
+        _ends.append((user_id, started, when))
+        return len(_starts) + len(_ends) >= setting('FLUSH_SIZE')
+
+
+def _start_time(started):
+    # request.session keeps the start as an ISO string
+    return parse_datetime(started) if isinstance(started, str) else started
+
+
+def _due():
+    # A full buffer is flushed by the worker thread, not the request
+    if setting('BACKGROUND'):
+        _ensure_worker()
+        _wake.set()
+    else:
+        flush()
+
+
+def session_started(account_pk, user_id, ip_address, user_agent='', when=None):
+    """
+    Record a main app / API login and return its start time, the session's
+    identity for session_ended(). No database access in buffered mode.
+    """
+    when = when or timezone.now()
+    if not buffered():
+        UserSession.objects.create(user_account_id=account_pk, session_start=when,
+                                   ip_address=ip_address, user_agent=user_agent or '')
+        return when
+    if _add_start(account_pk, user_id, ip_address, user_agent, when):
+        _due()
+    _ensure_worker()
+    return when
+
+
+def session_ended(user_id, when=None, started=None):
+    """
+    Record a logout: ends user_id's session that started at `started` (a
+    datetime or ISO string from session_started()), or without it the
+    newest open one
+    """
+    when = when or timezone.now()
+    started = _start_time(started)
+    if not buffered():
+        UserSession.objects.end_current(user_id, when, started=started)
+        return
+    if _add_end(user_id, started, when):
+        _due()
+    _ensure_worker()
+
+
+async def asession_started(account_pk, user_id, ip_address, user_agent='', when=None):
+    when = when or timezone.now()
+    if not buffered():
+        await UserSession.objects.acreate(user_account_id=account_pk, session_start=when,
+                                          ip_address=ip_address, user_agent=user_agent or '')
+        return when
+    if _add_start(account_pk, user_id, ip_address, user_agent, when):
+        await sync_to_async(_due)()
+    _ensure_worker()
+    return when
+
+
+async def asession_ended(user_id, when=None, started=None):
+    when = when or timezone.now()
+    started = _start_time(started)
+    if not buffered():
+        await UserSession.objects.aend_current(user_id, when, started=started)
+        return
+    if _add_end(user_id, started, when):
+        await sync_to_async(_due)()
+    _ensure_worker()
+
+
+def pending_session(account_pk):
+    """This process's newest not-yet-written session for account_pk, if any"""
+    with _lock:
+        for session in reversed(_starts):
+            if session.user_account_id == account_pk:
+                return session
+    return None
+
+
+def pending():
+    with _lock:
+        return len(_starts) + len(_ends)
+
+
+# -- flush --------------------------------------------------------------------
+
+def _close(ends):
+    """
+    Apply (user_id, started, when) ends: each closes the user's open row
+    that started at `started`, or the newest open row when started is None.
+    Returns the ends that matched no row, and may belong to a start another
+    worker hasn't written yet.
+    """
+    by_user = defaultdict(list)  # user_id -> [(pk, session_start)], newest first
+    open_rows = (UserSession.objects
+                 .filter(user_account__user_id__in={user_id for user_id, _, _ in ends}, session_end__isnull=True)
+                 .order_by('user_account_id', '-session_start', '-pk')
+                 .values_list('pk', 'user_account__user_id', 'session_start'))
+    for pk, user_id, session_start in open_rows:
+        by_user[user_id].append((pk, session_start))
+    closed, unmatched = [], []
+    for user_id, started, when in ends:
+        rows = by_user.get(user_id, [])
+        if started is None:
+            index = 0 if rows else None
+        else:
+            index = next((i for i, (_, session_start) in enumerate(rows) if session_start == started), None)
+        if index is None:
+            unmatched.append((user_id, started, when))
+            continue
+        pk, _ = rows.pop(index)
+        closed.append(UserSession(pk=pk, session_end=when))
+    UserSession.objects.bulk_update(closed, ['session_end'], batch_size=setting('FLUSH_SIZE'))
+    if unmatched:
+        # A row with that start that is already closed (the reaper) ends nothing
+        written = set(UserSession.objects
+                      .filter(user_account__user_id__in={user_id for user_id, _, _ in unmatched},
+                              session_start__in={started for _, started, _ in unmatched if started})
+                      .values_list('user_account__user_id', 'session_start'))
+        unmatched = [end for end in unmatched if end[1] is None or end[:2] not in written]
+    return unmatched
+
+
+def flush():
+    """Write buffered starts and ends in one transaction. Returns rows written or closed."""
+    with _flush_lock:
+        with _lock:
+            starts, ends = _starts[:], _ends[:]
+            _starts.clear()
+            _ends.clear()
+            _open.clear()
+        if not starts and not ends:
+            return 0
+        unmatched = []
+        try:
+            with transaction.atomic():
+                # Buffered ends belong to sessions written by earlier flushes
+                if ends:
+                    unmatched = _close(ends)
+                if starts:
+                    UserSession.objects.bulk_create(starts, batch_size=setting('FLUSH_SIZE'))
+        except Exception:
+            _requeue(starts, ends)
+            raise
+        if unmatched:
+            _wait_for_starts(unmatched)
+        return len(starts) + len(ends) - len(unmatched)
+
+
+def _wait_for_starts(unmatched):
+    # The start may be in another worker's buffer: retry until END_WAIT has passed
+    oldest = timezone.now() - timedelta(seconds=setting('END_WAIT'))
+    waiting = [end for end in unmatched if end[2] >= oldest]
+    if len(waiting) < len(unmatched):
+        logger.warning('Session audit dropped %d ends with no session to close', len(unmatched) - len(waiting))
+    if waiting:
+        _requeue([], waiting)
+
+
+def _requeue(starts, ends):
+    for session in starts:
+        session.pk = None  # may have been set by the rolled-back INSERT
+    with _lock:
+        _starts[:0] = starts
+        _ends[:0] = ends
+        overflow = len(_starts) + len(_ends) - setting('MAX_PENDING')
+        if overflow > 0:
+            # Oldest first; ends before starts, since a lost start loses its end too
+            dropped = min(overflow, len(_ends))
+            del _ends[:dropped]
+            del _starts[:overflow - dropped]
+            logger.error('Session audit buffer full, dropped %d events', overflow)
+        # Sessions started before the failed flush can still be closed in the buffer
+        _open.clear()
+        for session in _starts:
+            if session.session_end is None:
+                _open[(session.audit_user_id, session.session_start)] = session
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _loop():
+    while True:
+        _wake.wait(setting('FLUSH_INTERVAL'))
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception('Session audit flush failed')
+        finally:
+            connections.close_all()
+
+
+def _ensure_worker():
+    # Started lazily so each forked gunicorn worker gets its own thread
+    global _worker
+    if not setting('BACKGROUND') or _worker == os.getpid():
+        return
+    with _worker_lock:
+        if _worker == os.getpid():
+            return
+        threading.Thread(target=_loop, name='session-audit', daemon=True).start()
+        _worker = os.getpid()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Session audit flush at exit failed')
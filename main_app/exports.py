@@ -0,0 +1,170 @@
+"""
+Streaming exports of accounts and session history
+
+Full exports of UserAccount and UserSession (plus UserSessionArchive) for
+compliance, as CSV or NDJSON, optionally gzipped on the fly. Rows are read
+with QuerySet.iterator(chunk_size=CHUNK_SIZE) (a server-side cursor on
+PostgreSQL) as plain value tuples and encoded CHUNK_SIZE rows at a time,
+so memory stays flat however many rows there are. The header (or, for
+NDJSON, nothing) goes out before the query runs, so the first byte is
+sent right away.
+
+stream() is for WSGI and the export_data command; astream() drives it from
+ASGI one piece at a time (values_list().aiterator() runs its query in the
+event loop, and Django would read a plain iterator into a list before
+sending it).
+
+Exports read from a replica when there is one: api_export and export_data
+pass using=read_alias() (see internet_art_tools/replicas.py).
+"""
+import csv
+import io
+import json
+import zlib
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from users.models import UserAccount
+from .models import UserSession, UserSessionArchive
+
+DEFAULTS = {
+    'CHUNK_SIZE': 2000,   # rows per fetch from the database and per encoded piece
+    'GZIP_LEVEL': 5,      # zlib level for gzip=1; higher costs CPU for little gain on CSV
+    'MAX_USERS': 1000,    # user_ids one export may filter on
+}
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# columns: (header, lookup); date/user: lookups the since/until and user filters apply to
+Dataset = namedtuple('Dataset', 'model columns date user')
+
+DATASETS = {
+    'accounts': Dataset(UserAccount, (
+        ('user_id', 'user_id'),
+        ('status', 'status'),
+        ('is_logged_in', 'is_logged_in'),
+        ('device_ip', 'device_ip'),
+        ('last_login', 'last_login'),
+        ('last_seen', 'last_seen'),
+    ), date='last_login', user='user_id'),
+    'sessions': Dataset(UserSession, (
+        ('id', 'pk'),
+        ('user_id', 'user_account__user_id'),
+        ('session_start', 'session_start'),
+        ('session_end', 'session_end'),
+        ('ip_address', 'ip_address'),
+        ('user_agent', 'user_agent'),
+    ), date='session_start', user='user_account__user_id'),
+    'session-archive': Dataset(UserSessionArchive, (
+        ('id', 'original_id'),
+        ('user_id', 'user_id'),
+        ('session_start', 'session_start'),
+        ('session_end', 'session_end'),
+        ('ip_address', 'ip_address'),
+        ('user_agent', 'user_agent'),
+        ('archived_at', 'archived_at'),
+    ), date='session_start', user='user_id'),
+}
+
+
+def setting(name):
+    return getattr(settings, 'DATA_EXPORTS', {}).get(name, DEFAULTS[name])
+
+
+def filename(dataset, fmt, compress):
+    return f"{dataset}.{FORMATS[fmt][1]}" + ('.gz' if compress else '')
+
+
+def rows(dataset, since=None, until=None, users=None, using=None):
+    """values_list queryset of one dataset, in primary key order; [since, until) on its date"""
+    spec = DATASETS[dataset]
+    qs = spec.model.objects.using(using)
+    if since is not None:
+        qs = qs.filter(**{f'{spec.date}__gte': since})
+    if until is not None:
+        qs = qs.filter(**{f'{spec.date}__lt': until})
+    if users:
+        qs = qs.filter(**{f'{spec.user}__in': list(users)})
+    return qs.order_by('pk').values_list(*(lookup for _, lookup in spec.columns))
+
+
+def _cell(value):
+    # Datetimes as ISO 8601 in UTC, like the database stores them
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+class _Encoder:
+    """Turns batches of value tuples into bytes, gzipped when compress is set"""
+
+    def __init__(self, dataset, fmt, compress):
+        self.headers = [header for header, _ in DATASETS[dataset].columns]
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer) if fmt == 'csv' else None
+        self.zip = zlib.compressobj(setting('GZIP_LEVEL'), zlib.DEFLATED, 31) if compress else None
+
+    def _out(self, text, final=False):
+        data = text.encode()
+        if self.zip is None:
+            return data
+        # Sync-flush each piece so the client gets it now, not when the compressor fills up
+        return self.zip.compress(data) + self.zip.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    def _take(self):
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+    def start(self):
+        if self.writer is not None:
+            self.writer.writerow(self.headers)
+        return self._out(self._take())
+
+    def batch(self, batch):
+        if self.writer is not None:
+            self.writer.writerows([[_cell(value) for value in row] for row in batch])
+        else:
+            for row in batch:
+                self.buffer.write(json.dumps(dict(zip(self.headers, map(_cell, row)))))
+                self.buffer.write('\n')
+        return self._out(self._take())
+
+    def finish(self):
+        return self._out('', final=True) if self.zip is not None else b''
+
+
+def stream(dataset, fmt='csv', compress=False, since=None, until=None, users=None, using=None):
+    """Yield the export as bytes pieces, one per CHUNK_SIZE rows"""
+    encoder = _Encoder(dataset, fmt, compress)
+    size = setting('CHUNK_SIZE')
+    yield encoder.start()
+    batch = []
+    for row in rows(dataset, since, until, users, using).iterator(chunk_size=size):
+        batch.append(row)
+        if len(batch) >= size:
+            yield encoder.batch(batch)
+            batch = []
+    if batch:
+        yield encoder.batch(batch)
+    tail = encoder.finish()
+    if tail:
+        yield tail
+
+
+async def astream(dataset, fmt='csv', compress=False, since=None, until=None, users=None, using=None):
+    """stream() for ASGI: each piece is produced in a worker thread"""
+    pieces = stream(dataset, fmt, compress, since=since, until=until, users=users, using=using)
+    try:
+        while True:
+            piece = await sync_to_async(next)(pieces, None)
+            if piece is None:
+                return
+            yield piece
+    finally:
+        # Client went away mid-export: close the cursor in the thread that opened it
+        await sync_to_async(pieces.close)()
@@ -0,0 +1,142 @@
+"""
+Liveness/readiness checks for load balancers and process monitors
+
+Readiness runs a `SELECT 1` on every configured database plus a migration
+state check, but the result is memoized per process for HEALTH_CHECKS
+['READY_TTL'] seconds and only one thread refreshes it at a time, so a probe
+storm costs at most one round trip per worker per TTL. Detailed stats (user
+counts) are computed in a background thread and shared through the cache.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.utils import timezone
+
+DEFAULTS = {
+    'READY_TTL': 5,         # seconds a readiness result is reused
+    'MIGRATIONS_TTL': 300,  # migrations only change on deploy
+    'STATS_TTL': 60,        # seconds between background stats refreshes
+}
+
+STATS_KEY = 'health:stats'
+STATS_LOCK_KEY = 'health:stats:refreshing'
+
+
+def setting(name):
+    return getattr(settings, 'HEALTH_CHECKS', {}).get(name, DEFAULTS[name])
+
+
+class Memo:
+    """
+    Process-local memo of a check result. While one thread refreshes an
+    expired value, concurrent callers get the previous result instead of
+    running the check again.
+    """
+
+    def __init__(self, compute, ttl_setting):
+        self.compute = compute
+        self.ttl_setting = ttl_setting
+        self.lock = threading.Lock()
+        self.value = None
+        self.expires = 0.0
+
+    def get(self):
+        if self.value is not None and time.monotonic() < self.expires:
+            return self.value
+        if not self.lock.acquire(blocking=self.value is None):
+            return self.value
+        try:
+            if self.value is None or time.monotonic() >= self.expires:
+                self.value = self.compute()
+                self.expires = time.monotonic() + setting(self.ttl_setting)
+            return self.value
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.value = None
+        self.expires = 0.0
+
+
+def check_databases():
+    """SELECT 1 on every database; reuses the persistent connection if open"""
+    results = {}
+    for alias in connections:
+        conn = connections[alias]
+        reused = conn.connection is not None
+        started = time.perf_counter()
+        try:
+            conn.close_if_unusable_or_obsolete()
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+        except Exception as e:
+            results[alias] = {'ok': False, 'error': str(e)}
+            continue
+        results[alias] = {
+            'ok': True,
+            'reused_connection': reused,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        }
+    return results
+
+
+def check_migrations():
+    """Unapplied migrations on the default database"""
+    try:
+        executor = MigrationExecutor(connections[DEFAULT_DB_ALIAS])
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    except Exception as e:
+        return {'ok': False, 'error': str(e)}
+    pending = [f'{migration.app_label}.{migration.name}' for migration, _ in plan]
+    return {'ok': not pending, 'pending': pending}
+
+
+_databases = Memo(check_databases, 'READY_TTL')
+_migrations = Memo(check_migrations, 'MIGRATIONS_TTL')
+
+
+def readiness():
+    """Returns (ready, checks)"""
+    databases = _databases.get()
+    migrations = _migrations.get()
+    ready = all(db['ok'] for db in databases.values()) and migrations['ok']
+    return ready, {'databases': databases, 'migrations': migrations}
+
+
+# -- background stats ---------------------------------------------------------
+
+def compute_stats():
+    from users.models import UserAccount
+
+    stats = {
+        'user_count': UserAccount.objects.count(),
+        'logged_in_count': UserAccount.objects.filter(is_logged_in=True).count(),
+        'computed_at': timezone.now().isoformat(),
+    }
+    cache.set(STATS_KEY, stats, setting('STATS_TTL') * 2)
+    return stats
+
+
+def _refresh_stats():
+    try:
+        compute_stats()
+    except Exception:
+        cache.delete(STATS_LOCK_KEY)
+    finally:
+        connections.close_all()
+
+
+def cached_stats():
+    """
+    Latest stats from the cache (None until the first refresh finishes).
+    At most one worker per STATS_TTL starts a background refresh.
+    """
+    stats = cache.get(STATS_KEY)
+    if cache.add(STATS_LOCK_KEY, True, setting('STATS_TTL')):
+        threading.Thread(target=_refresh_stats, name='health-stats', daemon=True).start()
+    return stats
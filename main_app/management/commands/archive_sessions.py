@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from main_app import retention
+from main_app.models import UserSession
+
+
+class Command(BaseCommand):
+    help = 'Move closed UserSession rows older than the retention window into UserSessionArchive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Archive sessions closed more than N days ago (default: SESSION_RETENTION DAYS)')
+        parser.add_argument('--archive-days', type=int, default=None,
+                            help='Also purge archived sessions closed more than N days ago '
+                                 '(default: SESSION_RETENTION ARCHIVE_DAYS, unset keeps them)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows per batch/transaction (default: SESSION_RETENTION BATCH_SIZE)')
+        parser.add_argument('--max-batches', type=int, default=0,
+                            help='Stop after N batches (0 = until done)')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches to leave room for live traffic')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count what would be archived')
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else retention.policy('DAYS')
+        archive_days = options['archive_days'] if options['archive_days'] is not None else retention.policy('ARCHIVE_DAYS')
+        batch_size = options['batch_size'] or retention.policy('BATCH_SIZE')
+        if days < 0 or batch_size < 1:
+            raise CommandError('--days must be >= 0 and --batch-size >= 1')
+
+        cutoff = retention.cutoff_for(days)
+        if options['dry_run']:
+            count = UserSession.objects.filter(session_end__isnull=False, session_end__lt=cutoff).count()
+            self.stdout.write(f'{count} closed session(s) before {cutoff:%Y-%m-%d %H:%M} would be archived')
+            return
+
+        moved = self._run('Archived', lambda: retention.archive_batch(cutoff, batch_size), options)
+
+        purged = 0
+        if archive_days is not None:
+            archive_cutoff = retention.cutoff_for(archive_days)
+            purged = self._run('Purged', lambda: retention.purge_archive_batch(archive_cutoff, batch_size), options)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: archived {moved} session(s) closed before {cutoff:%Y-%m-%d %H:%M}, purged {purged} archived row(s)'
+        ))
+
+    def _run(self, label, step, options):
+        total = 0
+        batches = 0
+        started = time.monotonic()
+        while True:
+            count = step()
+            if not count:
+                break
+            total += count
+            batches += 1
+            elapsed = max(time.monotonic() - started, 1e-9)
+            self.stdout.write(f'{label} {total} row(s) in {batches} batch(es), {total / elapsed:.0f} rows/s')
+            if options['max_batches'] and batches >= options['max_batches']:
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        return total
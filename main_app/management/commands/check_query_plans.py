@@ -0,0 +1,75 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from users.models import UserAccount
+from main_app.models import UserSession, UserSessionArchive
+
+# A plan line that reads the whole table instead of an index
+FULL_SCAN_PATTERNS = {
+    'sqlite': r'\bSCAN (?:TABLE )?{table}\b(?! USING)',
+    'postgresql': r'Seq Scan on {table}\b',
+}
+
+
+def key_queries():
+    """The hot lookups the indexes in users/main_app migrations exist for"""
+    now = timezone.now()
+    return [
+        ('current open session (logout, end_current)',
+         UserSession.objects.filter(user_account_id=1, session_end__isnull=True).order_by('-session_start')[:1]),
+        ('latest session for account (main_dashboard)',
+         UserSession.objects.filter(user_account_id=1).order_by('-session_start')[:1]),
+        ('admin session_start filter',
+         UserSession.objects.filter(session_start__gte=now - timedelta(days=7))),
+        ('admin session_end filter / retention cutoff',
+         UserSession.objects.filter(session_end__isnull=False, session_end__lt=now).order_by('session_end')[:1000]),
+        ('admin ip_address filter',
+         UserSession.objects.filter(ip_address='10.0.0.1')),
+        ('online accounts',
+         UserAccount.objects.filter(is_logged_in=True)),
+        ('presence / login lookup by user_id',
+         UserAccount.objects.filter(user_id='someone').values('current_session', 'status')),
+        ('dashboard keyset page',
+         UserAccount.objects.filter(user_id__gt='m').order_by('user_id')[:51]),
+        ('archive admin search by user_id',
+         UserSessionArchive.objects.filter(user_id='someone')),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot session/account queries and fail if any of them does a full table scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show-plans', action='store_true', help='Print every plan, not just failures')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f'Query plan checks support SQLite and PostgreSQL, not {vendor}')
+
+        failures = []
+        with transaction.atomic():
+            if vendor == 'postgresql':
+                # Small tables make a seq scan the cheapest plan; we want to
+                # know whether an index *can* serve the query
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for label, queryset in key_queries():
+                plan = queryset.explain()
+                table = re.escape(queryset.model._meta.db_table)
+                full_scan = re.search(FULL_SCAN_PATTERNS[vendor].format(table=table), plan)
+
+                if full_scan:
+                    failures.append(label)
+                    self.stdout.write(self.style.ERROR(f'FULL SCAN  {label}'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'ok         {label}'))
+                if full_scan or options['show_plans']:
+                    self.stdout.write('    ' + plan.replace('\n', '\n    '))
+
+        if failures:
+            raise CommandError(f'{len(failures)} query plan(s) use a full table scan: {", ".join(failures)}')
@@ -0,0 +1,57 @@
+import sys
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from internet_art_tools import replicas
+from main_app import exports
+
+
+def _bound(value):
+    parsed = datetime.fromisoformat(value)
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+class Command(BaseCommand):
+    help = 'Stream accounts or session history to a CSV/NDJSON file (or stdout), optionally gzipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(exports.DATASETS))
+        parser.add_argument('--format', choices=list(exports.FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output (gzip)')
+        parser.add_argument('--since', type=_bound,
+                            help='Only rows on/after this date or datetime (last_login for accounts, '
+                                 'session_start otherwise)')
+        parser.add_argument('--until', type=_bound, help='Only rows before this date or datetime')
+        parser.add_argument('--user', action='append', default=[], help='Only this user_id (repeatable)')
+        parser.add_argument('--output', '-o', default='-',
+                            help='File to write (default: stdout)')
+        parser.add_argument('--database',
+                            help='Database alias to read from (default: a replica if there is one)')
+
+    def handle(self, *args, **options):
+        if options['since'] and options['until'] and options['since'] >= options['until']:
+            raise CommandError('--since must be before --until')
+
+        pieces = exports.stream(options['dataset'], options['format'], options['gzip'],
+                                since=options['since'], until=options['until'], users=options['user'],
+                                using=options['database'] or replicas.read_alias())
+        started = time.monotonic()
+        written = 0
+        out = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for piece in pieces:
+                out.write(piece)
+                written += len(piece)
+            out.flush()
+        except BrokenPipeError:
+            # Reader went away (`| head`); stop the query instead of failing
+            pieces.close()
+            return
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {written} bytes to {options['output']} in {time.monotonic() - started:.1f}s"))
@@ -0,0 +1,55 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from main_app import rollups
+
+
+class Command(BaseCommand):
+    help = 'Update the hourly/daily SessionRollup rows from the sessions started or ended since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep updating every --interval seconds instead of once')
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Seconds between updates with --loop (default: SESSION_ROLLUPS['INTERVAL'])")
+        parser.add_argument('--backfill', action='store_true',
+                            help='Recompute every day from --since to --until instead')
+        parser.add_argument('--since', type=date.fromisoformat,
+                            help='First day to backfill (YYYY-MM-DD, default: the oldest session)')
+        parser.add_argument('--until', type=date.fromisoformat,
+                            help='Last day to backfill (YYYY-MM-DD, default: today)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Days computed in parallel (default: SESSION_ROLLUPS['WORKERS'] for "
+                                 "--backfill, 1 otherwise)")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers is not None and workers < 1:
+            raise CommandError('--workers must be >= 1')
+
+        if options['backfill']:
+            since = options['since'] or rollups.first_day()
+            if since is None:
+                self.stdout.write('No sessions to backfill')
+                return
+            started = time.monotonic()
+            days = rollups.backfill(since, options['until'], workers)
+            self.stdout.write(self.style.SUCCESS(
+                f'Backfilled {days} day(s) from {since} in {time.monotonic() - started:.1f}s'))
+            return
+
+        interval = options['interval'] or rollups.setting('INTERVAL')
+        if interval <= 0:
+            raise CommandError('--interval must be positive')
+        while True:
+            days = rollups.update(workers=workers or 1)
+            if days:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Updated {len(days)} day(s): {", ".join(str(day) for day in days[:10])}'
+                    + (' ...' if len(days) > 10 else '')))
+            elif not options['loop']:
+                self.stdout.write('Rollups up to date')
+            if not options['loop']:
+                return
+            time.sleep(interval)
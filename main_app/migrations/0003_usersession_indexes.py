@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0002_usersessionarchive'),
+        ('users', '0003_useraccount_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['user_account', '-session_start'], name='usersession_account_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(condition=models.Q(('session_end__isnull', True)), fields=['user_account', '-session_start'], name='usersession_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['session_start'], name='usersession_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['session_end'], name='usersession_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['ip_address'], name='usersession_ip_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:11
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0003_usersession_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usersession',
+            name='session_start',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
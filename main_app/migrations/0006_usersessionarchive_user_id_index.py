@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0005_session_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usersessionarchive',
+            name='user_id',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+    ]
@@ -1,13 +1,111 @@
 from django.db import models
+from django.db.models import Subquery
+from django.utils import timezone
 from users.models import UserAccount
 
+class UserSessionQuerySet(models.QuerySet):
+    def _current(self, user_id, started=None):
+        open_rows = self.filter(user_account__user_id=user_id, session_end__isnull=True)
+        if started is not None:
+            return open_rows.filter(session_start=started)
+        newest = open_rows.order_by('-session_start').values('pk')[:1]
+        return self.filter(pk__in=Subquery(newest))
+
+    def end_current(self, user_id, at=None, started=None):
+        """
+        Close user_id's open session that started at `started`, or the newest
+        open one, with a single UPDATE
+        """
+        return self._current(user_id, started).update(session_end=at or timezone.now())
+
+    async def aend_current(self, user_id, at=None, started=None):
+        return await self._current(user_id, started).aupdate(session_end=at or timezone.now())
+
+    def end_open(self, account_ids, at=None):
+        """Close every open session of the given accounts with one UPDATE"""
+        return (self.filter(user_account_id__in=account_ids, session_end__isnull=True)
+                .update(session_end=at or timezone.now()))
+
 class UserSession(models.Model):
     """Track user sessions for the main app"""
     user_account = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
-    session_start = models.DateTimeField(auto_now_add=True)
+    # Set by the caller (main_app.audit writes rows after the login happened)
+    session_start = models.DateTimeField(default=timezone.now, editable=False)
     session_end = models.DateTimeField(null=True, blank=True)
     ip_address = models.GenericIPAddressField()
     user_agent = models.TextField(blank=True)
+
+    objects = UserSessionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Latest session for an account (main_dashboard)
+            models.Index(fields=['user_account', '-session_start'], name='usersession_account_start_idx'),
+            # Current open session for an account (logout paths, end_current)
+            models.Index(fields=['user_account', '-session_start'], condition=models.Q(session_end__isnull=True),
+                         name='usersession_open_idx'),
+            # Admin date filters and retention cutoffs
+            models.Index(fields=['session_start'], name='usersession_start_idx'),
+            models.Index(fields=['session_end'], name='usersession_end_idx'),
+            models.Index(fields=['ip_address'], name='usersession_ip_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user_account.user_id} - {self.session_start}"
+
+class UserSessionArchive(models.Model):
+    """Closed UserSession rows moved out of the hot table by archive_sessions"""
+    original_id = models.BigIntegerField(unique=True)
+    # Plain columns, not a ForeignKey: archived history outlives the account
+    user_account_id = models.BigIntegerField(db_index=True)
+    user_id = models.CharField(max_length=50, db_index=True)  # admin prefix search
+    session_start = models.DateTimeField()
+    session_end = models.DateTimeField(db_index=True)
+    ip_address = models.GenericIPAddressField()
+    user_agent = models.TextField(blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.session_start} (archived)"
+
+class SessionRollup(models.Model):
+    """
+    UserSession aggregates for one hour or one day (project time zone),
+    maintained by main_app.rollups. Durations count sessions that started
+    in the bucket and have ended.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIODS = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    period = models.CharField(max_length=4, choices=PERIODS)
+    start = models.DateTimeField()
+    logins = models.PositiveIntegerField(default=0)
+    unique_users = models.PositiveIntegerField(default=0)
+    distinct_ips = models.PositiveIntegerField(default=0)
+    completed_sessions = models.PositiveIntegerField(default=0)
+    total_duration = models.BigIntegerField(default=0, help_text='Seconds, over completed sessions')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'start'], name='sessionrollup_period_start_uniq'),
+        ]
+
+    @property
+    def avg_duration(self):
+        """Seconds, or None while no session of the bucket has ended"""
+        if not self.completed_sessions:
+            return None
+        return self.total_duration / self.completed_sessions
+
+    def __str__(self):
+        return f"{self.period} {self.start:%Y-%m-%d %H:%M}: {self.logins} logins"
+
+class RollupCursor(models.Model):
+    """High-water marks of main_app.rollups (session_start and session_end)"""
+    name = models.CharField(max_length=32, primary_key=True)
+    position = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
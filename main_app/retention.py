@@ -0,0 +1,77 @@
+"""
+Retention policy for UserSession history
+
+Closed sessions older than SESSION_RETENTION['DAYS'] are copied to
+UserSessionArchive and deleted from the hot table in small batches, each in
+its own transaction, so the hot table only holds recent and open sessions
+and no batch holds locks for long. Archived rows can be purged after
+SESSION_RETENTION['ARCHIVE_DAYS'] (None keeps them forever).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import UserSession, UserSessionArchive
+
+DEFAULTS = {
+    'DAYS': 90,
+    'ARCHIVE_DAYS': None,
+    'BATCH_SIZE': 1000,
+}
+
+
+def policy(name):
+    return getattr(settings, 'SESSION_RETENTION', {}).get(name, DEFAULTS[name])
+
+
+def archive_batch(cutoff, batch_size):
+    """Move one batch of sessions closed before cutoff, returns rows moved"""
+    with transaction.atomic():
+        rows = list(
+            UserSession.objects
+            .filter(session_end__isnull=False, session_end__lt=cutoff)
+            .order_by('session_end')
+            .values('pk', 'user_account_id', 'user_account__user_id', 'session_start',
+                    'session_end', 'ip_address', 'user_agent')[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        UserSessionArchive.objects.bulk_create(
+            [
+                UserSessionArchive(
+                    original_id=row['pk'],
+                    user_account_id=row['user_account_id'],
+                    user_id=row['user_account__user_id'],
+                    session_start=row['session_start'],
+                    session_end=row['session_end'],
+                    ip_address=row['ip_address'],
+                    user_agent=row['user_agent'],
+                )
+                for row in rows
+            ],
+            # A batch interrupted after the copy must not fail on rerun
+            ignore_conflicts=True,
+        )
+        UserSession.objects.filter(pk__in=[row['pk'] for row in rows]).delete()
+    return len(rows)
+
+
+def purge_archive_batch(cutoff, batch_size):
+    """Delete one batch of archived sessions closed before cutoff"""
+    pks = list(
+        UserSessionArchive.objects
+        .filter(session_end__lt=cutoff)
+        .values_list('pk', flat=True)[:batch_size]
+    )
+    if not pks:
+        return 0
+    with transaction.atomic():
+        UserSessionArchive.objects.filter(pk__in=pks).delete()
+    return len(pks)
+
+
+def cutoff_for(days, now=None):
+    return (now or timezone.now()) - timedelta(days=days)
@@ -0,0 +1,196 @@
+"""
+Hourly and daily UserSession rollups
+
+SessionRollup holds, per hour and per day (in the project time zone),
+logins, unique users, distinct IPs, and the number and total duration of
+the sessions that started in that bucket and have ended. Reports read only
+those rows; nothing scans UserSession to answer them.
+
+update() keeps them current from two high-water marks (RollupCursor): every
+session that started, or ended, after the last run marks the day it
+started in as dirty, and each dirty day is recomputed from its own sessions
+(two grouped queries on the session_start index) and rewritten in one
+transaction. Distinct counts can't be added up incrementally, but a day is
+small, so recomputing it is cheap and exact, and rerunning is harmless.
+Marks stop LAG seconds short of now, because main_app.audit writes rows
+with their real login/logout time a little after the fact.
+
+backfill() recomputes a range of days, a day per task on `workers` threads
+(one at a time on SQLite); each task holds one day's aggregates, so memory
+doesn't grow with history.
+Days older than the UserSession retention window are skipped by update()
+and backfill(): their sessions may already be archived, so their rollups
+are final.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from . import retention
+from .models import RollupCursor, SessionRollup, UserSession
+
+DEFAULTS = {
+    'LAG': 300,        # seconds the marks stay behind now (audit write-behind)
+    'INTERVAL': 300,   # seconds between runs of `rollup_sessions --loop`
+    'WORKERS': 4,      # threads for backfill
+    'MAX_BUCKETS': 2000,  # largest answer of the analytics API
+}
+
+START = 'session_start'
+END = 'session_end'
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def setting(name):
+    return getattr(settings, 'SESSION_ROLLUPS', {}).get(name, DEFAULTS[name])
+
+
+def _tz():
+    return timezone.get_default_timezone()
+
+
+def day_bounds(day):
+    start = datetime(day.year, day.month, day.day, tzinfo=_tz())
+    return start, start + timedelta(days=1)
+
+
+def _aggregates():
+    duration = ExpressionWrapper(F('session_end') - F('session_start'), output_field=DurationField())
+    return {
+        'logins': Count('pk'),
+        'unique_users': Count('user_account', distinct=True),
+        'distinct_ips': Count('ip_address', distinct=True),
+        'completed_sessions': Count('session_end'),
+        'total_duration': Sum(duration),
+    }
+
+
+def _rollup(period, start, values):
+    total = values['total_duration']
+    return SessionRollup(
+        period=period,
+        start=start,
+        logins=values['logins'],
+        unique_users=values['unique_users'],
+        distinct_ips=values['distinct_ips'],
+        completed_sessions=values['completed_sessions'],
+        total_duration=int(total.total_seconds()) if total else 0,
+    )
+
+
+def rollup_day(day):
+    """Recompute the hourly and daily rows of one day. Returns rows written."""
+    start, end = day_bounds(day)
+    sessions = UserSession.objects.filter(session_start__gte=start, session_start__lt=end)
+    hourly = (sessions
+              .annotate(bucket=TruncHour('session_start', tzinfo=_tz()))
+              .values('bucket')
+              .annotate(**_aggregates())
+              .order_by())
+    rows = [_rollup(SessionRollup.HOUR, values['bucket'], values) for values in hourly]
+    if rows:
+        rows.append(_rollup(SessionRollup.DAY, start, sessions.aggregate(**_aggregates())))
+
+    with transaction.atomic():
+        SessionRollup.objects.filter(start__gte=start, start__lt=end).delete()
+        SessionRollup.objects.bulk_create(rows)
+    return len(rows)
+
+
+def _rollup_day_thread(day):
+    try:
+        return rollup_day(day)
+    finally:
+        connections.close_all()  # this worker thread's own connections
+
+
+def dirty_days(start_after, end_after, until):
+    """Days (start date of the session) touched by logins or logouts in the window"""
+    started = (UserSession.objects
+               .filter(session_start__gt=start_after, session_start__lte=until)
+               .annotate(day=TruncDate('session_start', tzinfo=_tz()))
+               .values_list('day', flat=True)
+               .distinct()
+               .order_by())
+    ended = (UserSession.objects
+             .filter(session_end__gt=end_after, session_end__lte=until)
+             .annotate(day=TruncDate('session_start', tzinfo=_tz()))
+             .values_list('day', flat=True)
+             .distinct()
+             .order_by())
+    return sorted(set(started) | set(ended))
+
+
+def _cursors():
+    return dict(RollupCursor.objects.values_list('name', 'position'))
+
+
+def _advance(until):
+    for name in (START, END):
+        RollupCursor.objects.update_or_create(name=name, defaults={'position': until})
+
+
+def _floor(now):
+    """Oldest day whose sessions are all still in UserSession"""
+    return timezone.localtime(retention.cutoff_for(retention.policy('DAYS'), now), _tz()).date()
+
+
+def update(now=None, workers=1):
+    """Bring rollups up to now - LAG. Returns the days recomputed."""
+    now = now or timezone.now()
+    until = now - timedelta(seconds=setting('LAG'))
+    cursors = _cursors()
+    days = dirty_days(cursors.get(START, EPOCH), cursors.get(END, EPOCH), until)
+
+    floor = _floor(now)
+    days = [day for day in days if day >= floor]
+    _run(days, workers)
+    _advance(until)
+    return days
+
+
+def backfill(since, until=None, workers=None, now=None):
+    """
+    Recompute every day from `since` to `until` (dates, inclusive; until
+    defaults to today) on `workers` threads. Days past the retention window
+    are left alone, like in update(). If update() has never run, its marks
+    start at now - LAG, so it carries on from the backfill.
+    Returns the number of days processed.
+    """
+    now = now or timezone.now()
+    until = until or timezone.localtime(now, _tz()).date()
+    since = max(since, _floor(now))
+    days = [since + timedelta(days=offset) for offset in range((until - since).days + 1)]
+    _run(days, workers or setting('WORKERS'))
+    if not RollupCursor.objects.exists():
+        _advance(now - timedelta(seconds=setting('LAG')))
+    return len(days)
+
+
+def _run(days, workers):
+    # SQLite takes one writer at a time; threads would only contend for it
+    if workers <= 1 or len(days) <= 1 or connection.vendor == 'sqlite':
+        for day in days:
+            rollup_day(day)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(_rollup_day_thread, days):
+            pass
+
+
+def first_day():
+    """Day of the oldest session still in UserSession, or None"""
+    oldest = UserSession.objects.order_by('session_start').values_list('session_start', flat=True).first()
+    return timezone.localtime(oldest, _tz()).date() if oldest else None
+
+
+def buckets(period, since, until):
+    """Rollup rows of `period` starting in [since, until), oldest first"""
+    return (SessionRollup.objects
+            .filter(period=period, start__gte=since, start__lt=until)
+            .order_by('start'))
@@ -0,0 +1,13 @@
+from users.heartbeat import presence_expired
+
+from . import audit
+from .models import UserSession
+
+
+def close_expired_sessions(sender, pks, at, **kwargs):
+    """The heartbeat reaper logged these accounts out; end their open UserSessions"""
+    audit.flush()  # so sessions still in this worker's audit buffer are closed too
+    UserSession.objects.end_open(pks, at)
+
+
+presence_expired.connect(close_expired_sessions, dispatch_uid='main_app.close_expired_sessions')
@@ -0,0 +1,404 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.utils import timezone
+from users.models import UserAccount
+from users.passwords import hash_password
+from users.session_store import SessionStore
+
+from . import async_api_views, audit, exports, health, retention, rollups
+from .management.commands.check_query_plans import FULL_SCAN_PATTERNS
+from .models import SessionRollup, UserSession, UserSessionArchive
+
+
+@override_settings(SESSION_AUDIT={'MODE': 'sync'}, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AsyncApiTests(TestCase):
+    """The async views keep the sync views' contract"""
+
+    def setUp(self):
+        cache.clear()
+        UserAccount.objects.create(user_id='alice', password=hash_password('secret'))
+        self.session = SessionStore()
+
+    def request(self, method, body=None):
+        factory = AsyncRequestFactory()
+        if method == 'post':
+            request = factory.post('/app/api/', json.dumps(body or {}), content_type='application/json')
+        else:
+            request = factory.get('/app/api/')
+        request.session = self.session
+        return request
+
+    async def login(self, password='secret'):
+        return await async_api_views.api_login(self.request('post', {'username': 'alice', 'password': password}))
+
+    async def test_login_status_logout(self):
+        response = await self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['user']['id'], 'alice')
+        status = json.loads((await async_api_views.api_status(self.request('get'))).content)
+        self.assertTrue(status['authenticated'])
+        account = await UserAccount.objects.aget(user_id='alice')
+        self.assertTrue(account.is_logged_in)
+        self.assertEqual(await UserSession.objects.filter(session_end=None).acount(), 1)
+
+        response = await async_api_views.api_logout(self.request('post'))
+        self.assertTrue(json.loads(response.content)['success'])
+        account = await UserAccount.objects.aget(user_id='alice')
+        self.assertFalse(account.is_logged_in)
+        self.assertEqual(await UserSession.objects.filter(session_end=None).acount(), 0)
+        status = json.loads((await async_api_views.api_status(self.request('get'))).content)
+        self.assertFalse(status['authenticated'])
+
+    async def test_wrong_password_is_refused(self):
+        response = await self.login(password='wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertIsNone(await self.session.aget('user_id'))
+
+    async def test_heartbeat_needs_a_login(self):
+        self.assertEqual((await async_api_views.api_heartbeat(self.request('post'))).status_code, 401)
+        await self.login()
+        self.assertEqual((await async_api_views.api_heartbeat(self.request('post'))).status_code, 200)
+
+
+class HealthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for memo in (health._databases, health._migrations):
+            memo.clear()
+            self.addCleanup(memo.clear)
+
+    def test_liveness_skips_the_database(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/app/api/health/live/')
+        self.assertEqual(response.json()['status'], 'alive')
+
+    def test_readiness_is_memoized(self):
+        response = self.client.get('/app/api/health/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['checks']['migrations']['ok'])
+        with mock.patch.object(health._databases, 'compute') as compute:
+            self.client.get('/app/api/health/ready/')
+        compute.assert_not_called()
+
+    def test_failed_database_is_not_ready(self):
+        failed = {'default': {'ok': False, 'error': 'down'}}
+        with mock.patch.object(health._databases, 'compute', return_value=failed):
+            response = self.client.get('/app/api/health/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['checks']['databases'], failed)
+
+    def test_health_serves_cached_stats(self):
+        stats = {'user_count': 7, 'logged_in_count': 2, 'computed_at': timezone.now().isoformat()}
+        cache.set(health.STATS_KEY, stats)
+        cache.add(health.STATS_LOCK_KEY, True)  # a refresh is already running
+        self.client.get('/app/api/health/ready/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/app/api/health/')
+        self.assertEqual((response.json()['user_count'], response.json()['logged_in_count']), (7, 2))
+
+    def test_stats_refresh_at_most_once_per_ttl(self):
+        with mock.patch.object(health.threading, 'Thread') as thread:
+            self.assertIsNone(health.cached_stats())
+            health.cached_stats()
+        self.assertEqual(thread.call_count, 1)
+
+
+@override_settings(DATA_EXPORTS={'CHUNK_SIZE': 2})
+class ExportTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        for n, user_id in enumerate(('alice', 'bob', 'carol')):
+            UserAccount.objects.create(user_id=user_id, password='x', last_login=self.now - timedelta(days=n))
+
+    def export(self, *args, **kwargs):
+        return b''.join(exports.stream(*args, **kwargs))
+
+    def test_csv_in_chunks(self):
+        pieces = list(exports.stream('accounts'))
+        # header, then two rows per piece
+        self.assertEqual(len(pieces), 3)
+        lines = b''.join(pieces).decode().splitlines()
+        self.assertEqual(lines[0], 'user_id,status,is_logged_in,device_ip,last_login,last_seen')
+        self.assertEqual(lines[1], f'alice,True,False,,{self.now.isoformat()},')
+        self.assertEqual(len(lines), 4)
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.export('accounts', 'ndjson').splitlines()]
+        self.assertEqual([row['user_id'] for row in rows], ['alice', 'bob', 'carol'])
+        self.assertEqual(rows[0]['last_login'], self.now.isoformat())
+
+    def test_gzip(self):
+        self.assertEqual(gzip.decompress(self.export('accounts', 'ndjson', compress=True)),
+                         self.export('accounts', 'ndjson'))
+
+    def test_filters(self):
+        rows = self.export('accounts', 'ndjson', since=self.now - timedelta(days=1, hours=1),
+                           until=self.now, users=['alice', 'bob', 'carol'])
+        self.assertEqual([json.loads(line)['user_id'] for line in rows.splitlines()], ['bob'])
+
+    def test_astream_matches_stream(self):
+        async def collect():
+            return b''.join([piece async for piece in exports.astream('accounts', 'csv', compress=True)])
+        self.assertEqual(gzip.decompress(async_to_sync(collect)()), self.export('accounts'))
+
+    def test_api_is_staff_only(self):
+        self.assertEqual(self.client.get('/app/api/export/accounts/').status_code, 403)
+        admin = User.objects.create_superuser('export-admin', 'admin@example.com', 'x')
+        UserAccount.objects.create(user_id='export-admin', password='x')
+        self.client.force_login(admin, backend='django.contrib.auth.backends.ModelBackend')
+        UserAccount.objects.filter(user_id='export-admin').update(
+            is_logged_in=True, current_session=self.client.session.session_key)
+        response = self.client.get('/app/api/export/accounts/', {'format': 'ndjson', 'user': 'bob'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="accounts.ndjson"')
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['user_id'], 'bob')
+        self.assertEqual(self.client.get('/app/api/export/nothing/').status_code, 404)
+        self.assertEqual(self.client.get('/app/api/export/accounts/', {'format': 'xml'}).status_code, 400)
+
+    def test_export_data_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'accounts.csv.gz')
+            call_command('export_data', 'accounts', '--gzip', '--user', 'carol', '-o', path, stdout=StringIO())
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual([line.split(',')[0] for line in f.read().splitlines()], ['user_id', 'carol'])
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'sessions', '--since', '2024-02-01', '--until', '2024-01-01')
+
+
+class QueryPlanTests(TestCase):
+    """The hot session/account lookups must be served by an index"""
+
+    def setUp(self):
+        if connection.vendor not in FULL_SCAN_PATTERNS:
+            self.skipTest(f'no plan checks for {connection.vendor}')
+
+    def test_full_scan_is_detected(self):
+        # user_agent has no index: the pattern has to catch this plan
+        plan = UserSession.objects.filter(user_agent='x').explain()
+        pattern = FULL_SCAN_PATTERNS[connection.vendor].format(table=re.escape(UserSession._meta.db_table))
+        self.assertIsNotNone(re.search(pattern, plan), plan)
+
+    def test_check_query_plans_command_passes(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+
+class AuditTests(TestCase):
+    """An end closes the session it belongs to, not the account's newest"""
+
+    def setUp(self):
+        # Events buffered by other tests' logins refer to rolled-back accounts
+        with audit._lock:
+            audit._starts.clear()
+            audit._ends.clear()
+            audit._open.clear()
+        self.account = UserAccount.objects.create(user_id='alice', password='x')
+        self.first = timezone.now() - timedelta(minutes=5)
+        self.second = self.first + timedelta(minutes=1)
+        self.addCleanup(audit.flush)
+
+    def start_both(self):
+        for when in (self.first, self.second):
+            self.assertEqual(audit.session_started(self.account.pk, 'alice', '10.0.0.1', when=when), when)
+
+    def ends(self):
+        return list(UserSession.objects.order_by('session_start').values_list('session_end', flat=True))
+
+    def check_first_closed(self):
+        first_end, second_end = self.ends()
+        self.assertIsNotNone(first_end)
+        self.assertIsNone(second_end)
+
+    @override_settings(SESSION_AUDIT={'MODE': 'sync'})
+    def test_sync(self):
+        self.start_both()
+        audit.session_ended('alice', started=self.first.isoformat())
+        self.check_first_closed()
+
+    @override_settings(SESSION_AUDIT={'BACKGROUND': False})
+    def test_buffered_start_closed_in_buffer(self):
+        self.start_both()
+        audit.session_ended('alice', started=self.first.isoformat())
+        audit.flush()
+        self.check_first_closed()
+
+    @override_settings(SESSION_AUDIT={'BACKGROUND': False})
+    def test_buffered_end_of_written_start(self):
+        self.start_both()
+        audit.flush()
+        audit.session_ended('alice', started=self.first)
+        audit.flush()
+        self.check_first_closed()
+
+    @override_settings(SESSION_AUDIT={'BACKGROUND': False})
+    def test_end_without_start_closes_newest(self):
+        self.start_both()
+        audit.flush()
+        audit.session_ended('alice')
+        audit.flush()
+        first_end, second_end = self.ends()
+        self.assertIsNone(first_end)
+        self.assertIsNotNone(second_end)
+
+    @override_settings(SESSION_AUDIT={'BACKGROUND': False})
+    def test_end_of_already_closed_session_closes_nothing(self):
+        self.start_both()
+        audit.flush()
+        UserSession.objects.end_open([self.account.pk])
+        closed = self.ends()
+        audit.session_ended('alice', started=self.first)
+        audit.flush()
+        self.assertEqual(self.ends(), closed)
+        self.assertEqual(audit.pending(), 0)
+
+    @override_settings(SESSION_AUDIT={'BACKGROUND': False})
+    def test_end_waits_for_start_buffered_elsewhere(self):
+        # The start is still in another worker's buffer when this end is flushed
+        audit.session_ended('alice', started=self.first)
+        audit.flush()
+        self.assertEqual(audit.pending(), 1)
+        UserSession.objects.create(user_account=self.account, session_start=self.first, ip_address='10.0.0.2')
+        audit.flush()
+        self.assertEqual(audit.pending(), 0)
+        self.assertIsNotNone(self.ends()[0])
+
+    @override_settings(SESSION_AUDIT={'BACKGROUND': False, 'END_WAIT': 60})
+    def test_end_waiting_too_long_is_dropped(self):
+        audit.session_ended('alice', started=self.first, when=timezone.now() - timedelta(seconds=61))
+        with self.assertLogs(audit.logger, 'WARNING'):
+            audit.flush()
+        self.assertEqual(audit.pending(), 0)
+
+    @override_settings(SESSION_AUDIT={'BACKGROUND': False},
+                       PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_logout_closes_its_own_browser_session(self):
+        UserAccount.objects.filter(pk=self.account.pk).update(password=hash_password('secret'))
+        browsers = [self.client_class(), self.client_class()]
+        for browser in browsers:
+            browser.post('/app/login/', {'username': 'alice', 'password': 'secret'})
+        audit.flush()
+        browsers[0].get('/app/logout/')
+        audit.flush()
+        first_end, second_end = self.ends()
+        self.assertIsNotNone(first_end)
+        self.assertIsNone(second_end)
+
+
+@override_settings(SESSION_RETENTION={'DAYS': 90}, SESSION_ROLLUPS={'LAG': 0})
+class RollupTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.alice = UserAccount.objects.create(user_id='alice', password='x')
+        self.bob = UserAccount.objects.create(user_id='bob', password='x')
+        # Noon, so every session of the test stays in one local day
+        self.start = timezone.localtime(self.now - timedelta(days=2)).replace(hour=12, minute=0)
+        self.session(self.alice, self.start, minutes=10)
+        self.session(self.alice, self.start + timedelta(minutes=20), minutes=5)
+        self.session(self.bob, self.start, ip='10.0.0.2')
+        self.day = timezone.localtime(self.start).date()
+
+    def session(self, account, start, minutes=None, ip='10.0.0.1'):
+        end = start + timedelta(minutes=minutes) if minutes is not None else None
+        return UserSession.objects.create(user_account=account, session_start=start, session_end=end, ip_address=ip)
+
+    def daily(self, day):
+        return SessionRollup.objects.get(period=SessionRollup.DAY, start=rollups.day_bounds(day)[0])
+
+    def test_day_rollup(self):
+        rollups.rollup_day(self.day)
+        daily = self.daily(self.day)
+        self.assertEqual((daily.logins, daily.unique_users, daily.distinct_ips), (3, 2, 2))
+        self.assertEqual((daily.completed_sessions, daily.total_duration), (2, 15 * 60))
+        hours = SessionRollup.objects.filter(period=SessionRollup.HOUR)
+        self.assertEqual(sum(hours.values_list('logins', flat=True)), 3)
+
+    def test_update_recomputes_only_touched_days(self):
+        rollups.update(now=self.now)
+        self.assertEqual(self.daily(self.day).logins, 3)
+        login = self.now + timedelta(seconds=30)
+        self.session(self.bob, login)
+        later = self.now + timedelta(minutes=1)
+        self.assertEqual(rollups.update(now=later), [timezone.localtime(login).date()])
+        self.assertEqual(rollups.update(now=later), [])
+
+    def test_update_closes_session_of_an_earlier_day(self):
+        rollups.update(now=self.now)
+        UserSession.objects.filter(user_account=self.bob).update(session_end=self.now + timedelta(seconds=30))
+        self.assertEqual(rollups.update(now=self.now + timedelta(minutes=1)), [self.day])
+        self.assertEqual(self.daily(self.day).completed_sessions, 3)
+
+    def test_backfill_leaves_days_past_retention_alone(self):
+        # Sessions of that day were archived; its rollup is final
+        old_day = timezone.localtime(self.now - timedelta(days=120)).date()
+        SessionRollup.objects.create(period=SessionRollup.DAY, start=rollups.day_bounds(old_day)[0], logins=5)
+        self.assertEqual(rollups.backfill(old_day, now=self.now), 91)
+        self.assertEqual(self.daily(old_day).logins, 5)
+        self.assertEqual(self.daily(self.day).logins, 3)
+
+
+@override_settings(SESSION_RETENTION={'DAYS': 90, 'BATCH_SIZE': 2})
+class RetentionTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.alice = UserAccount.objects.create(user_id='alice', password='x')
+        self.bob = UserAccount.objects.create(user_id='bob', password='x')
+        old = now - timedelta(days=100)
+        for account in (self.alice, self.alice, self.bob):
+            UserSession.objects.create(user_account=account, session_start=old, session_end=old + timedelta(hours=1),
+                                       ip_address='10.0.0.1')
+        # Still open, and recently closed: both stay
+        UserSession.objects.create(user_account=self.bob, session_start=old, ip_address='10.0.0.1')
+        UserSession.objects.create(user_account=self.bob, session_start=now - timedelta(days=1),
+                                   session_end=now, ip_address='10.0.0.1')
+
+    def archive(self, *args):
+        call_command('archive_sessions', *args, stdout=StringIO())
+
+    def test_old_closed_sessions_are_moved(self):
+        self.archive()
+        self.assertEqual(UserSession.objects.count(), 2)
+        self.assertEqual(sorted(UserSessionArchive.objects.values_list('user_id', flat=True)),
+                         ['alice', 'alice', 'bob'])
+
+    def test_rerun_after_interrupted_batch(self):
+        # A batch that copied its rows but died before deleting them
+        cutoff = retention.cutoff_for(90)
+        with mock.patch.object(QuerySet, 'delete', return_value=(0, {})):
+            retention.archive_batch(cutoff, 2)
+        self.archive()
+        self.assertEqual(UserSessionArchive.objects.count(), 3)
+        self.assertEqual(UserSession.objects.count(), 2)
+
+    def test_archive_purged_after_archive_days(self):
+        self.archive()
+        self.archive('--archive-days', '99')
+        self.assertEqual(UserSessionArchive.objects.count(), 0)
+
+    def test_dry_run_moves_nothing(self):
+        self.archive('--dry-run')
+        self.assertEqual(UserSession.objects.count(), 5)
+
+    def test_admin_searches_archive_by_user_id_prefix(self):
+        self.archive()
+        admin = User.objects.create_superuser('archive-admin', 'admin@example.com', 'x')
+        UserAccount.objects.create(user_id='archive-admin', password='x')
+        self.client.force_login(admin, backend='django.contrib.auth.backends.ModelBackend')
+        UserAccount.objects.filter(user_id='archive-admin').update(
+            is_logged_in=True, current_session=self.client.session.session_key)
+        response = self.client.get('/admin/main_app/usersessionarchive/', {'q': 'ali'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(obj.user_id for obj in response.context['cl'].result_list), ['alice', 'alice'])
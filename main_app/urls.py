@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from . import api_views
+from . import async_api_views
+
+# Under ASGI (API_ASYNC=True) the hot JSON endpoints use the async views
+api = async_api_views if settings.API_ASYNC else api_views
 
 app_name = 'main_app'
 
@@ -12,8 +17,13 @@ urlpatterns = [
     path('logout/', views.main_logout, name='main_logout'),
     
     # API endpoints for AI Mailer Pro
-    path('api/login/', api_views.api_login, name='api_login'),
-    path('api/status/', api_views.api_status, name='api_status'),
-    path('api/logout/', api_views.api_logout, name='api_logout'),
+    path('api/login/', api.api_login, name='api_login'),
+    path('api/status/', api.api_status, name='api_status'),
+    path('api/heartbeat/', api.api_heartbeat, name='api_heartbeat'),
+    path('api/logout/', api.api_logout, name='api_logout'),
     path('api/health/', api_views.api_health, name='api_health'),
+    path('api/analytics/sessions/', api_views.api_session_analytics, name='api_session_analytics'),
+    path('api/export/<str:dataset>/', api_views.api_export, name='api_export'),
+    path('api/health/live/', api_views.api_liveness, name='api_liveness'),
+    path('api/health/ready/', api_views.api_readiness, name='api_readiness'),
 ]
@@ -1,8 +1,14 @@
+import logging
+
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.utils import timezone
+from internet_art_tools.replicas import read_only
 from users.models import UserAccount
+from users import session_state
 from .models import UserSession
+from . import audit
+
+logger = logging.getLogger(__name__)
 
 def main_login(request):
     """Main app login view - uses same UserAccount model"""
@@ -14,68 +20,65 @@ def main_login(request):
         username = request.POST.get('username', '').strip()
         password = request.POST.get('password', '').strip()
         
-        # Debug: Print received credentials
-        print(f"🔍 Main App Login Attempt: username={username}, password={'*' * len(password)}")
+        logger.debug("Main app login attempt: %s", username)
         
         if not username or not password:
             messages.error(request, 'Please enter both username and password')
             return render(request, 'main_app/login.html')
         
         try:
-            # Check if user exists in UserAccount model (same as admin panel)
-            user_account = UserAccount.objects.get(user_id=username)
-            print(f"✅ User found: {user_account.user_id}, status: {user_account.status}")
-            
-            # Check if user is active
-            if not user_account.status:
+            # Check status and password and record the login in one UPDATE
+            # (same rules as admin panel, without single session enforcement)
+            claim = session_state.claim_session(
+                username,
+                password=password,
+                device_ip=request.META.get('REMOTE_ADDR'),
+                exclusive=False,
+            )
+
+            if claim.outcome == session_state.DISABLED:
                 messages.error(request, 'Account is disabled. Please contact administrator.')
                 return render(request, 'main_app/login.html')
-            
-            # Check password (same logic as admin panel)
-            if user_account.password == password:
-                # Update UserAccount with login info
-                user_account.is_logged_in = True
-                user_account.last_login = timezone.now()
-                user_account.device_ip = request.META.get('REMOTE_ADDR')
-                user_account.save()
-                
-                # Create UserSession for main app
-                UserSession.objects.create(
-                    user_account=user_account,
-                    ip_address=request.META.get('REMOTE_ADDR'),
-                    user_agent=request.META.get('HTTP_USER_AGENT', '')
-                )
-                
-                # Store user info in session
-                request.session['user_id'] = user_account.user_id
-                request.session['user_status'] = user_account.status
-                request.session.save()  # Ensure session is saved
-                
-                print(f"✅ Login successful for user: {username}")
-                messages.success(request, f'Welcome back, {username}!')
-                return redirect('main_app:main_dashboard')
-            else:
-                print(f"❌ Password mismatch for user: {username}")
+
+            if claim.outcome == session_state.INVALID_PASSWORD:
+                logger.info("Main app login refused (invalid_password): %s", username)
                 messages.error(request, 'Invalid username or password')
                 return render(request, 'main_app/login.html')
+
+            if claim.outcome == session_state.NOT_FOUND:
+                raise UserAccount.DoesNotExist
+
+            # Record the UserSession (written behind the request, see main_app/audit.py)
+            started = audit.session_started(
+                claim.pk,
+                username,
+                ip_address=request.META.get('REMOTE_ADDR'),
+                user_agent=request.META.get('HTTP_USER_AGENT', '')
+            )
+
+            # Store user info in session
+            request.session['user_id'] = username
+            request.session['user_status'] = True
+            # Which UserSession this browser's logout ends
+            request.session['session_start'] = started.isoformat()
+            request.session.save()  # Ensure session is saved
+
+            logger.info("Main app login: %s", username)
+            messages.success(request, f'Welcome back, {username}!')
+            return redirect('main_app:main_dashboard')
                 
         except UserAccount.DoesNotExist:
-            print(f"❌ User not found: {username}")
-            # Debug: Show all users in database
-            all_users = UserAccount.objects.all()
-            print(f"📊 Total users in database: {all_users.count()}")
-            for user in all_users:
-                print(f"   - {user.user_id} (status: {user.status})")
-            
+            logger.info("Main app login refused (not_found): %s", username)
             messages.error(request, 'Invalid username or password')
             return render(request, 'main_app/login.html')
-        except Exception as e:
-            print(f"❌ Login error: {e}")
+        except Exception:
+            logger.exception("Main app login failed")
             messages.error(request, 'Login failed. Please try again.')
             return render(request, 'main_app/login.html')
             
     return render(request, 'main_app/login.html')
 
+@read_only
 def main_dashboard(request):
     """Main app dashboard - only accessible after login"""
     user_id = request.session.get('user_id')
@@ -90,8 +93,8 @@ def main_dashboard(request):
             del request.session['user_id']
             return redirect('main_app:main_login')
             
-        # Get user's session info
-        user_session = UserSession.objects.filter(
+        # Get user's session info (a login this worker hasn't written yet counts)
+        user_session = audit.pending_session(user_account.pk) or UserSession.objects.filter(
             user_account=user_account
         ).order_by('-session_start').first()
         
@@ -111,23 +114,11 @@ def main_logout(request):
     """Main app logout"""
     user_id = request.session.get('user_id')
     if user_id:
-        try:
-            user_account = UserAccount.objects.get(user_id=user_id)
-            user_account.is_logged_in = False
-            user_account.save()
-            
-            # End the current session
-            current_session = UserSession.objects.filter(
-                user_account=user_account,
-                session_end__isnull=True
-            ).order_by('-session_start').first()
-            
-            if current_session:
-                current_session.session_end = timezone.now()
-                current_session.save()
-                
-        except UserAccount.DoesNotExist:
-            pass
+        # The main app login never binds current_session, so leave it alone
+        session_state.release_session(user_id, clear_session=False)
+
+        # End this browser's session
+        audit.session_ended(user_id, started=request.session.get('session_start'))
     
     # Clear session
     request.session.flush()
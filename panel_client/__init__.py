@@ -0,0 +1,27 @@
+"""
+Client for the panel's logout and heartbeat API (stdlib only)
+
+Used by AI Mailer Pro desktop clients and gateways in place of the old
+one-connection-per-call scripts: pooled keep-alive connections, jittered
+retries, a circuit breaker, batched logouts, an asyncio variant and a
+durable outbox for calls made while the panel is down.
+Credentials are always sent in a POST body, never in the URL.
+
+    from panel_client import PanelClient
+    panel = PanelClient()            # base URL from PANEL_URL
+    panel.logout('user1', 'secret')
+"""
+from .aio import AsyncPanelClient
+from .client import PanelClient
+from .outbox import Outbox
+from .policy import CircuitBreaker, PanelError, PanelUnavailable, RetryPolicy
+
+__all__ = [
+    'AsyncPanelClient',
+    'CircuitBreaker',
+    'Outbox',
+    'PanelClient',
+    'PanelError',
+    'PanelUnavailable',
+    'RetryPolicy',
+]
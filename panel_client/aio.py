@@ -0,0 +1,90 @@
+"""
+asyncio panel client
+"""
+import asyncio
+
+from .client import HEARTBEAT_PATH, LIVENESS_PATH, LOGOUT_BATCH_SIZE, LOGOUT_PATH, PRESENCE_PATH, _ClientBase
+from .policy import PanelError, PanelUnavailable
+from .transport import AsyncConnectionPool, ConnectError
+
+
+class AsyncPanelClient(_ClientBase):
+    """
+    PanelClient for asyncio code. At most pool_size requests are in flight
+    at once; logout_many() sends its batches concurrently within that bound.
+
+        async with AsyncPanelClient('https://panel.example.com') as panel:
+            await panel.logout('user1', 'secret')
+    """
+
+    def __init__(self, base_url=None, timeout=10.0, pool_size=4, retry=None, breaker=None):
+        super().__init__(base_url, timeout, pool_size, retry, breaker)
+        self._pool = AsyncConnectionPool(self.base_url, size=pool_size, timeout=timeout)
+
+    async def request(self, method, path, payload=None, token=None, idempotent=True):
+        body, headers = self._encode(payload, token)
+        error = None
+        for attempt in range(self.retry.attempts):
+            if attempt:
+                await asyncio.sleep(self.retry.delay(attempt - 1))
+            if not self.breaker.allow():
+                raise PanelUnavailable('circuit open: panel failed repeatedly') from error
+            try:
+                response = await self._pool.request(method, path, body, headers)
+            except ConnectError as exc:
+                error = exc
+            except (OSError, asyncio.TimeoutError, ValueError) as exc:
+                error = exc
+                if not idempotent:
+                    self.breaker.record_failure()
+                    break
+            else:
+                if not idempotent or not self._should_retry(response):
+                    self.breaker.record_success()
+                    return response
+                error = PanelError(f'HTTP {response.status}', response.status)
+            self.breaker.record_failure()
+        raise PanelUnavailable(f'{method} {path} failed: {error}') from error
+
+    async def logout(self, username=None, password=None, token=None):
+        response = await self.request('POST', LOGOUT_PATH, self._logout_body(username, password, token), token)
+        return self._logout_result(response)
+
+    async def logout_many(self, credentials, batch_size=LOGOUT_BATCH_SIZE):
+        responses = await asyncio.gather(*(
+            self.request('POST', LOGOUT_PATH, batch, idempotent=False) for batch in self._batches(credentials, batch_size)
+        ))
+        results = {}
+        for response in responses:
+            results.update(self._batch_results(response))
+        return results
+
+    async def presence_many(self, updates, token):
+        return self._presence_results(await self.request('POST', PRESENCE_PATH, self._presence_body(updates), token))
+
+    async def is_healthy(self):
+        if not self.breaker.allow():
+            return False
+        try:
+            response = await self._pool.request('GET', LIVENESS_PATH)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            self.breaker.record_failure()
+            return False
+        healthy = response.status == 200
+        (self.breaker.record_success if healthy else self.breaker.record_failure)()
+        return healthy
+
+    async def heartbeat(self, token):
+        response = await self.request('POST', HEARTBEAT_PATH, token=token)
+        if response.status != 200:
+            raise PanelError(f'heartbeat failed with HTTP {response.status}', response.status)
+        return response.json().get('timeout')
+
+    async def close(self):
+        await self._pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,189 @@
+"""
+Blocking panel client
+"""
+import http.client
+import json
+import os
+import time
+
+from .policy import CircuitBreaker, PanelError, PanelUnavailable, RetryPolicy
+from .transport import ConnectError, ConnectionPool
+
+LOGOUT_PATH = '/api/logout/'
+HEARTBEAT_PATH = '/api/heartbeat/'
+PRESENCE_PATH = '/api/users/presence/'
+LIVENESS_PATH = '/app/api/health/live/'
+
+# Cap on {"users": [...]} batches; the server's LOGOUT_BATCH_MAX_ITEMS defaults
+# to this. Every item costs the server a password hash check (~0.5 s), so a
+# batch has to finish well inside this client's timeout and gunicorn's.
+LOGOUT_BATCH_SIZE = int(os.environ.get('LOGOUT_BATCH_MAX_ITEMS', 10))
+
+
+def panel_url(base_url=None):
+    base_url = base_url or os.environ.get('PANEL_URL')
+    if not base_url:
+        raise ValueError('pass base_url or set PANEL_URL, e.g. https://panel.example.com')
+    return base_url
+
+
+class _ClientBase:
+    def __init__(self, base_url=None, timeout=10.0, pool_size=4, retry=None, breaker=None):
+        self.base_url = panel_url(base_url)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+
+    @staticmethod
+    def _encode(payload, token):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        headers = {'Authorization': f'Bearer {token}'} if token else None
+        return body, headers
+
+    def _should_retry(self, response):
+        return response.status in self.retry.retry_statuses
+
+    @staticmethod
+    def _logout_body(username, password, token):
+        if token:
+            return None
+        if not username or not password:
+            raise ValueError('username and password, or token, required')
+        return {'username': username, 'password': password}
+
+    @staticmethod
+    def _logout_result(response):
+        """True when logged out, False when the panel refused the credentials"""
+        if response.status == 200:
+            return response.json().get('status') == 'success'
+        if response.status in (401, 403, 404):
+            return False
+        raise PanelError(f'logout failed with HTTP {response.status}', response.status)
+
+    @staticmethod
+    def _batches(credentials, batch_size):
+        items = list(credentials.items() if isinstance(credentials, dict) else credentials)
+        for start in range(0, len(items), batch_size):
+            yield {'users': [{'username': u, 'password': p} for u, p in items[start:start + batch_size]]}
+
+    @staticmethod
+    def _batch_results(response):
+        if response.status != 200:
+            raise PanelError(f'batch logout failed with HTTP {response.status}', response.status)
+        return {item['username']: item['result'] for item in response.json()['results']}
+
+    @staticmethod
+    def _presence_body(updates):
+        items = updates.items() if isinstance(updates, dict) else updates
+        return [{'user_id': user_id, 'status': status} for user_id, status in items]
+
+    @staticmethod
+    def _presence_results(response):
+        if response.status != 200:
+            raise PanelError(f'presence update failed with HTTP {response.status}', response.status)
+        return {item['user_id']: item['result'] for item in response.json()['results'] if 'user_id' in item}
+
+
+class PanelClient(_ClientBase):
+    """
+    Talks to the panel over pooled keep-alive connections. Safe to share
+    between threads. Calls that can't reach the panel are retried per
+    `retry` (RetryPolicy) and counted by `breaker` (CircuitBreaker); once
+    they are exhausted, or while the circuit is open, PanelUnavailable is
+    raised.
+
+        with PanelClient('https://panel.example.com') as panel:
+            panel.logout('user1', 'secret')
+            panel.logout_many({'user1': 'secret', 'user2': 'secret'})
+    """
+
+    def __init__(self, base_url=None, timeout=10.0, pool_size=4, retry=None, breaker=None):
+        super().__init__(base_url, timeout, pool_size, retry, breaker)
+        self._pool = ConnectionPool(self.base_url, size=pool_size, timeout=timeout)
+
+    def request(self, method, path, payload=None, token=None, idempotent=True):
+        """
+        Send one JSON request and return the transport Response. Requests
+        that may already have reached the server (an error mid-request, or a
+        502/503/504 answer) are only retried when idempotent; a refused
+        connection is always safe to retry.
+        """
+        body, headers = self._encode(payload, token)
+        error = None
+        for attempt in range(self.retry.attempts):
+            if attempt:
+                time.sleep(self.retry.delay(attempt - 1))
+            if not self.breaker.allow():
+                raise PanelUnavailable('circuit open: panel failed repeatedly') from error
+            try:
+                response = self._pool.request(method, path, body, headers)
+            except ConnectError as exc:
+                error = exc
+            except (OSError, http.client.HTTPException) as exc:
+                error = exc
+                if not idempotent:
+                    self.breaker.record_failure()
+                    break
+            else:
+                if not idempotent or not self._should_retry(response):
+                    self.breaker.record_success()
+                    return response
+                error = PanelError(f'HTTP {response.status}', response.status)
+            self.breaker.record_failure()
+        raise PanelUnavailable(f'{method} {path} failed: {error}') from error
+
+    def logout(self, username=None, password=None, token=None):
+        """Log out with credentials or a JWT access token. False when refused."""
+        response = self.request('POST', LOGOUT_PATH, self._logout_body(username, password, token), token)
+        return self._logout_result(response)
+
+    def logout_many(self, credentials, batch_size=LOGOUT_BATCH_SIZE):
+        """
+        Log out many accounts with one request per batch_size of them.
+        credentials is {username: password} or (username, password) pairs.
+        Returns {username: 'ok' | 'not_found' | 'invalid_password' | 'invalid'}.
+        A batch that may have reached the panel is not resent: the server
+        could still be checking its passwords.
+        """
+        results = {}
+        for batch in self._batches(credentials, batch_size):
+            results.update(self._batch_results(self.request('POST', LOGOUT_PATH, batch, idempotent=False)))
+        return results
+
+    def presence_many(self, updates, token):
+        """
+        Set many accounts 'online' or 'offline' in one request (JWT token of
+        a staff gateway, or of the account itself). updates is
+        {user_id: status} or pairs. Returns {user_id: result}.
+        """
+        return self._presence_results(self.request('POST', PRESENCE_PATH, self._presence_body(updates), token))
+
+    def is_healthy(self):
+        """One liveness probe, no retries; False while the circuit is open"""
+        if not self.breaker.allow():
+            return False
+        try:
+            response = self._pool.request('GET', LIVENESS_PATH)
+        except (OSError, http.client.HTTPException):
+            self.breaker.record_failure()
+            return False
+        healthy = response.status == 200
+        (self.breaker.record_success if healthy else self.breaker.record_failure)()
+        return healthy
+
+    def heartbeat(self, token):
+        """Keep a JWT login alive; returns the server's presence timeout in seconds"""
+        response = self.request('POST', HEARTBEAT_PATH, token=token)
+        if response.status != 200:
+            raise PanelError(f'heartbeat failed with HTTP {response.status}', response.status)
+        return response.json().get('timeout')
+
+    def close(self):
+        self._pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,234 @@
+"""
+Durable outbox for logout and presence calls the panel didn't receive
+
+When the panel can't be reached, the call is written to a local SQLite file
+(WAL, synchronous=FULL) instead of being dropped, so the account doesn't
+stay logged in on the server after the desktop client logs out. The table
+is keyed by user_id: a newer event for the same user replaces the queued
+one, so only the last state per user is ever sent. Each row keeps the time
+it was queued; a logout that later reaches the panel directly (discard())
+or a login after that time (record_login()) drops it, so a replay never
+logs out a session the user started after the failed call.
+
+replay() sends what is queued once the panel answers its liveness probe:
+logouts as /api/logout/ batches, presence as /api/users/presence/ batches,
+at most `concurrency` requests at a time. Each batch is re-read just before
+it is sent, leaving out rows dropped or replaced since the replay started.
+A row is deleted only after the panel has answered for it, and only if no
+newer event replaced it in the meantime, so a crash at any point means a
+resend at worst, never a loss.
+
+The file holds passwords for queued logouts until they are replayed; it is
+created readable by the current user only.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import LOGOUT_BATCH_SIZE
+from .policy import PanelError
+
+LOGOUT = 'logout'
+PRESENCE = 'presence'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    user_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    queued_at REAL NOT NULL
+)
+"""
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.panel_outbox.sqlite3')
+
+
+class Outbox:
+    """
+        outbox = Outbox()                      # ~/.panel_outbox.sqlite3
+        try:
+            panel.logout(user, password)
+        except PanelUnavailable:
+            outbox.record_logout(user, password)
+        ...
+        outbox.replay(panel)                   # or outbox.start(panel)
+    """
+
+    def __init__(self, path=None, batch_size=LOGOUT_BATCH_SIZE, concurrency=4):
+        self.path = path or os.environ.get('PANEL_OUTBOX', DEFAULT_PATH)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._replaying = threading.Lock()
+        self._worker = None
+        self._stop = threading.Event()
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        os.close(fd)
+        # Writes share one connection (under _lock); reads open their own
+        self._db = self._open()
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(SCHEMA)
+
+    def _open(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA synchronous=FULL')
+        return db
+
+    def _connect(self):
+        return _Closing(self._open())
+
+    def _write(self, statements):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, params in statements:
+                    (self._db.executemany if isinstance(params, list) else self._db.execute)(sql, params)
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    # -- recording ------------------------------------------------------------
+
+    def _record(self, user_id, kind, payload):
+        self._write([(
+            'INSERT INTO outbox (user_id, kind, payload, seq, queued_at) '
+            'VALUES (?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM outbox), ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET kind = excluded.kind, payload = excluded.payload, '
+            'seq = excluded.seq, queued_at = excluded.queued_at',
+            (user_id, kind, json.dumps(payload), time.time()),
+        )])
+
+    def record_logout(self, username, password):
+        """Queue a logout; replaces anything queued for username. Durable on return."""
+        self._record(username, LOGOUT, {'password': password})
+
+    def record_presence(self, user_id, status):
+        """Queue 'online' / 'offline' for user_id (sent with the replay token)"""
+        self._record(user_id, PRESENCE, {'status': status})
+
+    def discard(self, user_id, before=None):
+        """
+        Drop what is queued for user_id (queued before `before`, a time.time()
+        value, when given): call after a logout for the user reached the panel.
+        """
+        if before is None:
+            self._write([('DELETE FROM outbox WHERE user_id = ?', (user_id,))])
+        else:
+            self._write([('DELETE FROM outbox WHERE user_id = ? AND queued_at < ?', (user_id, before))])
+
+    def record_login(self, user_id, at=None):
+        """The user logged in at `at` (default now): events queued before then are stale"""
+        self.discard(user_id, time.time() if at is None else at)
+
+    def pending(self):
+        with self._connect() as db:
+            return db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    # -- replay ---------------------------------------------------------------
+
+    def _batches(self):
+        with self._connect() as db:
+            rows = db.execute('SELECT user_id, kind, payload, seq FROM outbox ORDER BY seq').fetchall()
+        by_kind = {LOGOUT: [], PRESENCE: []}
+        for user_id, kind, payload, seq in rows:
+            by_kind[kind].append((user_id, json.loads(payload), seq))
+        for kind, items in by_kind.items():
+            for start in range(0, len(items), self.batch_size):
+                yield kind, items[start:start + self.batch_size]
+
+    def _still_queued(self, batch):
+        """The rows of batch not dropped or replaced since it was read"""
+        with self._connect() as db:
+            current = set(db.execute(
+                'SELECT user_id, seq FROM outbox WHERE user_id IN ({})'.format(', '.join('?' * len(batch))),
+                [user_id for user_id, _, _ in batch]).fetchall())
+        return [item for item in batch if (item[0], item[2]) in current]
+
+    @staticmethod
+    def _send(client, kind, batch, token):
+        if kind == LOGOUT:
+            return client.logout_many({user_id: payload['password'] for user_id, payload, _ in batch})
+        if token is None:
+            raise PanelError('presence events need a token to replay')
+        return client.presence_many({user_id: payload['status'] for user_id, payload, _ in batch}, token)
+
+    def _acknowledge(self, batch):
+        self._write([('DELETE FROM outbox WHERE user_id = ? AND seq = ?',
+                      [(user_id, seq) for user_id, _, seq in batch])])
+
+    def replay(self, client, token=None):
+        """
+        Send everything queued if the panel is healthy. Returns
+        {'sent': n, 'results': {user_id: result}, 'error': str or None};
+        batches that fail stay queued for the next replay.
+        """
+        report = {'sent': 0, 'results': {}, 'error': None}
+        if not self._replaying.acquire(blocking=False):
+            return report  # another thread is already replaying
+        try:
+            if not self.pending() or not client.is_healthy():
+                return report
+
+            def deliver(kind, batch):
+                batch = self._still_queued(batch)
+                if not batch:
+                    return {}
+                results = self._send(client, kind, batch, token)
+                self._acknowledge(batch)
+                return results
+
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = [pool.submit(deliver, kind, batch) for kind, batch in self._batches()]
+                for future in futures:
+                    try:
+                        results = future.result()
+                    except (PanelError, OSError) as exc:
+                        report['error'] = str(exc)
+                        continue
+                    report['sent'] += len(results)
+                    report['results'].update(results)
+            return report
+        finally:
+            self._replaying.release()
+
+    def start(self, client, token=None, interval=30.0):
+        """Replay every `interval` seconds from a daemon thread"""
+        if self._worker is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.replay(client, token)
+                except Exception:
+                    pass  # keep the events; try again next interval
+
+        self._worker = threading.Thread(target=loop, name='panel-outbox', daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+
+class _Closing:
+    """sqlite3 connections don't close on `with`; this one does"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, *exc_info):
+        self.db.close()
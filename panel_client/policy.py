@@ -0,0 +1,95 @@
+"""
+Retry and circuit-breaker policy shared by the sync and async clients
+"""
+import random
+import threading
+import time
+
+
+class PanelError(Exception):
+    """The panel answered, but not with a usable response"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class PanelUnavailable(PanelError):
+    """The panel could not be reached (retries exhausted or circuit open)"""
+
+
+class RetryPolicy:
+    """
+    attempts: total tries per request (1 disables retries).
+    Delays use "full jitter": a random wait between 0 and
+    min(max_backoff, backoff * 2 ** retry), so clients that failed together
+    don't retry together.
+    """
+
+    def __init__(self, attempts=3, backoff=0.2, max_backoff=5.0, retry_statuses=(502, 503, 504)):
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def delay(self, retry):
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** retry)))
+
+
+class CircuitBreaker:
+    """
+    Stop calling a panel that keeps failing. After failure_threshold
+    consecutive failures the circuit opens and calls fail fast with
+    PanelUnavailable for reset_timeout seconds; then one trial call is let
+    through (half-open) and its outcome closes or re-opens the circuit.
+    Thread-safe; one breaker may be shared by several clients.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """True if a call may go ahead now"""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._trial = False
@@ -0,0 +1,221 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+import logout_integration
+
+from .outbox import LOGOUT, PRESENCE, Outbox
+from .policy import PanelError, PanelUnavailable
+
+
+class FakePanel:
+    """Answers logout_many/presence_many like the panel; records what was sent"""
+
+    def __init__(self, healthy=True, fail=False):
+        self.healthy = healthy
+        self.fail = fail
+        self.sent = []
+
+    def is_healthy(self):
+        return self.healthy
+
+    def logout_many(self, credentials):
+        if self.fail:
+            raise PanelUnavailable('panel down')
+        self.sent.append((LOGOUT, dict(credentials)))
+        return {user_id: 'ok' for user_id in credentials}
+
+    def presence_many(self, updates, token):
+        self.sent.append((PRESENCE, dict(updates)))
+        return {user_id: 'ok' for user_id in updates}
+
+
+class OutboxTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'outbox.sqlite3')
+        self.outbox = Outbox(self.path, batch_size=2, concurrency=1)
+
+    def tearDown(self):
+        self.outbox.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def rows(self):
+        with sqlite3.connect(self.path) as db:
+            return db.execute('SELECT user_id, kind, payload FROM outbox ORDER BY seq').fetchall()
+
+    def test_file_readable_by_owner_only(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_newer_event_replaces_queued_one(self):
+        self.outbox.record_logout('alice', 'old')
+        self.outbox.record_presence('alice', 'offline')
+        self.outbox.record_logout('alice', 'new')
+        self.assertEqual(self.rows(), [('alice', LOGOUT, '{"password": "new"}')])
+
+    def test_replay_sends_batches_and_acknowledges(self):
+        for user_id in ('a', 'b', 'c'):
+            self.outbox.record_logout(user_id, 'secret')
+        self.outbox.record_presence('d', 'online')
+        panel = FakePanel()
+        report = self.outbox.replay(panel, token='token')
+        self.assertEqual(report['sent'], 4)
+        self.assertIsNone(report['error'])
+        self.assertEqual(panel.sent, [(LOGOUT, {'a': 'secret', 'b': 'secret'}), (LOGOUT, {'c': 'secret'}),
+                                      (PRESENCE, {'d': 'online'})])
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_nothing_sent_while_panel_unhealthy(self):
+        self.outbox.record_logout('alice', 'secret')
+        panel = FakePanel(healthy=False)
+        self.assertEqual(self.outbox.replay(panel)['sent'], 0)
+        self.assertEqual(panel.sent, [])
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_failed_batch_stays_queued(self):
+        self.outbox.record_logout('alice', 'secret')
+        report = self.outbox.replay(FakePanel(fail=True))
+        self.assertEqual(report['sent'], 0)
+        self.assertIn('panel down', report['error'])
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_presence_without_token_stays_queued(self):
+        self.outbox.record_presence('alice', 'offline')
+        report = self.outbox.replay(FakePanel())
+        self.assertIsNotNone(report['error'])
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_event_replaced_during_send_is_kept(self):
+        self.outbox.record_logout('alice', 'old')
+        panel = FakePanel()
+        send = panel.logout_many
+
+        def logout_many(credentials):
+            self.outbox.record_logout('alice', 'new')  # arrives while the old one is in flight
+            return send(credentials)
+        panel.logout_many = logout_many
+        self.outbox.replay(panel)
+        self.assertEqual(self.rows(), [('alice', LOGOUT, '{"password": "new"}')])
+
+    def test_discard_after_direct_logout(self):
+        self.outbox.record_logout('alice', 'secret')
+        self.outbox.record_logout('bob', 'secret')
+        self.outbox.discard('alice')
+        self.assertEqual([row[0] for row in self.rows()], ['bob'])
+
+    def test_discard_keeps_events_queued_after_the_call_started(self):
+        started = time.time()
+        self.outbox.record_logout('alice', 'secret')
+        self.outbox.discard('alice', before=started)
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_login_drops_earlier_logout(self):
+        self.outbox.record_logout('alice', 'secret')
+        self.outbox.record_login('alice')
+        panel = FakePanel()
+        self.outbox.replay(panel)
+        self.assertEqual(panel.sent, [])
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_login_before_queueing_keeps_logout(self):
+        logged_in = time.time()
+        self.outbox.record_logout('alice', 'secret')
+        self.outbox.record_login('alice', at=logged_in)
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_login_during_replay_is_not_logged_out(self):
+        self.outbox.record_logout('alice', 'secret')
+        self.outbox.record_logout('bob', 'secret')
+        batches = self.outbox._batches
+
+        def read_then_login():
+            # The batch is read, then alice logs in before it is sent
+            read = list(batches())
+            self.outbox.record_login('alice')
+            return iter(read)
+        self.outbox._batches = read_then_login
+        panel = FakePanel()
+        self.outbox.replay(panel)
+        self.assertEqual(panel.sent, [(LOGOUT, {'bob': 'secret'})])
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_reopens_queued_events(self):
+        self.outbox.record_logout('alice', 'secret')
+        self.outbox.close()
+        self.outbox = Outbox(self.path)
+        self.assertEqual(self.outbox.pending(), 1)
+
+
+class LogoutIntegrationTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.outbox = Outbox(os.path.join(self.directory, 'outbox.sqlite3'))
+        self.panel = mock.Mock()
+        patches = [mock.patch.object(logout_integration, '_panel', self.panel),
+                   mock.patch.object(logout_integration, '_outbox', self.outbox),
+                   mock.patch('builtins.print')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.outbox.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_unreachable_panel_queues_logout(self):
+        self.panel.logout.side_effect = PanelUnavailable('down')
+        self.assertFalse(logout_integration.logout_from_panel('alice', 'secret'))
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_successful_logout_drops_queued_one(self):
+        self.outbox.record_logout('alice', 'secret')
+        self.panel.logout.return_value = True
+        self.assertTrue(logout_integration.logout_from_panel('alice', 'secret'))
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_refused_logout_keeps_queued_one(self):
+        self.outbox.record_logout('alice', 'secret')
+        self.panel.logout.side_effect = PanelError('HTTP 500', 500)
+        logout_integration.logout_from_panel('alice', 'secret')
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_rate_limited_logout_is_queued(self):
+        for status in (429, 503):
+            self.panel.logout.side_effect = PanelError(f'HTTP {status}', status)
+            self.assertFalse(logout_integration.logout_from_panel(f'user{status}', 'secret'))
+        self.assertEqual(self.outbox.pending(), 2)
+
+    def test_rejected_logout_is_not_queued(self):
+        self.panel.logout.side_effect = PanelError('HTTP 400', 400)
+        logout_integration.logout_from_panel('alice', 'secret')
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_unreachable_panel_queues_batch(self):
+        self.panel.logout_many.side_effect = PanelUnavailable('down')
+        self.assertEqual(logout_integration.logout_many_from_panel({'alice': 'a', 'bob': 'b'}), {})
+        self.assertEqual(self.outbox.pending(), 2)
+
+    def test_batch_refused_with_retryable_status_is_queued(self):
+        self.panel.logout_many.side_effect = PanelError('HTTP 429', 429)
+        logout_integration.logout_many_from_panel({'alice': 'a'})
+        self.assertEqual(self.outbox.pending(), 1)
+        self.panel.logout_many.side_effect = PanelError('HTTP 401', 401)
+        logout_integration.logout_many_from_panel({'bob': 'b'})
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_batch_logout_drops_queued_ones_that_went_through(self):
+        self.outbox.record_logout('alice', 'secret')
+        self.outbox.record_logout('bob', 'secret')
+        self.panel.logout_many.return_value = {'alice': 'ok', 'bob': 'invalid_password'}
+        logout_integration.logout_many_from_panel({'alice': 'secret', 'bob': 'secret'})
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_login_drops_queued_logout(self):
+        self.outbox.record_logout('alice', 'secret')
+        logout_integration.record_login('alice')
+        self.assertEqual(self.outbox.pending(), 0)
@@ -0,0 +1,217 @@
+"""
+Keep-alive HTTP/1.1 connection pools (stdlib only)
+
+The sync pool wraps http.client connections, the async pool speaks
+HTTP/1.1 over asyncio streams. Both keep up to `size` idle connections per
+panel so repeated calls skip the TCP (and TLS) handshake, and both retry
+once on a fresh connection when a pooled one turns out to have been closed
+by the server while idle. Failures to connect raise ConnectError, which
+tells the client the request never left the machine.
+"""
+import asyncio
+import http.client
+import json
+import socket
+import ssl
+import threading
+from collections import deque, namedtuple
+from urllib.parse import urlsplit
+
+
+class ConnectError(OSError):
+    """The connection could not be opened; nothing was sent"""
+
+
+class Response(namedtuple('Response', 'status headers body')):
+    __slots__ = ()
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+
+def _target(base_url):
+    parts = urlsplit(base_url)
+    if parts.scheme not in ('http', 'https'):
+        raise ValueError(f'unsupported panel URL: {base_url}')
+    https = parts.scheme == 'https'
+    return https, parts.hostname, parts.port or (443 if https else 80), parts.path.rstrip('/')
+
+
+def _request_headers(host, port, body, headers):
+    merged = {'Host': f'{host}:{port}', 'Accept': 'application/json', 'Connection': 'keep-alive'}
+    if body:
+        merged['Content-Type'] = 'application/json'
+    merged.update(headers or {})
+    return merged
+
+
+# Errors from reusing a connection the server already closed
+_STALE = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+
+class ConnectionPool:
+    def __init__(self, base_url, size=4, timeout=10.0, ssl_context=None):
+        self.https, self.host, self.port, self.prefix = _target(base_url)
+        self.size = size
+        self.timeout = timeout
+        self.ssl_context = ssl_context or (ssl.create_default_context() if self.https else None)
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.https:
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                               context=self.ssl_context)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.connect()
+        except OSError as exc:
+            conn.close()
+            raise ConnectError(str(exc)) from exc
+        # Small request/response pairs on a reused connection: never wait on Nagle
+        # (asyncio sets this for its sockets already)
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _checkin(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body=b'', headers=None):
+        conn, reused = self._checkout()
+        headers = _request_headers(self.host, self.port, body, headers)
+        while True:
+            try:
+                conn.request(method, self.prefix + path, body=body or None, headers=headers)
+                response = conn.getresponse()
+                payload = response.read()
+            except _STALE:
+                conn.close()
+                if not reused:
+                    raise
+                conn, reused = self._connect(), False
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(conn)
+        return Response(response.status, {k.lower(): v for k, v in response.getheaders()}, payload)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for conn in idle:
+            conn.close()
+
+
+class AsyncConnectionPool:
+    """At most `size` requests are in flight at once; further callers wait for a connection."""
+
+    def __init__(self, base_url, size=4, timeout=10.0, ssl_context=None):
+        self.https, self.host, self.port, self.prefix = _target(base_url)
+        self.size = size
+        self.timeout = timeout
+        self.ssl_context = ssl_context or (ssl.create_default_context() if self.https else None)
+        self._idle = deque()
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self):
+        try:
+            return await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl_context), self.timeout)
+        except (OSError, asyncio.TimeoutError) as exc:
+            raise ConnectError(str(exc) or 'connect timed out') from exc
+
+    @staticmethod
+    async def _discard(conn):
+        _, writer = conn
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    async def request(self, method, path, body=b'', headers=None):
+        async with self._slots:
+            reused = bool(self._idle)
+            conn = self._idle.pop() if reused else await self._connect()
+            head = [f'{method} {self.prefix + path} HTTP/1.1', f'Content-Length: {len(body)}']
+            head += [f'{name}: {value}' for name, value in
+                     _request_headers(self.host, self.port, body, headers).items()]
+            raw = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+            while True:
+                try:
+                    response, keep = await asyncio.wait_for(self._exchange(conn, raw), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError) as exc:
+                    await self._discard(conn)
+                    if not reused:
+                        raise ConnectionError(str(exc)) from exc
+                    conn, reused = await self._connect(), False
+                    continue
+                except BaseException:
+                    await self._discard(conn)
+                    raise
+                break
+
+            if keep and len(self._idle) < self.size:
+                self._idle.append(conn)
+            else:
+                await self._discard(conn)
+            return response
+
+    @staticmethod
+    async def _exchange(conn, raw):
+        reader, writer = conn
+        writer.write(raw)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('server closed the connection')
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            payload = await reader.readexactly(int(headers['content-length']))
+            keep = headers.get('connection', '').lower() != 'close'
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            payload = b''.join(chunks)
+            keep = headers.get('connection', '').lower() != 'close'
+        else:
+            payload = await reader.read()
+            keep = False
+        return Response(status, headers, payload), keep
+
+    async def close(self):
+        while self._idle:
+            await self._discard(self._idle.pop())
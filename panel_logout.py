@@ -1,5 +1,13 @@
-import requests
-import json
+from panel_client import PanelClient, PanelError
+
+# One pooled client per process; the panel URL comes from PANEL_URL
+_panel = None
+
+def _client():
+    global _panel
+    if _panel is None:
+        _panel = PanelClient()
+    return _panel
 
 def logout_from_panel(username, password):
     """
@@ -7,33 +15,13 @@ def logout_from_panel(username, password):
     This function should be called when user logs out from AI Mailer Pro
     """
     try:
-        # Panel API endpoint
-        url = "http://16.170.250.233:8000/api/logout/"
-        
-        # GET request with parameters
-        params = {
-            'username': username,
-            'password': password
-        }
-        
         print(f"🔄 Logging out user {username} from panel...")
-        
-        # Make API call
-        response = requests.get(url, params=params, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'success':
-                print(f"✅ User {username} logged out from panel successfully")
-                return True
-            else:
-                print(f"❌ Panel logout failed: {data.get('message')}")
-                return False
-        else:
-            print(f"❌ Panel logout failed with status code: {response.status_code}")
-            return False
-            
-    except Exception as e:
+        if _client().logout(username, password):
+            print(f"✅ User {username} logged out from panel successfully")
+            return True
+        print(f"❌ Panel logout refused for user {username}")
+        return False
+    except (PanelError, ValueError) as e:
         print(f"❌ Error calling panel logout API: {e}")
         return False
 
@@ -27,7 +27,7 @@ def test_database_connection():
         
         if total_users > 0:
             print("\n👥 Users found:")
-            for user in UserAccount.objects.all():
+            for user in UserAccount.objects.iterator(chunk_size=2000):
                 print(f"   - Username: {user.user_id}")
                 print(f"     Status: {'Active' if user.status else 'Inactive'}")
                 print(f"     Logged in: {'Yes' if user.is_logged_in else 'No'}")
@@ -1,31 +1,22 @@
-import requests
+import sys
 
-def test_logout():
+from panel_client import PanelClient, PanelError
+
+def test_logout(base_url=None):
     try:
-        url = "http://16.170.250.233:8000/api/logout/"
-        params = {
-            'username': 'admin',
-            'password': 'admin123'
-        }
-        
-        print("🔄 Testing panel logout API...")
-        response = requests.get(url, params=params, timeout=10)
-        
-        print(f"📡 Status Code: {response.status_code}")
-        print(f"📡 Response: {response.text}")
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'success':
+        # Panel URL from the command line or PANEL_URL
+        with PanelClient(base_url, retry=None) as panel:
+            print("🔄 Testing panel logout API...")
+            if panel.logout('admin', 'admin123'):
                 print("✅ API test successful!")
                 return True
-        
+
         print("❌ API test failed!")
         return False
-        
-    except Exception as e:
+
+    except (PanelError, ValueError) as e:
         print(f"❌ Error: {e}")
         return False
 
 if __name__ == "__main__":
-    test_logout()
+    test_logout(sys.argv[1] if len(sys.argv) > 1 else None)
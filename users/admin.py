@@ -1,7 +1,43 @@
 from django.contrib import admin
+from internet_art_tools.changelists import LargeTableMixin
 from .models import UserAccount
+from .presence import invalidate_presence
+from .passwords import hash_password
+from . import bulk
 
 @admin.register(UserAccount)
-class UserAccountAdmin(admin.ModelAdmin):
+class UserAccountAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ('user_id','status','is_logged_in','device_ip','last_login')
-    search_fields = ('user_id',)
+    # Prefix search on the unique user_id index
+    search_prefix_fields = ('user_id',)
+    search_help_text = 'User ID starts with (=alice for an exact match)'
+    actions = ('enable_accounts', 'disable_accounts', 'force_logout_accounts')
+
+    def save_model(self, request, obj, form, change):
+        # A password typed into the form is plaintext; stored hashes pass through
+        obj.password = hash_password(obj.password)
+        super().save_model(request, obj, form, change)
+        invalidate_presence(obj.user_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_presence(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        # Used by the built-in "delete selected" action
+        bulk.delete_accounts(queryset)
+
+    @admin.action(description='Enable selected accounts')
+    def enable_accounts(self, request, queryset):
+        count = bulk.set_status(queryset, True)
+        self.message_user(request, f'Enabled {count} account(s).')
+
+    @admin.action(description='Disable selected accounts')
+    def disable_accounts(self, request, queryset):
+        count = bulk.set_status(queryset, False)
+        self.message_user(request, f'Disabled {count} account(s).')
+
+    @admin.action(description='Force logout selected accounts')
+    def force_logout_accounts(self, request, queryset):
+        count = bulk.force_logout(queryset)
+        self.message_user(request, f'Logged out {count} account(s).')
@@ -3,9 +3,8 @@ from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.utils import timezone
 
-from .models import UserAccount
+from . import session_state
 
 
 class SingleSessionTokenObtainPairView(TokenObtainPairView):
@@ -16,20 +15,7 @@ class SingleSessionTokenObtainPairView(TokenObtainPairView):
         if not username or not password:
             return Response({'detail': 'username and password required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Verify UserAccount exists and active
-        try:
-            user_account = UserAccount.objects.get(user_id=username)
-        except UserAccount.DoesNotExist:
-            return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
-
-        if not user_account.status:
-            return Response({'detail': 'Account disabled'}, status=status.HTTP_403_FORBIDDEN)
-
-        # Enforce single session: if already logged in elsewhere, block
-        if user_account.is_logged_in and user_account.current_session:
-            return Response({'detail': 'User already logged in elsewhere'}, status=status.HTTP_409_CONFLICT)
-
-        # Proceed with default serializer validation
+        # Default serializer validation (UserAccountBackend checks the UserAccount password)
         serializer = self.get_serializer(data=request.data)
         try:
             serializer.is_valid(raise_exception=True)
@@ -45,11 +31,16 @@ class SingleSessionTokenObtainPairView(TokenObtainPairView):
         except Exception:
             logical_session_id = None
 
-        # Update presence and tracking
-        user_account.is_logged_in = True
-        user_account.last_login = timezone.now()
-        user_account.current_session = logical_session_id or 'jwt'
-        user_account.session_key = user_account.current_session
-        user_account.save()
+        # Verify UserAccount exists and is active, and enforce single session
+        # (an expired heartbeat session counts as free), in the same
+        # conditional UPDATE that records the login
+        claim = session_state.claim_session(username, session_id=logical_session_id or 'jwt', heartbeat=True)
+
+        if claim.outcome == session_state.NOT_FOUND:
+            return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+        if claim.outcome == session_state.DISABLED:
+            return Response({'detail': 'Account disabled'}, status=status.HTTP_403_FORBIDDEN)
+        if claim.outcome == session_state.ALREADY_LOGGED_IN:
+            return Response({'detail': 'User already logged in elsewhere'}, status=status.HTTP_409_CONFLICT)
 
         return Response(data, status=status.HTTP_200_OK)
@@ -0,0 +1,99 @@
+"""
+Authentication backend for UserAccount credentials
+
+django.contrib.auth.login() and SimpleJWT need a django User, so every
+UserAccount has a "shadow" User with the same username. Credentials live only
+on UserAccount: the shadow User gets an unusable password and is written only
+when it is created or actually out of sync, so a login costs one hash check
+instead of check + set_password() + save().
+
+Listed before ModelBackend in AUTHENTICATION_BACKENDS, so a panel login
+doesn't pay for ModelBackend's User lookup (or its timing-mitigation hash
+when no User exists yet). Staff Users are never returned here; they keep
+authenticating against their own password through ModelBackend. Shadow
+Users can't match there because their password is unusable (users
+migration 0004).
+"""
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+
+from .models import UserAccount
+from . import passwords
+
+
+def _shadow_defaults(username):
+    return {'email': f'{username}@example.com'}
+
+
+def _out_of_sync(user):
+    # Staff accounts keep their own password for the Django admin
+    return not user.is_staff and not user.is_superuser and user.has_usable_password()
+
+
+def shadow_user(username):
+    """The User row behind a UserAccount, created or synced only when needed"""
+    user = User.objects.filter(username=username).first()
+    if user is None:
+        user = User(username=username, **_shadow_defaults(username))
+        user.set_unusable_password()
+        user.save()
+    elif _out_of_sync(user):
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    return user
+
+
+async def ashadow_user(username):
+    user = await User.objects.filter(username=username).afirst()
+    if user is None:
+        user = User(username=username, **_shadow_defaults(username))
+        user.set_unusable_password()
+        await user.asave()
+    elif _out_of_sync(user):
+        user.set_unusable_password()
+        await user.asave(update_fields=['password'])
+    return user
+
+
+class UserAccountBackend(ModelBackend):
+    """
+    Authenticate username/password against UserAccount. Account status and
+    the single-session rule are enforced by session_state when the login is
+    claimed, so callers can still tell a disabled account from bad
+    credentials.
+    """
+
+    def user_can_authenticate(self, user):
+        # UserAccount credentials must never log someone in as staff
+        return super().user_can_authenticate(user) and not (user.is_staff or user.is_superuser)
+
+    def _account(self, username):
+        return UserAccount.objects.filter(user_id=username).values('pk', 'password')
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
+            return None
+        account = self._account(username).first()
+        if account is None:
+            return None
+        valid, new_hash = passwords.verify(password, account['password'])
+        if not valid:
+            return None
+        if new_hash:
+            passwords.upgrade(account['pk'], account['password'], new_hash)
+        user = shadow_user(username)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
+            return None
+        account = await self._account(username).afirst()
+        if account is None:
+            return None
+        valid, new_hash = await passwords.averify(password, account['password'])
+        if not valid:
+            return None
+        if new_hash:
+            await passwords.aupgrade(account['pk'], account['password'], new_hash)
+        user = await ashadow_user(username)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,128 @@
+"""
+Set-based account operations used by the dashboard bulk endpoint and the
+UserAccount admin actions. Each operation is one UPDATE (or a short series
+of batched DELETEs) no matter how many accounts it touches.
+"""
+from django.db import transaction
+from django.db.models.deletion import CASCADE
+from django.utils import timezone
+
+from .models import UserAccount
+from .presence import invalidate_presence
+from .events import publish
+from . import heartbeat
+from .session_state import OK, NOT_FOUND, DISABLED
+
+DELETE_BATCH_SIZE = 500
+PRESENCE_BATCH_SIZE = 500
+
+ONLINE = 'online'
+OFFLINE = 'offline'
+
+
+def _user_ids(queryset):
+    return list(queryset.values_list('user_id', flat=True))
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def set_status(queryset, enabled):
+    """Enable or disable every account in queryset, returns rows updated"""
+    user_ids = _user_ids(queryset)
+    count = queryset.update(status=enabled)
+    invalidate_presence(*user_ids)
+    return count
+
+
+def force_logout(queryset):
+    """Clear login state for every account in queryset, returns rows updated"""
+    user_ids = _user_ids(queryset)
+    count = queryset.update(is_logged_in=False, current_session=None, session_key=None)
+    invalidate_presence(*user_ids)
+    return count
+
+
+def apply_presence(updates, batch_size=PRESENCE_BATCH_SIZE):
+    """
+    Set many accounts online or offline at once. updates maps user_id to
+    ONLINE or OFFLINE. Accounts are looked up batch_size at a time, then
+    every change is applied in one transaction with one UPDATE per
+    batch_size accounts per state; going online also records a heartbeat
+    in the same UPDATE. Returns {user_id: OK, NOT_FOUND or DISABLED}
+    (a disabled account can go offline but not online).
+    """
+    user_ids = list(updates)
+    enabled = {}
+    for chunk in _chunks(user_ids, batch_size):
+        enabled.update(UserAccount.objects.filter(user_id__in=chunk).values_list('user_id', 'status'))
+
+    outcomes = {}
+    online, offline = [], []
+    for user_id, state in updates.items():
+        if user_id not in enabled:
+            outcomes[user_id] = NOT_FOUND
+        elif state == ONLINE and not enabled[user_id]:
+            outcomes[user_id] = DISABLED
+        else:
+            outcomes[user_id] = OK
+            (online if state == ONLINE else offline).append(user_id)
+
+    now = timezone.now()
+    with transaction.atomic():
+        for chunk in _chunks(online, batch_size):
+            UserAccount.objects.filter(user_id__in=chunk, status=True).update(is_logged_in=True, last_seen=now)
+        for chunk in _chunks(offline, batch_size):
+            UserAccount.objects.filter(user_id__in=chunk).update(
+                is_logged_in=False, current_session=None, session_key=None,
+            )
+
+    heartbeat.seen(online, now)
+    publish(*online)
+    invalidate_presence(*offline)
+    return outcomes
+
+
+def _cascade_relations():
+    return [
+        rel for rel in UserAccount._meta.related_objects
+        if rel.one_to_many and rel.on_delete is CASCADE
+    ]
+
+
+def delete_accounts(queryset, batch_size=DELETE_BATCH_SIZE):
+    """
+    Delete every account in queryset in batches of batch_size.
+
+    Rows that cascade from UserAccount (e.g. main_app.UserSession) are
+    removed first, batch_size at a time, each batch in its own short
+    transaction so a large delete never holds locks for long. Returns the
+    number of accounts deleted.
+    """
+    relations = _cascade_relations()
+    deleted = 0
+    pks = list(queryset.order_by('pk').values_list('pk', 'user_id'))
+
+    for start in range(0, len(pks), batch_size):
+        chunk = pks[start:start + batch_size]
+        account_pks = [pk for pk, _ in chunk]
+
+        for rel in relations:
+            related = rel.related_model._base_manager.filter(
+                **{f'{rel.field.name}__in': account_pks}
+            )
+            while True:
+                related_pks = list(related.values_list('pk', flat=True)[:batch_size])
+                if not related_pks:
+                    break
+                with transaction.atomic():
+                    rel.related_model._base_manager.filter(pk__in=related_pks).delete()
+
+        with transaction.atomic():
+            _, per_model = UserAccount.objects.filter(pk__in=account_pks).delete()
+        deleted += per_model.get(UserAccount._meta.label, 0)
+        invalidate_presence(*[user_id for _, user_id in chunk])
+
+    return deleted
@@ -0,0 +1,174 @@
+"""
+Live dashboard updates
+
+Every code path that changes an account's login state, status or session
+already goes through users.presence (set_presence / invalidate_presence),
+which publishes the affected user_ids to the in-process hub here. A
+dashboard tab holds one server-sent events stream per page
+(/dashboard/events/) subscribed to just the user_ids on screen. A
+notification only tells the stream which rows to look at: it coalesces the
+ids for COALESCE seconds, re-reads those rows in one query and pushes the
+fields that actually changed. Nothing polls the database while nobody
+logs in or out.
+
+The hub is per process: run the dashboard behind a single ASGI worker, or
+accept that changes made by other workers show up on the next reload.
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateformat import format as format_date
+
+from .models import UserAccount
+
+DEFAULTS = {
+    'MAX_USERS': 5000,   # user_ids one stream may follow
+    'KEEPALIVE': 15,     # seconds between comment lines on an idle stream
+    'COALESCE': 0.25,    # seconds to gather notifications before re-reading rows
+    'RETRY': 5000,       # ms the browser waits before reconnecting
+    'BATCH_SIZE': 500,   # user_ids per row query
+}
+
+FIELDS = ('user_id', 'status', 'is_logged_in', 'last_login', 'device_ip')
+
+
+def setting(name):
+    return getattr(settings, 'DASHBOARD_LIVE', {}).get(name, DEFAULTS[name])
+
+
+class Subscription:
+    """Pending changes for one stream, handed to its event loop from any thread."""
+
+    def __init__(self, hub, user_ids, loop):
+        self.user_ids = frozenset(user_ids)
+        self._hub = hub
+        self._loop = loop
+        self._pending = set()
+        self._event = asyncio.Event()
+
+    def _notify(self, user_ids):
+        # Called by Hub.publish with the hub lock held
+        changed = [user_id for user_id in user_ids if user_id in self.user_ids]
+        if not changed:
+            return
+        wake = not self._pending
+        self._pending.update(changed)
+        if wake:
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:
+                pass  # loop already closed; close() will follow
+
+    def drain(self):
+        with self._hub._lock:
+            pending, self._pending = self._pending, set()
+            self._event.clear()
+        return pending
+
+    async def wait(self, timeout):
+        """Changed user_ids, or None if nothing changed within timeout"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.drain()
+
+    def close(self):
+        self._hub.unsubscribe(self)
+
+
+class Hub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, user_ids):
+        subscription = Subscription(self, user_ids, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, *user_ids):
+        """Tell the streams following any of user_ids that those rows changed"""
+        if not self._subscriptions or not user_ids:
+            return
+        with self._lock:
+            for subscription in self._subscriptions:
+                subscription._notify(user_ids)
+
+
+hub = Hub()
+publish = hub.publish
+
+
+def _row(values):
+    last_login = values['last_login']
+    return {
+        'user_id': values['user_id'],
+        'status': values['status'],
+        'is_logged_in': values['is_logged_in'],
+        # Same format as the dashboard template
+        'last_login': format_date(timezone.localtime(last_login), 'M d, H:i') if last_login else None,
+        'device_ip': values['device_ip'],
+    }
+
+
+async def _rows(user_ids):
+    user_ids = list(user_ids)
+    size = setting('BATCH_SIZE')
+    rows = {}
+    for start in range(0, len(user_ids), size):
+        queryset = UserAccount.objects.filter(user_id__in=user_ids[start:start + size]).values(*FIELDS)
+        async for values in queryset:
+            rows[values['user_id']] = _row(values)
+    return rows
+
+
+def _message(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def stream(user_ids):
+    """
+    Server-sent events for the dashboard rows of user_ids. The first
+    "users" event carries every row (the page may have rendered before a
+    change this stream missed); later ones only rows that changed, and
+    {"user_id": ..., "deleted": true} for deleted accounts.
+    """
+    subscription = hub.subscribe(user_ids)
+    sent = {}
+    try:
+        yield f"retry: {setting('RETRY')}\n\n"
+        changed = set(user_ids)
+        while True:
+            if changed:
+                rows = await _rows(changed)
+                updates = []
+                for user_id in changed:
+                    row = rows.get(user_id)
+                    if row is None:
+                        if user_id not in sent or sent[user_id] is not None:
+                            updates.append({'user_id': user_id, 'deleted': True})
+                        sent[user_id] = None
+                    elif sent.get(user_id) != row:
+                        sent[user_id] = row
+                        updates.append(row)
+                if updates:
+                    yield _message('users', updates)
+
+            changed = await subscription.wait(setting('KEEPALIVE'))
+            if changed is None:
+                changed = set()
+                yield ': keepalive\n\n'
+            else:
+                await asyncio.sleep(setting('COALESCE'))
+                changed |= subscription.drain()
+    finally:
+        subscription.close()
@@ -0,0 +1,215 @@
+"""
+Heartbeat presence for API clients
+
+AI Mailer Pro clients prove they are alive by pinging a heartbeat endpoint
+(or polling /app/api/status/). A beat only touches a per-process buffer;
+a background thread writes the buffered last-seen times to
+UserAccount.last_seen in batches (one UPDATE per FLUSH_SIZE users, and a
+user is rewritten at most every REFRESH seconds), and a reaper logs out
+every account whose heartbeat is older than TIMEOUT with one set-based
+UPDATE per sweep. A client that crashed without logging out therefore
+frees its account after TIMEOUT instead of blocking logins with 409s.
+
+Accounts that never heartbeat (web panel logins) have last_seen NULL and
+are never reaped. TIMEOUT must stay well above REFRESH + FLUSH_INTERVAL,
+so a live client's beat always reaches the database before it could be
+reaped by another worker.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import UserAccount
+from .presence import invalidate_presence
+
+DEFAULTS = {
+    'TIMEOUT': 90,          # seconds without a beat before a session is free
+    'REFRESH': 30,          # min seconds between DB writes of one user's last_seen
+    'FLUSH_INTERVAL': 10,   # seconds between buffer flushes
+    'FLUSH_SIZE': 500,      # users per UPDATE; a full buffer flushes at once
+    'REAP_INTERVAL': 30,    # seconds between reaper sweeps (across workers)
+    'BACKGROUND': True,     # run flush + reaper in a thread in each worker
+}
+
+REAP_LOCK_KEY = 'heartbeat:reaping'
+
+logger = logging.getLogger(__name__)
+
+# Sent after a sweep with pks=[...] and user_ids=[...] of the accounts that
+# were logged out, and at=the sweep time (main_app closes their UserSessions)
+presence_expired = Signal()
+
+
+def setting(name):
+    return getattr(settings, 'PRESENCE_HEARTBEAT', {}).get(name, DEFAULTS[name])
+
+
+def timeout():
+    return timedelta(seconds=setting('TIMEOUT'))
+
+
+def is_stale(last_seen, now=None):
+    """True for a heartbeat session that missed its TIMEOUT (never for NULL)"""
+    return last_seen is not None and last_seen < (now or timezone.now()) - timeout()
+
+
+# -- buffer -------------------------------------------------------------------
+
+_lock = threading.Lock()
+_pending = {}   # user_id -> last beat not yet written
+_written = {}   # user_id -> last_seen value last written by this process
+
+
+def _record(user_id, when):
+    """Buffer a beat; returns True when the buffer is due for a flush"""
+    with _lock:
+        written = _written.get(user_id)
+        if written is not None and (when - written).total_seconds() < setting('REFRESH'):
+            return False
+        _pending[user_id] = when
+        return len(_pending) >= setting('FLUSH_SIZE')
+
+
+def beat(user_id, when=None):
+    """Record that user_id's client is alive. No database access unless the buffer is full."""
+    if _record(user_id, when or timezone.now()):
+        flush()
+    _ensure_worker()
+
+
+async def abeat(user_id, when=None):
+    if _record(user_id, when or timezone.now()):
+        await sync_to_async(flush)()
+    _ensure_worker()
+
+
+def seen(user_ids, when):
+    """Note beats the caller already wrote to last_seen (e.g. users.bulk.apply_presence)"""
+    with _lock:
+        for user_id in user_ids:
+            pending = _pending.get(user_id)
+            if pending is not None and pending <= when:
+                del _pending[user_id]
+            _written[user_id] = when
+
+
+def flush():
+    """Write buffered beats, one UPDATE per FLUSH_SIZE users. Returns users written."""
+    with _lock:
+        batch = list(_pending.items())
+        _pending.clear()
+
+    size = setting('FLUSH_SIZE')
+    for start in range(0, len(batch), size):
+        chunk = batch[start:start + size]
+        try:
+            UserAccount.objects.filter(user_id__in=[user_id for user_id, _ in chunk]).update(
+                last_seen=Case(
+                    *[When(user_id=user_id, then=Value(when)) for user_id, when in chunk],
+                    output_field=DateTimeField(),
+                )
+            )
+        except Exception:
+            _requeue(batch[start:])
+            raise
+        # Only now: a beat arriving while the chunk was written is just rewritten later
+        with _lock:
+            _written.update(chunk)
+    return len(batch)
+
+
+def _requeue(beats):
+    with _lock:
+        for user_id, when in beats:
+            pending = _pending.get(user_id)
+            if pending is None or pending < when:
+                _pending[user_id] = when
+
+
+# -- reaper -------------------------------------------------------------------
+
+def reap(now=None):
+    """
+    Log out every account whose heartbeat is older than TIMEOUT: one SELECT
+    on the logged-in partial index to learn who, one set-based UPDATE that
+    re-checks the same condition. Returns the user_ids logged out; only those
+    are signalled, not accounts that logged in again in between.
+    """
+    now = now or timezone.now()
+    stale = UserAccount.objects.filter(is_logged_in=True, last_seen__lt=now - timeout())
+    with transaction.atomic():
+        # Locked until commit, so the UPDATE matches exactly these rows;
+        # rows a login holds right now are left for the next sweep
+        rows = list(stale.select_for_update(skip_locked=True).values_list('pk', 'user_id'))
+        if not rows:
+            return []
+        pks = [pk for pk, _ in rows]
+        updated = stale.filter(pk__in=pks).update(
+            is_logged_in=False,
+            current_session=None,
+            session_key=None,
+        )
+        if updated < len(rows):
+            # No row locks on this backend and a login got in first: keep the rows logged out
+            rows = list(UserAccount.objects.filter(pk__in=pks, is_logged_in=False).values_list('pk', 'user_id'))
+            pks = [pk for pk, _ in rows]
+    if not rows:
+        return []
+    user_ids = [user_id for _, user_id in rows]
+    invalidate_presence(*user_ids)
+    presence_expired.send(sender=UserAccount, pks=pks, user_ids=user_ids, at=now)
+    return user_ids
+
+
+def sweep():
+    """Flush this process's beats, then reap if no other worker did recently"""
+    flush()
+    if cache.add(REAP_LOCK_KEY, True, setting('REAP_INTERVAL')):
+        return reap()
+    return []
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _loop():
+    while True:
+        time.sleep(setting('FLUSH_INTERVAL'))
+        try:
+            sweep()
+        except Exception:
+            logger.exception('Heartbeat sweep failed')
+        finally:
+            connections.close_all()
+
+
+def _ensure_worker():
+    # Started lazily so each forked gunicorn worker gets its own thread
+    global _worker
+    if not setting('BACKGROUND') or (_worker is not None and _worker == os.getpid()):
+        return
+    with _worker_lock:
+        if _worker == os.getpid():
+            return
+        threading.Thread(target=_loop, name='heartbeat-sweep', daemon=True).start()
+        _worker = os.getpid()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
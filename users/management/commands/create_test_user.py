@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from users.models import UserAccount
+from users.passwords import hash_password
 
 class Command(BaseCommand):
     help = 'Create a test user for authentication testing'
@@ -22,7 +23,7 @@ class Command(BaseCommand):
         # Create the test user
         user = UserAccount.objects.create(
             user_id=username,
-            password=password,
+            password=hash_password(password),
             status=True,
             is_logged_in=False
         )
@@ -0,0 +1,165 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from users.models import UserAccount
+from users.passwords import hash_password
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'enabled', 'active')
+CREATE_ATTEMPTS = 3  # a batch is re-deduped when rows appear between its SELECT and INSERT
+
+
+def _parse_status(value):
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+class Command(BaseCommand):
+    help = 'Bulk import UserAccounts from a CSV or NDJSON file (or stdin) in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for stdin")
+        parser.add_argument('--format', choices=('auto', 'csv', 'ndjson'), default='auto',
+                            help='Input format (default: guessed from the file extension, csv for stdin)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per dedupe query, bulk_create and transaction')
+        parser.add_argument('--progress-every', type=int, default=50000,
+                            help='Print a progress line every N input rows (0 disables)')
+        parser.add_argument('--hash', action=argparse.BooleanOptionalAction, default=True,
+                            help='Hash plaintext passwords of new accounts while importing (the default; one '
+                                 'full hash per row). With --no-hash they are stored as given and hashed on '
+                                 'first login; already-hashed values are kept either way')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        fmt = options['format']
+        if fmt == 'auto':
+            fmt = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+        if path == '-':
+            stream = sys.stdin
+            close = False
+        else:
+            try:
+                stream = open(path, newline='', encoding='utf-8')
+            except OSError as e:
+                raise CommandError(f'Cannot open {path}: {e}')
+            close = True
+
+        try:
+            rows = self._read_csv(stream) if fmt == 'csv' else self._read_ndjson(stream)
+            self._hash = options['hash']
+            self._import(rows, batch_size, options['progress_every'])
+        finally:
+            if close:
+                stream.close()
+
+    def _read_csv(self, stream):
+        reader = csv.DictReader(stream)
+        if not reader.fieldnames or 'user_id' not in reader.fieldnames or 'password' not in reader.fieldnames:
+            raise CommandError('CSV header must contain user_id and password columns')
+        for line_no, row in enumerate(reader, start=2):
+            yield line_no, row
+
+    def _read_ndjson(self, stream):
+        for line_no, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise CommandError(f'Invalid JSON on line {line_no}: {e}')
+            if not isinstance(row, dict):
+                raise CommandError(f'Line {line_no} is not a JSON object')
+            yield line_no, row
+
+    def _accounts(self, rows, counts):
+        """Turn raw rows into unsaved UserAccounts, skipping invalid ones"""
+        for line_no, row in rows:
+            user_id = (row.get('user_id') or '').strip()
+            password = row.get('password') or ''
+            if not user_id or not password or len(user_id) > 50:
+                counts['invalid'] += 1
+                self.stderr.write(f'Skipping invalid row at line {line_no}')
+                continue
+            yield UserAccount(
+                user_id=user_id,
+                password=password,
+                status=_parse_status(row.get('status')),
+                is_logged_in=False,
+            )
+
+    def _import(self, rows, batch_size, progress_every):
+        counts = {'read': 0, 'created': 0, 'existing': 0, 'invalid': 0}
+        accounts = self._accounts(rows, counts)
+        started = time.monotonic()
+        next_report = progress_every
+
+        while True:
+            batch = list(islice(accounts, batch_size))
+            if not batch:
+                break
+            counts['read'] += len(batch)
+
+            # Drop duplicates inside the batch, then against the table
+            unique = {}
+            for account in batch:
+                unique.setdefault(account.user_id, account)
+            new = self._create(unique, batch_size)
+
+            counts['created'] += len(new)
+            counts['existing'] += len(batch) - len(new)
+
+            if progress_every and counts['read'] >= next_report:
+                next_report += progress_every
+                self.stdout.write(self._summary(counts, started))
+
+        self.stdout.write(self.style.SUCCESS(self._summary(counts, started)))
+
+    def _create(self, unique, batch_size):
+        """Insert the accounts whose user_id isn't taken yet; returns them"""
+        hashed = set()
+        for attempt in range(1, CREATE_ATTEMPTS + 1):
+            existing = set(
+                UserAccount.objects
+                .filter(user_id__in=list(unique))
+                .values_list('user_id', flat=True)
+            )
+            new = [a for uid, a in unique.items() if uid not in existing]
+            if self._hash:
+                # Only rows that will be written: hashing is the slow part
+                for account in new:
+                    if account.user_id not in hashed:
+                        account.password = hash_password(account.password)
+                        hashed.add(account.user_id)
+            try:
+                with transaction.atomic():
+                    UserAccount.objects.bulk_create(new, batch_size=batch_size)
+                return new
+            except IntegrityError:
+                # Another import or a signup took some of these user_ids since the SELECT
+                if attempt == CREATE_ATTEMPTS:
+                    raise
+                for account in new:
+                    account.pk = None
+
+    def _summary(self, counts, started):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        return (
+            f"read={counts['read']} created={counts['created']} "
+            f"skipped_existing={counts['existing']} invalid={counts['invalid']} "
+            f"elapsed={elapsed:.1f}s rate={counts['read'] / elapsed:.0f} rows/s"
+        )
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from users import heartbeat
+
+
+class Command(BaseCommand):
+    help = 'Log out accounts whose client heartbeat expired (one set-based UPDATE per sweep)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep sweeping every --interval seconds instead of once')
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Seconds between sweeps with --loop (default: PRESENCE_HEARTBEAT['REAP_INTERVAL'])")
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or heartbeat.setting('REAP_INTERVAL')
+        if interval <= 0:
+            raise CommandError('--interval must be positive')
+
+        while True:
+            reaped = heartbeat.reap()
+            if reaped:
+                self.stdout.write(self.style.SUCCESS(f'Logged out {len(reaped)} stale account(s): {", ".join(reaped[:20])}'
+                                                     + (' ...' if len(reaped) > 20 else '')))
+            elif not options['loop']:
+                self.stdout.write('No stale accounts')
+            if not options['loop']:
+                return
+            time.sleep(interval)
@@ -1,28 +1,85 @@
-from django.contrib.auth import logout
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import logout, alogout
 from .models import UserAccount
+from .presence import (get_presence, invalidate_presence, refresh_presence,
+                       aget_presence, ainvalidate_presence, arefresh_presence)
+
+# Paths that never need the single-session check. Skipping them also avoids
+# loading the session and auth user for static assets and health probes.
+DEFAULT_EXEMPT_PREFIXES = (
+    settings.STATIC_URL,
+    '/app/api/health/',
+    '/admin/jsi18n/',
+    '/favicon.ico',
+    '/metrics',
+)
+
+def _holds(presence, session_key):
+    return bool(presence) and presence['current_session'] == session_key
+
 
 class SessionManagementMiddleware:
+    """
+    Logs out sessions that are no longer their account's current session.
+    The presence cache may be a few seconds stale in this worker, so a
+    mismatch is confirmed against the database before acting on it, and
+    the account is only cleared if it still points at this session.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.exempt_prefixes = tuple(
+            getattr(settings, 'SESSION_CHECK_EXEMPT_PREFIXES', DEFAULT_EXEMPT_PREFIXES)
+        )
+        # Run natively under ASGI instead of being wrapped in a thread
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
         # Check if user is authenticated
-        if request.user.is_authenticated:
-            try:
-                # Get user account
-                user_account = UserAccount.objects.get(user_id=request.user.username)
-                
-                # Check if current session matches stored session
-                if user_account.current_session != request.session.session_key:
+        if not request.path.startswith(self.exempt_prefixes) and request.user.is_authenticated:
+            username = request.user.username
+            session_key = request.session.session_key
+            if not _holds(get_presence(username), session_key):
+                presence = refresh_presence(username)
+                if not presence:
+                    # User account not found - logout
+                    logout(request)
+                elif presence['current_session'] != session_key:
                     # Session mismatch - logout user
                     logout(request)
-                    user_account.is_logged_in = False
-                    user_account.current_session = None
-                    user_account.save()
-                    
-            except UserAccount.DoesNotExist:
-                # User account not found - logout
-                logout(request)
-        
+                    if UserAccount.objects.filter(user_id=username, current_session=session_key).update(
+                        is_logged_in=False,
+                        current_session=None,
+                    ):
+                        invalidate_presence(username)
+
         response = self.get_response(request)
         return response
+
+    async def __acall__(self, request):
+        if not request.path.startswith(self.exempt_prefixes):
+            user = await request.auser()
+            if user.is_authenticated:
+                username = user.username
+                session_key = request.session.session_key
+                if not _holds(await aget_presence(username), session_key):
+                    presence = await arefresh_presence(username)
+                    if not presence:
+                        await alogout(request)
+                    elif presence['current_session'] != session_key:
+                        await alogout(request)
+                        if await UserAccount.objects.filter(user_id=username, current_session=session_key).aupdate(
+                            is_logged_in=False,
+                            current_session=None,
+                        ):
+                            await ainvalidate_presence(username)
+
+        return await self.get_response(request)
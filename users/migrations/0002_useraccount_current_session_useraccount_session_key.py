@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useraccount',
+            name='current_session',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='useraccount',
+            name='session_key',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
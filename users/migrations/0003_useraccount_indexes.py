@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_useraccount_current_session_useraccount_session_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='useraccount',
+            index=models.Index(condition=models.Q(('is_logged_in', True)), fields=['is_logged_in'], name='useraccount_logged_in_idx'),
+        ),
+    ]
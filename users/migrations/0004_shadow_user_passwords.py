@@ -0,0 +1,29 @@
+from django.contrib.auth.hashers import make_password
+from django.db import migrations
+
+
+def disable_shadow_passwords(apps, schema_editor):
+    """
+    Shadow Users used to get the UserAccount password copied in on every
+    login. Credentials now live only on UserAccount (users.backends), so a
+    stale copy must not keep authenticating through ModelBackend.
+    """
+    User = apps.get_model('auth', 'User')
+    UserAccount = apps.get_model('users', 'UserAccount')
+    (User.objects
+     .filter(is_staff=False, is_superuser=False,
+             username__in=UserAccount.objects.values('user_id'))
+     .exclude(password__startswith='!')
+     .update(password=make_password(None)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0003_useraccount_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(disable_shadow_passwords, migrations.RunPython.noop),
+    ]
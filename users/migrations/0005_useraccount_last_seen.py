@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_shadow_user_passwords'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useraccount',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -9,6 +9,14 @@ class UserAccount(models.Model):
     last_login = models.DateTimeField(null=True, blank=True)
     current_session = models.CharField(max_length=100, null=True, blank=True)  # Added for session management
     session_key = models.CharField(max_length=100, null=True, blank=True)  # Added for session management
+    last_seen = models.DateTimeField(null=True, blank=True)  # Client heartbeat, flushed in batches (users/heartbeat.py)
+
+    class Meta:
+        indexes = [
+            # Online accounts are a small slice of the table; index just those
+            models.Index(fields=['is_logged_in'], condition=models.Q(is_logged_in=True),
+                         name='useraccount_logged_in_idx'),
+        ]
 
     def __str__(self):
         return self.user_id
@@ -0,0 +1,67 @@
+"""
+UserAccount password hashing
+
+Passwords are stored with Django's configured hasher (PASSWORD_HASHERS).
+Rows created before hashing was introduced hold the plaintext; they still
+verify, and the caller is handed a hash to store in their place, so every
+account is upgraded on its next successful login. Verification is the only
+expensive step: each login costs exactly one hash check.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.utils.crypto import constant_time_compare
+
+from .models import UserAccount
+
+
+def is_hashed(value):
+    try:
+        identify_hasher(value)
+    except ValueError:
+        return False
+    return True
+
+
+def hash_password(raw_password):
+    """Hash for storing in UserAccount.password (already-hashed values pass through)"""
+    if is_hashed(raw_password):
+        return raw_password
+    return make_password(raw_password)
+
+
+def verify(raw_password, stored):
+    """
+    Check raw_password against the stored value. Returns (valid, new_hash);
+    new_hash is set when stored should be replaced: a legacy plaintext row,
+    or a hash made with outdated hasher settings.
+    """
+    if not raw_password or not stored:
+        return False, None
+
+    if not is_hashed(stored):
+        if constant_time_compare(raw_password, stored):
+            return True, make_password(raw_password)
+        return False, None
+
+    rehashed = []
+    valid = check_password(raw_password, stored, setter=lambda raw: rehashed.append(make_password(raw)))
+    return valid, (rehashed[0] if valid and rehashed else None)
+
+
+# Hashing is pure CPU: under ASGI run it in the default thread pool rather than
+# the single thread shared by sync_to_async(thread_sensitive=True) calls, so
+# concurrent logins hash in parallel and don't stall other ORM work.
+averify = sync_to_async(verify, thread_sensitive=False)
+
+
+def _upgrade_queryset(pk, stored):
+    # Only replace the value that was verified, never a concurrent change
+    return UserAccount.objects.filter(pk=pk, password=stored)
+
+
+def upgrade(pk, stored, new_hash):
+    return _upgrade_queryset(pk, stored).update(password=new_hash)
+
+
+async def aupgrade(pk, stored, new_hash):
+    return await _upgrade_queryset(pk, stored).aupdate(password=new_hash)
@@ -0,0 +1,176 @@
+"""
+Presence cache for single-session enforcement.
+
+SessionManagementMiddleware needs ``current_session`` and ``status`` for the
+logged-in user on every request. Those values only change on login, logout,
+enable/disable and delete, so they are cached here in two tiers:
+
+* a small per-process LRU with a short TTL (no network hop at all), and
+* Django's cache framework, shared between workers when CACHES points at a
+  shared backend.
+
+Every code path that changes those fields must call ``set_presence`` or
+``invalidate_presence`` so the cache never serves a stale session key for
+longer than the local TTL. Both also publish the change to users.events,
+which pushes it to live dashboards.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import UserAccount
+from .events import publish
+
+DEFAULTS = {
+    'LOCAL_MAXSIZE': 10000,  # entries kept in the per-process LRU
+    'LOCAL_TTL': 5,          # seconds an LRU entry is trusted
+    'TTL': 300,              # seconds an entry lives in the shared cache
+    'KEY_PREFIX': 'presence:',
+}
+
+# Stored for user_ids that have no UserAccount row, so repeated requests from
+# a deleted account don't fall through to the database either.
+ABSENT = {}
+
+
+def _conf(name):
+    return getattr(settings, 'PRESENCE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+class LocalLRU:
+    """Thread-safe LRU with a per-entry TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = LocalLRU(_conf('LOCAL_MAXSIZE'), _conf('LOCAL_TTL'))
+
+
+def _key(user_id):
+    return f"{_conf('KEY_PREFIX')}{user_id}"
+
+
+def _presence_query(user_id):
+    return UserAccount.objects.filter(user_id=user_id).values('current_session', 'status')
+
+
+def _load(user_id):
+    row = _presence_query(user_id).first()
+    return row if row is not None else ABSENT
+
+
+def get_presence(user_id):
+    """
+    Return ``{'current_session': ..., 'status': ...}`` for user_id, or ABSENT
+    if the account does not exist. Only hits the database on a full miss.
+    """
+    value = _local.get(user_id)
+    if value is not None:
+        return value
+
+    value = cache.get(_key(user_id))
+    if value is None:
+        value = _load(user_id)
+        cache.set(_key(user_id), value, _conf('TTL'))
+    _local.set(user_id, value)
+    return value
+
+
+def refresh_presence(user_id):
+    """Reload user_id from the database into both tiers and return it"""
+    value = _load(user_id)
+    cache.set(_key(user_id), value, _conf('TTL'))
+    _local.set(user_id, value)
+    return value
+
+
+def set_presence(user_id, current_session, status=True):
+    """Write-through after a login or any change whose new values are known."""
+    value = {'current_session': current_session, 'status': status}
+    cache.set(_key(user_id), value, _conf('TTL'))
+    _local.set(user_id, value)
+    publish(user_id)
+
+
+def invalidate_presence(*user_ids):
+    """Drop cached presence so the next lookup reloads from the database."""
+    if not user_ids:
+        return
+    cache.delete_many([_key(uid) for uid in user_ids])
+    for uid in user_ids:
+        _local.delete(uid)
+    publish(*user_ids)
+
+
+# Async variants for the ASGI code paths (see main_app/async_api_views.py)
+
+async def aget_presence(user_id):
+    value = _local.get(user_id)
+    if value is not None:
+        return value
+
+    value = await cache.aget(_key(user_id))
+    if value is None:
+        row = await _presence_query(user_id).afirst()
+        value = row if row is not None else ABSENT
+        await cache.aset(_key(user_id), value, _conf('TTL'))
+    _local.set(user_id, value)
+    return value
+
+
+async def arefresh_presence(user_id):
+    row = await _presence_query(user_id).afirst()
+    value = row if row is not None else ABSENT
+    await cache.aset(_key(user_id), value, _conf('TTL'))
+    _local.set(user_id, value)
+    return value
+
+
+async def aset_presence(user_id, current_session, status=True):
+    value = {'current_session': current_session, 'status': status}
+    await cache.aset(_key(user_id), value, _conf('TTL'))
+    _local.set(user_id, value)
+    publish(user_id)
+
+
+async def ainvalidate_presence(*user_ids):
+    if not user_ids:
+        return
+    await cache.adelete_many([_key(uid) for uid in user_ids])
+    for uid in user_ids:
+        _local.delete(uid)
+    publish(*user_ids)
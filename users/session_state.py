@@ -0,0 +1,265 @@
+"""
+Shared login/logout state transitions for UserAccount.
+
+Every login path (admin panel, main app, JSON API, JWT) claims the account
+with one conditional UPDATE instead of read / check in Python / save(). The
+database decides whether the claim wins, so two concurrent logins can never
+both pass the single-session check. Password checks need the stored hash,
+so a claim with a password reads the row once before the UPDATE; without
+one the success path costs a single query.
+
+Each successful transition pins the user to the primary for a few seconds
+(internet_art_tools/replicas.py), so the reads right after a login or
+logout don't come from a replica that hasn't seen it yet.
+"""
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.db import connections, router
+from django.db.models import Q
+from django.utils import timezone
+from internet_art_tools.replicas import apin, pin
+
+from .models import UserAccount
+from .presence import set_presence, invalidate_presence, ainvalidate_presence
+from .events import publish
+from .heartbeat import is_stale, timeout as heartbeat_timeout
+from . import passwords
+
+OK = 'ok'
+NOT_FOUND = 'not_found'
+DISABLED = 'disabled'
+ALREADY_LOGGED_IN = 'already_logged_in'
+INVALID_PASSWORD = 'invalid_password'
+
+# Stored in current_session by an exclusive claim made without a session_id
+PENDING_SESSION = 'pending'
+
+Claim = namedtuple('Claim', 'outcome pk last_login')
+
+
+def _field(name):
+    return UserAccount._meta.get_field(name)
+
+
+def _account_row(user_id):
+    return (UserAccount.objects
+            .filter(user_id=user_id)
+            .values('pk', 'password', 'status', 'is_logged_in', 'current_session', 'last_seen'))
+
+
+def _refusal(row, exclusive):
+    """Why row can't be claimed, in the order the views always checked, or None"""
+    if row is None:
+        return NOT_FOUND
+    if not row['status']:
+        return DISABLED
+    if (exclusive and row['is_logged_in'] and row['current_session']
+            and not is_stale(row['last_seen'])):
+        return ALREADY_LOGGED_IN
+    return None
+
+
+def claim_session(user_id, password=None, session_id=None, device_ip=None, exclusive=True,
+                  heartbeat=False):
+    """
+    Mark user_id as logged in if it exists, is enabled, the password matches
+    (when given) and, when exclusive, it is not already logged in with a
+    live session (a heartbeat session past its timeout counts as free).
+    session_id is stored as current_session/session_key only for exclusive
+    claims; device_ip only when given. heartbeat=True is for clients that
+    ping users.heartbeat: last_seen starts now and the reaper frees the
+    account if the beats stop. Other exclusive logins clear last_seen;
+    non-exclusive ones leave it as it is.
+
+    Passwords are hashed, so when one is given the row is read and verified
+    first (one hash check; a legacy plaintext password is upgraded in the
+    claiming UPDATE) and the UPDATE only applies if the stored password is
+    still the one that was verified. Without a password the claim is a
+    single UPDATE.
+
+    Returns Claim(outcome, pk, last_login); outcome is OK or the reason the
+    claim was refused, in the same order the views used to check them.
+    """
+    verified = None
+    if password is not None:
+        row = _account_row(user_id).first()
+        outcome = _refusal(row, exclusive)
+        if outcome is not None:
+            return Claim(outcome, None, None)
+        valid, new_hash = passwords.verify(password, row['password'])
+        if not valid:
+            return Claim(INVALID_PASSWORD, None, None)
+        verified = (row['password'], new_hash)
+    return _claim(user_id, session_id, device_ip, exclusive, heartbeat, verified)
+
+
+async def aclaim_session(user_id, password=None, session_id=None, device_ip=None, exclusive=True,
+                         heartbeat=False):
+    """
+    Async claim_session() for main_app/async_api_views.py. The hash check
+    runs in the thread pool (passwords.averify) so concurrent logins don't
+    queue behind each other; the raw-SQL claim goes through sync_to_async.
+    """
+    verified = None
+    if password is not None:
+        row = await _account_row(user_id).afirst()
+        outcome = _refusal(row, exclusive)
+        if outcome is not None:
+            return Claim(outcome, None, None)
+        valid, new_hash = await passwords.averify(password, row['password'])
+        if not valid:
+            return Claim(INVALID_PASSWORD, None, None)
+        verified = (row['password'], new_hash)
+    return await sync_to_async(_claim)(user_id, session_id, device_ip, exclusive, heartbeat, verified)
+
+
+def _claim(user_id, session_id, device_ip, exclusive, heartbeat, verified):
+    """
+    The conditional UPDATE. verified is (stored password, new hash or None)
+    from a password check, or None when no password was given.
+    """
+    connection = connections[router.db_for_write(UserAccount)]
+    qn = connection.ops.quote_name
+    now = timezone.now()
+
+    def col(name):
+        return qn(_field(name).column)
+
+    def prep(name, value):
+        return _field(name).get_db_prep_save(value, connection)
+
+    assignments = [(col('is_logged_in'), prep('is_logged_in', True)),
+                   (col('last_login'), prep('last_login', now))]
+    if heartbeat:
+        assignments.append((col('last_seen'), prep('last_seen', now)))
+    elif exclusive:
+        # The new session replaces the old one and doesn't beat
+        assignments.append((col('last_seen'), prep('last_seen', None)))
+    # A non-exclusive login shares the row with whatever session holds it,
+    # so its last_seen is left alone and the reaper still sees that session
+    if exclusive:
+        stored = session_id or PENDING_SESSION
+        assignments += [(col('current_session'), stored), (col('session_key'), stored)]
+    if device_ip is not None:
+        assignments.append((col('device_ip'), prep('device_ip', device_ip)))
+
+    where = [f"{col('user_id')} = %s", f"{col('status')} = %s"]
+    where_params = [user_id, prep('status', True)]
+    if verified is not None:
+        stored_password, new_hash = verified
+        where.append(f"{col('password')} = %s")
+        where_params.append(stored_password)
+        if new_hash:
+            assignments.append((col('password'), new_hash))
+    if exclusive:
+        # Free unless logged in with a session whose heartbeat (if any) is live
+        where.append(f"NOT ({col('is_logged_in')} = %s AND {col('current_session')} IS NOT NULL"
+                     f" AND ({col('last_seen')} IS NULL OR {col('last_seen')} >= %s))")
+        where_params += [prep('is_logged_in', True), prep('last_seen', now - heartbeat_timeout())]
+
+    # UPDATE ... RETURNING: PostgreSQL, and SQLite >= 3.35 (same threshold as
+    # INSERT ... RETURNING). Elsewhere the pk costs one extra SELECT.
+    returning = connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert
+    sql = 'UPDATE {} SET {} WHERE {}{}'.format(
+        qn(UserAccount._meta.db_table),
+        ', '.join(f'{column} = %s' for column, _ in assignments),
+        ' AND '.join(where),
+        f" RETURNING {col('id')}" if returning else '',
+    )
+    params = [value for _, value in assignments] + where_params
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        if returning:
+            row = cursor.fetchone()
+            pk = row[0] if row else None
+        else:
+            pk = None
+            if cursor.rowcount:
+                pk = UserAccount.objects.using(connection.alias).values_list('pk', flat=True).get(user_id=user_id)
+
+    if pk is None:
+        return Claim(_refusal_reason(user_id, exclusive), None, None)
+
+    pin(user_id)
+    if exclusive:
+        set_presence(user_id, session_id or PENDING_SESSION, True)
+    else:
+        publish(user_id)  # presence cache unaffected, but dashboards show the login
+    return Claim(OK, pk, now)
+
+
+def _refusal_reason(user_id, exclusive):
+    # Lost a race with a concurrent login, status or password change
+    return _refusal(_account_row(user_id).first(), exclusive) or INVALID_PASSWORD
+
+
+def _release(user_id, clear_session):
+    values = {'is_logged_in': False}
+    if clear_session:
+        values.update(current_session=None, session_key=None)
+    return UserAccount.objects.filter(user_id=user_id), values
+
+
+def release_session(user_id, password=None, clear_session=True):
+    """
+    Mark user_id as logged out with one UPDATE. When password is given it
+    must match (checked against the hash first, then required unchanged in
+    the UPDATE). clear_session=False leaves current_session/session_key
+    alone (the main app login never sets them). Returns the number of rows
+    changed.
+    """
+    queryset, values = _release(user_id, clear_session)
+    if password is not None:
+        row = queryset.values('password').first()
+        if row is None or not passwords.verify(password, row['password'])[0]:
+            return 0
+        queryset = queryset.filter(password=row['password'])
+    count = queryset.update(**values)
+    if count:
+        invalidate_presence(user_id)
+        pin(user_id)
+    return count
+
+
+def release_many(credentials):
+    """
+    release_session() with a password for many accounts at once: one SELECT
+    for the stored hashes, a hash check per account, then one UPDATE that
+    only matches rows whose password is still the one verified. credentials
+    maps user_id to raw password. Returns {user_id: OK, NOT_FOUND or
+    INVALID_PASSWORD}.
+    """
+    stored = dict(UserAccount.objects.filter(user_id__in=list(credentials)).values_list('user_id', 'password'))
+    outcomes = {}
+    verified = Q(pk__in=[])
+    for user_id, password in credentials.items():
+        if user_id not in stored:
+            outcomes[user_id] = NOT_FOUND
+        elif passwords.verify(password, stored[user_id])[0]:
+            outcomes[user_id] = OK
+            verified |= Q(user_id=user_id, password=stored[user_id])
+        else:
+            outcomes[user_id] = INVALID_PASSWORD
+
+    released = [user_id for user_id, outcome in outcomes.items() if outcome == OK]
+    if released:
+        UserAccount.objects.filter(verified).update(is_logged_in=False, current_session=None, session_key=None)
+        invalidate_presence(*released)
+        pin(*released)
+    return outcomes
+
+
+async def arelease_session(user_id, password=None, clear_session=True):
+    queryset, values = _release(user_id, clear_session)
+    if password is not None:
+        row = await queryset.values('password').afirst()
+        if row is None or not (await passwords.averify(password, row['password']))[0]:
+            return 0
+        queryset = queryset.filter(password=row['password'])
+    count = await queryset.aupdate(**values)
+    if count:
+        await ainvalidate_presence(user_id)
+        await apin(user_id)
+    return count
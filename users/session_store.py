@@ -0,0 +1,252 @@
+"""
+Write-coalescing session engine (SESSION_ENGINE = 'users.session_store')
+
+Like Django's cached_db backend, sessions are read from the cache and fall
+back to django_session. The difference is in save(): with
+SESSION_SAVE_EVERY_REQUEST every response calls it, but a database write
+only happens when the session data changed or when the sliding expiry has
+moved more than SESSION_REFRESH_THRESHOLD seconds past the stored
+expire_date. A status poll on an unchanged session therefore does no
+session write at all; the stored expiry is refreshed at most once per
+threshold, so the server-side session can lapse at most that much earlier
+than the cookie.
+
+A login's new session row is written once: cycle_key() only picks the new
+key, and the response's save() INSERTs it with the logged-in data (Django
+INSERTs it empty, then UPDATEs it). reserve_key() tells a login view that
+key before login() runs, so it can be stored with the account's claim.
+
+Changed data is still written through to the database immediately. The
+cache is only read when it is shared between workers: a per-process cache
+(LocMem, the default CACHES) can't see a logout or flush() handled by
+another worker, so with one every load() reads django_session (and saves
+still skip unchanged sessions). Set CACHE_BACKEND to memcached or redis to
+serve sessions from the cache.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+
+KEY_PREFIX = 'users.session_store'
+
+logger = logging.getLogger('django.contrib.sessions')
+
+
+def is_shared(cache):
+    """False for caches each process keeps to itself"""
+    return not isinstance(cache, LocMemCache)
+
+
+def refresh_threshold():
+    return timedelta(seconds=getattr(settings, 'SESSION_REFRESH_THRESHOLD', 3600))
+
+
+class SessionStore(DBStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._cache = caches[settings.SESSION_CACHE_ALIAS]
+        self._shared = is_shared(self._cache)
+        # (serialized data, expire_date) as last written to the database
+        self._stored = None
+        self._next_key = None         # picked by reserve_key(), used by the next cycle
+        self._create_on_save = False  # cycled key not in the database yet
+        super().__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return self.cache_key_prefix + self._get_or_create_session_key()
+
+    async def acache_key(self):
+        return self.cache_key_prefix + await self._aget_or_create_session_key()
+
+    def _serialize(self, data):
+        return self.serializer().dumps(data)
+
+    def _remember(self, data, expire_date):
+        """Record what is in the database; returns the cache entry for it"""
+        self._stored = (self._serialize(data), expire_date)
+        return {'data': data, 'expire_date': expire_date}
+
+    def _from_cache(self, entry):
+        if not entry or entry['expire_date'] <= timezone.now():
+            return None
+        self._remember(entry['data'], entry['expire_date'])
+        return entry['data']
+
+    def _unchanged(self, data, expire_date):
+        if self._stored is None:
+            return False
+        stored_data, stored_expiry = self._stored
+        return (
+            expire_date - stored_expiry < refresh_threshold()
+            and self._serialize(data) == stored_data
+        )
+
+    # -- load -------------------------------------------------------------
+
+    def load(self):
+        if self._shared:
+            try:
+                data = self._from_cache(self._cache.get(self.cache_key))
+            except Exception:
+                # Some backends raise on invalid cache keys; fall back to the DB
+                data = None
+            if data is not None:
+                return data
+
+        s = self._get_session_from_db()
+        if not s:
+            return {}
+        data = self.decode(s.session_data)
+        entry = self._remember(data, s.expire_date)
+        if self._shared:
+            self._cache.set(self.cache_key, entry, self.get_expiry_age(expiry=s.expire_date))
+        return data
+
+    async def aload(self):
+        if self._shared:
+            try:
+                data = self._from_cache(await self._cache.aget(await self.acache_key()))
+            except Exception:
+                data = None
+            if data is not None:
+                return data
+
+        s = await self._aget_session_from_db()
+        if not s:
+            return {}
+        data = self.decode(s.session_data)
+        entry = self._remember(data, s.expire_date)
+        if self._shared:
+            await self._cache.aset(await self.acache_key(), entry,
+                                   await self.aget_expiry_age(expiry=s.expire_date))
+        return data
+
+    def exists(self, session_key):
+        return (
+            self._shared and session_key
+            and (self.cache_key_prefix + session_key) in self._cache
+            or super().exists(session_key)
+        )
+
+    async def aexists(self, session_key):
+        return (
+            self._shared and session_key
+            and await self._cache.ahas_key(self.cache_key_prefix + session_key)
+            or await super().aexists(session_key)
+        )
+
+    # -- cycle ------------------------------------------------------------
+
+    def reserve_key(self):
+        """The key the next cycle_key() or flush() switches to; nothing is written"""
+        if self._next_key is None:
+            self._next_key = self._get_new_session_key()
+        return self._next_key
+
+    def _switch_key(self, session_key):
+        self._session_key = session_key
+        self._next_key = None
+        self._stored = None
+        self._create_on_save = True
+        self.modified = True
+
+    def cycle_key(self):
+        data = self._session
+        key = self.session_key
+        self._switch_key(self._next_key or self._get_new_session_key())
+        self._session_cache = data
+        if key:
+            self.delete(key)
+
+    async def acycle_key(self):
+        data = await self._aget_session()
+        key = self.session_key
+        self._switch_key(self._next_key or await self._aget_new_session_key())
+        self._session_cache = data
+        if key:
+            await self.adelete(key)
+
+    # -- save -------------------------------------------------------------
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        must_create = must_create or self._create_on_save
+        data = self._get_session(no_load=must_create)
+        expire_date = self.get_expiry_date()
+        if not must_create and self._unchanged(data, expire_date):
+            return
+        super().save(must_create)
+        self._create_on_save = False
+        if not self._shared:
+            self._stored = (self._serialize(data), expire_date)
+            return
+        try:
+            self._cache.set(self.cache_key, self._remember(data, expire_date),
+                            self.get_expiry_age(expiry=expire_date))
+        except Exception:
+            logger.exception("Error saving to cache (%s)", self._cache)
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            return await self.acreate()
+        must_create = must_create or self._create_on_save
+        data = await self._aget_session(no_load=must_create)
+        expire_date = await self.aget_expiry_date()
+        if not must_create and self._unchanged(data, expire_date):
+            return
+        await super().asave(must_create)
+        self._create_on_save = False
+        if not self._shared:
+            self._stored = (self._serialize(data), expire_date)
+            return
+        try:
+            await self._cache.aset(await self.acache_key(), self._remember(data, expire_date),
+                                   await self.aget_expiry_age(expiry=expire_date))
+        except Exception:
+            logger.exception("Error saving to cache (%s)", self._cache)
+
+    # -- delete -----------------------------------------------------------
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(self.cache_key_prefix + session_key)
+        self.model.objects.filter(session_key=session_key).delete()
+        if session_key == self.session_key:
+            self._stored = None
+
+    async def adelete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        await self._cache.adelete(self.cache_key_prefix + session_key)
+        await self.model.objects.filter(session_key=session_key).adelete()
+        if session_key == self.session_key:
+            self._stored = None
+
+    def flush(self):
+        self.clear()
+        self.delete(self.session_key)
+        self._session_key = None
+        self._create_on_save = False
+        if self._next_key:
+            self._switch_key(self._next_key)
+
+    async def aflush(self):
+        self.clear()
+        await self.adelete(self.session_key)
+        self._session_key = None
+        self._create_on_save = False
+        if self._next_key:
+            self._switch_key(self._next_key)
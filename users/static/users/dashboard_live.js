@@ -0,0 +1,59 @@
+// Live dashboard: follow the rows on screen over /dashboard/events/ (users/events.py)
+// and patch them in place instead of reloading the page.
+(function () {
+    var script = document.currentScript;
+    var rows = {};
+    document.querySelectorAll('tr[data-user]').forEach(function (tr) {
+        rows[tr.dataset.user] = tr;
+    });
+    var ids = Object.keys(rows);
+    if (!ids.length || !window.EventSource) {
+        return;
+    }
+
+    function pill(className, text) {
+        var span = document.createElement('span');
+        span.className = 'pill ' + className;
+        span.textContent = text;
+        return span;
+    }
+
+    function patch(row) {
+        var tr = rows[row.user_id];
+        if (!tr) {
+            return;
+        }
+        if (row.deleted) {
+            tr.classList.add('dim');
+            tr.querySelectorAll('input, .row-actions').forEach(function (el) { el.remove(); });
+            return;
+        }
+
+        var status = tr.querySelector('[data-field="status"]');
+        status.className = 'pill ' + (row.status ? 'enabled' : 'disabled');
+        status.textContent = row.status ? 'Enabled' : 'Disabled';
+
+        tr.querySelector('[data-field="is_logged_in"]').replaceChildren(
+            row.is_logged_in ? pill('online', 'Online') : pill('offline', 'Offline'));
+
+        tr.querySelector('[data-field="last_login"]').textContent = row.last_login || 'Never';
+
+        var ip = document.createElement('div');
+        ip.className = row.device_ip ? 'ip' : 'ip dim';
+        ip.textContent = row.device_ip || '—';
+        tr.querySelector('[data-field="device_ip"]').replaceChildren(ip);
+    }
+
+    var params = new URLSearchParams();
+    ids.forEach(function (id) { params.append('u', id); });
+    var source = new EventSource(script.dataset.eventsUrl + '?' + params.toString());
+    source.addEventListener('users', function (event) {
+        JSON.parse(event.data).forEach(patch);
+    });
+    source.onerror = function () {
+        // Not served (WSGI) or rejected: the page still works with reloads
+        if (source.readyState === EventSource.CLOSED) {
+            source.close();
+        }
+    };
+})();
@@ -0,0 +1,872 @@
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.models import QuerySet
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from main_app.models import UserSession
+from panel_client import PanelClient, PanelError, PanelUnavailable
+from panel_client.client import LOGOUT_BATCH_SIZE
+from panel_client.policy import RetryPolicy
+from panel_client.transport import Response
+from rest_framework.test import APIClient
+
+from . import bulk, events, heartbeat, passwords, presence, session_state, throttle
+from .backends import UserAccountBackend
+from .management.commands import import_users
+from .models import UserAccount
+from .passwords import hash_password, is_hashed
+from .session_store import SessionStore
+from .views import dashboard_events
+
+# The default PBKDF2 hasher costs ~0.5 s per check
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def _during_verify(action):
+    """Patch passwords.verify to run `action` after the check, before the UPDATE"""
+    real = passwords.verify
+
+    def verify(raw_password, stored):
+        result = real(raw_password, stored)
+        action()
+        return result
+    return mock.patch.object(passwords, 'verify', verify)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ClaimSessionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        UserAccount.objects.create(user_id='alice', password=hash_password('secret'))
+
+    def account(self):
+        return UserAccount.objects.get(user_id='alice')
+
+    def test_claim_marks_logged_in(self):
+        claim = session_state.claim_session('alice', password='secret', session_id='s1')
+        self.assertEqual(claim.outcome, session_state.OK)
+        account = self.account()
+        self.assertEqual(claim.pk, account.pk)
+        self.assertTrue(account.is_logged_in)
+        self.assertEqual(account.current_session, 's1')
+        self.assertEqual(account.session_key, 's1')
+
+    def test_refusals_in_order(self):
+        self.assertEqual(session_state.claim_session('nobody', password='x').outcome, session_state.NOT_FOUND)
+        self.assertEqual(session_state.claim_session('alice', password='wrong').outcome,
+                         session_state.INVALID_PASSWORD)
+        UserAccount.objects.filter(user_id='alice').update(status=False)
+        self.assertEqual(session_state.claim_session('alice', password='wrong').outcome, session_state.DISABLED)
+
+    def test_second_exclusive_claim_refused(self):
+        session_state.claim_session('alice', password='secret', session_id='s1')
+        claim = session_state.claim_session('alice', password='secret', session_id='s2')
+        self.assertEqual(claim.outcome, session_state.ALREADY_LOGGED_IN)
+        self.assertEqual(self.account().current_session, 's1')
+
+    def test_non_exclusive_claim_leaves_session_alone(self):
+        session_state.claim_session('alice', session_id='s1')
+        claim = session_state.claim_session('alice', password='secret', exclusive=False)
+        self.assertEqual(claim.outcome, session_state.OK)
+        self.assertEqual(self.account().current_session, 's1')
+
+    def test_stale_heartbeat_session_is_free(self):
+        session_state.claim_session('alice', session_id='s1', heartbeat=True)
+        UserAccount.objects.filter(user_id='alice').update(last_seen=timezone.now() - timedelta(days=1))
+        claim = session_state.claim_session('alice', password='secret', session_id='s2')
+        self.assertEqual(claim.outcome, session_state.OK)
+        self.assertEqual(self.account().current_session, 's2')
+
+    def test_claim_loses_race_with_concurrent_login(self):
+        # Another login wins between this one's password check and its UPDATE
+        with _during_verify(lambda: session_state.claim_session('alice', session_id='winner')):
+            claim = session_state.claim_session('alice', password='secret', session_id='loser')
+        self.assertEqual(claim.outcome, session_state.ALREADY_LOGGED_IN)
+        self.assertIsNone(claim.pk)
+        self.assertEqual(self.account().current_session, 'winner')
+
+    def test_claim_loses_race_with_password_change(self):
+        def change_password():
+            UserAccount.objects.filter(user_id='alice').update(password=hash_password('changed'))
+        with _during_verify(change_password):
+            claim = session_state.claim_session('alice', password='secret', session_id='s1')
+        self.assertEqual(claim.outcome, session_state.INVALID_PASSWORD)
+        self.assertFalse(self.account().is_logged_in)
+
+    def test_claim_loses_race_with_disable(self):
+        with _during_verify(lambda: UserAccount.objects.filter(user_id='alice').update(status=False)):
+            claim = session_state.claim_session('alice', password='secret', session_id='s1')
+        self.assertEqual(claim.outcome, session_state.DISABLED)
+        self.assertFalse(self.account().is_logged_in)
+
+    def test_legacy_plaintext_password_upgraded_by_claim(self):
+        UserAccount.objects.filter(user_id='alice').update(password='plain')
+        claim = session_state.claim_session('alice', password='plain', session_id='s1')
+        self.assertEqual(claim.outcome, session_state.OK)
+        self.assertTrue(passwords.is_hashed(self.account().password))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ReleaseSessionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for user_id in ('alice', 'bob'):
+            UserAccount.objects.create(user_id=user_id, password=hash_password('secret'))
+            session_state.claim_session(user_id, session_id=f'{user_id}-session')
+
+    def test_release_with_password(self):
+        self.assertEqual(session_state.release_session('alice', password='secret'), 1)
+        account = UserAccount.objects.get(user_id='alice')
+        self.assertFalse(account.is_logged_in)
+        self.assertIsNone(account.current_session)
+        self.assertIsNone(account.session_key)
+
+    def test_release_with_wrong_password_changes_nothing(self):
+        self.assertEqual(session_state.release_session('alice', password='wrong'), 0)
+        self.assertTrue(UserAccount.objects.get(user_id='alice').is_logged_in)
+
+    def test_release_loses_race_with_password_change(self):
+        def change_password():
+            UserAccount.objects.filter(user_id='alice').update(password=hash_password('changed'))
+        with _during_verify(change_password):
+            self.assertEqual(session_state.release_session('alice', password='secret'), 0)
+        self.assertTrue(UserAccount.objects.get(user_id='alice').is_logged_in)
+
+    def test_release_keeping_session(self):
+        session_state.release_session('alice', clear_session=False)
+        account = UserAccount.objects.get(user_id='alice')
+        self.assertFalse(account.is_logged_in)
+        self.assertEqual(account.current_session, 'alice-session')
+
+    def test_release_frees_account_for_next_claim(self):
+        session_state.release_session('alice')
+        claim = session_state.claim_session('alice', password='secret', session_id='again')
+        self.assertEqual(claim.outcome, session_state.OK)
+
+    def test_release_many_outcomes(self):
+        outcomes = session_state.release_many({'alice': 'secret', 'bob': 'wrong', 'nobody': 'secret'})
+        self.assertEqual(outcomes, {'alice': session_state.OK, 'bob': session_state.INVALID_PASSWORD,
+                                    'nobody': session_state.NOT_FOUND})
+        self.assertEqual(set(UserAccount.objects.filter(is_logged_in=True).values_list('user_id', flat=True)),
+                         {'bob'})
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class HeartbeatReapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        UserAccount.objects.create(user_id='alice', password=hash_password('secret'))
+
+    def test_non_exclusive_login_keeps_heartbeat(self):
+        session_state.claim_session('alice', session_id='desktop', heartbeat=True)
+        last_seen = UserAccount.objects.get(user_id='alice').last_seen
+        session_state.claim_session('alice', password='secret', exclusive=False)
+        self.assertEqual(UserAccount.objects.get(user_id='alice').last_seen, last_seen)
+        # The desktop client stops beating: the reaper still frees the account
+        self.assertEqual(heartbeat.reap(now=last_seen + heartbeat.timeout() + timedelta(seconds=1)), ['alice'])
+        self.assertFalse(UserAccount.objects.get(user_id='alice').is_logged_in)
+
+    def test_exclusive_web_login_is_not_reaped(self):
+        session_state.claim_session('alice', password='secret', session_id='web')
+        self.assertIsNone(UserAccount.objects.get(user_id='alice').last_seen)
+        self.assertEqual(heartbeat.reap(now=timezone.now() + timedelta(days=1)), [])
+
+    def test_account_that_logged_in_again_is_not_signalled(self):
+        UserAccount.objects.create(user_id='bob', password='x')
+        long_ago = timezone.now() - timedelta(days=1)
+        UserAccount.objects.update(is_logged_in=True, last_seen=long_ago)
+        real_update = QuerySet.update
+
+        def update(queryset, **kwargs):
+            if kwargs.get('is_logged_in') is False:
+                # bob's fresh login lands between the reaper's SELECT and UPDATE
+                real_update(UserAccount.objects.filter(user_id='bob'), last_seen=timezone.now())
+            return real_update(queryset, **kwargs)
+        signalled = []
+
+        def receiver(sender, user_ids, **kwargs):
+            signalled.extend(user_ids)
+        heartbeat.presence_expired.connect(receiver)
+        self.addCleanup(heartbeat.presence_expired.disconnect, receiver)
+        with mock.patch.object(QuerySet, 'update', update):
+            self.assertEqual(heartbeat.reap(), ['alice'])
+        self.assertEqual(signalled, ['alice'])
+        self.assertTrue(UserAccount.objects.get(user_id='bob').is_logged_in)
+
+
+@override_settings(PRESENCE_HEARTBEAT={'BACKGROUND': False})
+class HeartbeatFlushTests(TestCase):
+    def setUp(self):
+        with heartbeat._lock:
+            heartbeat._pending.clear()
+            heartbeat._written.clear()
+        UserAccount.objects.create(user_id='alice', password='x')
+
+    def test_failed_flush_keeps_beats(self):
+        when = timezone.now()
+        heartbeat.beat('alice', when)
+        with mock.patch.object(QuerySet, 'update', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                heartbeat.flush()
+        self.assertNotIn('alice', heartbeat._written)
+        # Not skipped as already written: the next flush writes it
+        heartbeat.beat('alice', when + timedelta(seconds=1))
+        self.assertEqual(heartbeat.flush(), 1)
+        self.assertEqual(UserAccount.objects.get(user_id='alice').last_seen, when + timedelta(seconds=1))
+        self.assertEqual(heartbeat._written['alice'], when + timedelta(seconds=1))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class PanelLoginTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for user_id in ('alice', 'bob'):
+            UserAccount.objects.create(user_id=user_id, password=hash_password('secret'))
+
+    def log_in(self, user_id):
+        return self.client.post('/login/', {'username': user_id, 'password': 'secret'})
+
+    def test_claim_stores_the_new_session_key(self):
+        self.assertRedirects(self.log_in('alice'), '/dashboard/', fetch_redirect_response=False)
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        account = UserAccount.objects.get(user_id='alice')
+        self.assertEqual((account.current_session, account.session_key), (session_key, session_key))
+        self.assertEqual(self.client.get('/dashboard/').status_code, 200)
+
+    def test_login_over_another_users_session(self):
+        self.log_in('alice')
+        self.log_in('bob')
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertEqual(UserAccount.objects.get(user_id='bob').current_session, session_key)
+
+    def test_session_row_written_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.log_in('alice')
+        # INSERTed with the logged-in data, not created empty and UPDATEd
+        session_writes = [query['sql'] for query in queries
+                          if 'django_session' in query['sql'] and not query['sql'].startswith('SELECT')]
+        self.assertEqual(len(session_writes), 1, session_writes)
+        self.assertTrue(session_writes[0].startswith('INSERT'))
+
+    def test_failed_login_releases_the_claim(self):
+        self.client.raise_request_exception = True
+        with mock.patch('users.views.shadow_user', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError), self.assertLogs('django.request', 'ERROR'):
+                self.log_in('alice')
+        self.assertFalse(UserAccount.objects.get(user_id='alice').is_logged_in)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class UserAccountBackendTests(TestCase):
+    def setUp(self):
+        UserAccount.objects.create(user_id='alice', password=hash_password('secret'))
+        self.backend = UserAccountBackend()
+
+    def authenticate(self, password='secret', username='alice'):
+        return self.backend.authenticate(None, username=username, password=password)
+
+    def user_writes(self, call):
+        with CaptureQueriesContext(connection) as queries:
+            result = call()
+        table = User._meta.db_table
+        return result, [query['sql'] for query in queries
+                        if table in query['sql'] and not query['sql'].startswith('SELECT')]
+
+    def test_shadow_user_created_without_a_password(self):
+        user = self.authenticate()
+        self.assertEqual(user.username, 'alice')
+        self.assertFalse(user.has_usable_password())
+
+    def test_later_logins_do_not_write_the_user(self):
+        self.authenticate()
+        user, writes = self.user_writes(self.authenticate)
+        self.assertIsNotNone(user)
+        self.assertEqual(writes, [])
+
+    def test_shadow_user_out_of_sync_is_fixed(self):
+        User.objects.create_user('alice', password='old')
+        user, writes = self.user_writes(self.authenticate)
+        self.assertEqual(len(writes), 1)
+        self.assertFalse(User.objects.get(username='alice').has_usable_password())
+        self.assertIsNone(self.authenticate(password='old'))
+
+    def test_wrong_password_and_unknown_user(self):
+        self.assertIsNone(self.authenticate(password='wrong'))
+        self.assertIsNone(self.authenticate(username='nobody'))
+        self.assertFalse(User.objects.exists())
+
+    def test_staff_user_is_never_returned(self):
+        User.objects.create_superuser('alice', 'alice@example.com', 'admin-password')
+        self.assertIsNone(self.authenticate())
+        self.assertTrue(User.objects.get(username='alice').check_password('admin-password'))
+
+    def test_plaintext_password_upgraded(self):
+        UserAccount.objects.filter(user_id='alice').update(password='secret')
+        self.assertIsNotNone(self.authenticate())
+        self.assertTrue(is_hashed(UserAccount.objects.get(user_id='alice').password))
+
+    def test_async_login(self):
+        self.assertIsNotNone(async_to_sync(self.backend.aauthenticate)(None, username='alice', password='secret'))
+        self.assertIsNone(async_to_sync(self.backend.aauthenticate)(None, username='alice', password='wrong'))
+
+
+@override_settings(SESSION_REFRESH_THRESHOLD=3600)
+class SessionStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        session = SessionStore()
+        session['user_id'] = 'alice'
+        session.save()
+        self.key = session.session_key
+
+    def loaded(self):
+        session = SessionStore(self.key)
+        self.assertEqual(session['user_id'], 'alice')
+        return session
+
+    def test_unchanged_session_is_not_written(self):
+        session = self.loaded()
+        with self.assertNumQueries(0):
+            session.save()
+
+    def test_changed_session_is_written(self):
+        session = self.loaded()
+        session['user_status'] = True
+        with CaptureQueriesContext(connection) as queries:
+            session.save()
+        self.assertTrue(any(query['sql'].startswith('UPDATE') for query in queries))
+        self.assertTrue(SessionStore(self.key)['user_status'])
+
+    def test_expiry_refreshed_once_past_the_threshold(self):
+        session = self.loaded()
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            with CaptureQueriesContext(connection) as queries:
+                session.save()
+            self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+            with self.assertNumQueries(0):
+                session.save()
+        self.assertGreater(Session.objects.get(session_key=self.key).expire_date, later)
+
+    def test_per_process_cache_is_not_trusted(self):
+        session = self.loaded()
+        Session.objects.filter(session_key=self.key).delete()  # flushed by another worker
+        self.assertNotIn('user_id', SessionStore(self.key))
+        self.assertFalse(session.exists(self.key))
+
+
+class LocalLRUTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        lru = presence.LocalLRU(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+    def test_entries_expire(self):
+        lru = presence.LocalLRU(maxsize=2, ttl=-1)
+        lru.set('a', 1)
+        self.assertIsNone(lru.get('a'))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        presence._local.clear()
+        UserAccount.objects.create(user_id='alice', password=hash_password('secret'))
+
+    def test_lookups_hit_the_database_once(self):
+        with self.assertNumQueries(1):
+            for _ in range(3):
+                self.assertEqual(presence.get_presence('alice'), {'current_session': None, 'status': True})
+        with self.assertNumQueries(1):
+            presence.get_presence('nobody')
+            self.assertIs(presence.get_presence('nobody'), presence.ABSENT)
+
+    def test_shared_cache_serves_other_workers(self):
+        presence.get_presence('alice')
+        presence._local.clear()  # another worker's LRU
+        with self.assertNumQueries(0):
+            presence.get_presence('alice')
+
+    def test_login_writes_through_and_logout_invalidates(self):
+        session_state.claim_session('alice', password='secret', session_id='s1')
+        with self.assertNumQueries(0):
+            self.assertEqual(presence.get_presence('alice')['current_session'], 's1')
+        session_state.release_session('alice')
+        self.assertIsNone(presence.get_presence('alice')['current_session'])
+
+    def test_stale_mismatch_is_confirmed_before_logging_out(self):
+        self.client.post('/login/', {'username': 'alice', 'password': 'secret'})
+        presence.set_presence('alice', 'someone-else')  # stale in this worker
+        self.assertEqual(self.client.get('/dashboard/').status_code, 200)
+
+    def test_session_replaced_elsewhere_is_logged_out(self):
+        self.client.post('/login/', {'username': 'alice', 'password': 'secret'})
+        UserAccount.objects.filter(user_id='alice').update(current_session='newer')
+        presence.invalidate_presence('alice')
+        self.assertEqual(self.client.get('/dashboard/').status_code, 302)
+        # The newer session keeps the account
+        self.assertEqual(UserAccount.objects.get(user_id='alice').current_session, 'newer')
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class DashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        UserAccount.objects.bulk_create([UserAccount(user_id=f'u{n:02}', password='x', status=n % 4 != 0,
+                                                     is_logged_in=n % 3 == 0) for n in range(12)])
+        UserAccount.objects.create(user_id='operator', password=hash_password('secret'))
+        self.client.post('/login/', {'username': 'operator', 'password': 'secret'})
+
+    def page(self, **params):
+        context = self.client.get('/dashboard/', params).context
+        return [account.user_id for account in context['users']], context['prev_cursor'], context['next_cursor']
+
+    def test_keyset_pages(self):
+        first = self.page(q='u', size=5)
+        self.assertEqual(first, (['u00', 'u01', 'u02', 'u03', 'u04'], None, 'u04'))
+        self.assertEqual(self.page(q='u', size=5, after='u04'),
+                         (['u05', 'u06', 'u07', 'u08', 'u09'], 'u05', 'u09'))
+        self.assertEqual(self.page(q='u', size=5, after='u09'), (['u10', 'u11'], 'u10', None))
+        self.assertEqual(self.page(q='u', size=5, before='u05'), first)
+
+    def test_filters(self):
+        self.assertEqual(self.page(q='u', status='disabled')[0], ['u00', 'u04', 'u08'])
+        self.assertEqual(self.page(q='u', online='yes', status='enabled')[0], ['u03', 'u06', 'u09'])
+        self.assertEqual(self.page(q='u1')[0], ['u10', 'u11'])
+
+    @override_settings(DASHBOARD_MAX_PAGE_SIZE=3)
+    def test_page_size_is_capped(self):
+        self.assertEqual(len(self.page(q='u', size=1000)[0]), 3)
+        self.assertEqual(len(self.page(q='u', size='many')[0]), 12)
+
+    def test_only_rendered_columns_are_loaded(self):
+        account = self.client.get('/dashboard/', {'q': 'u'}).context['users'][0]
+        self.assertIn('password', account.get_deferred_fields())
+
+    def test_links_keep_filters(self):
+        response = self.client.get('/dashboard/', {'q': 'u', 'size': 5, 'status': 'enabled'})
+        self.assertContains(response, 'href="?q=u&amp;size=5&amp;status=enabled&after=u06"')
+
+
+@override_settings(DASHBOARD_LIVE={'COALESCE': 0, 'KEEPALIVE': 0.05})
+class DashboardEventsTests(TestCase):
+    def setUp(self):
+        for user_id in ('alice', 'bob', 'carol'):
+            UserAccount.objects.create(user_id=user_id, password='x')
+
+    def users(self, message):
+        event, data = message.strip().split('\n')
+        self.assertEqual(event, 'event: users')
+        return sorted(json.loads(data.removeprefix('data: ')), key=lambda row: row['user_id'])
+
+    async def test_stream_sends_changed_rows_only(self):
+        stream = events.stream(['alice', 'bob'])
+        self.assertEqual(await anext(stream), 'retry: 5000\n\n')
+        self.assertEqual([row['user_id'] for row in self.users(await anext(stream))], ['alice', 'bob'])
+
+        await UserAccount.objects.filter(user_id__in=['alice', 'carol']).aupdate(is_logged_in=True)
+        events.publish('alice', 'carol')
+        [row] = self.users(await anext(stream))
+        self.assertEqual((row['user_id'], row['is_logged_in']), ('alice', True))
+
+        # Nothing on screen changed: only a keepalive
+        events.publish('alice', 'carol')
+        self.assertEqual(await anext(stream), ': keepalive\n\n')
+
+        await UserAccount.objects.filter(user_id='bob').adelete()
+        events.publish('bob')
+        self.assertEqual(self.users(await anext(stream)), [{'user_id': 'bob', 'deleted': True}])
+        await stream.aclose()
+        self.assertFalse(events.hub._subscriptions)
+
+    async def events_response(self, factory, params=None):
+        request = factory.get('/dashboard/events/', params)
+        user, _ = await User.objects.aget_or_create(username='alice')
+
+        async def auser():
+            return user
+        request.auser = auser
+        return await dashboard_events(request)
+
+    async def test_view_needs_user_ids_and_asgi(self):
+        self.assertEqual((await self.events_response(AsyncRequestFactory())).status_code, 400)
+        response = await self.events_response(RequestFactory(), {'u': 'alice'})
+        self.assertEqual(response.status_code, 501)
+
+        response = await self.events_response(AsyncRequestFactory(), {'u': ['alice', 'bob']})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        await stream.aclose()
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class BulkActionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        UserAccount.objects.bulk_create([UserAccount(user_id=f'u{n}', password='x', is_logged_in=True,
+                                                     current_session=f's{n}') for n in range(5)])
+        UserAccount.objects.create(user_id='operator', password=hash_password('secret'))
+        self.client.post('/login/', {'username': 'operator', 'password': 'secret'})
+
+    def post(self, action, body):
+        return self.client.post(f'/bulk/{action}/', json.dumps(body), content_type='application/json')
+
+    def test_disable_listed_accounts(self):
+        response = self.post('disable', {'user_ids': ['u0', 'u1', 'missing']})
+        self.assertEqual(response.json(), {'status': 'success', 'action': 'disable', 'affected': 2})
+        self.assertEqual(set(UserAccount.objects.filter(status=False).values_list('user_id', flat=True)),
+                         {'u0', 'u1'})
+
+    def test_filter_selects_accounts(self):
+        UserAccount.objects.filter(user_id__startswith='u').update(status=False)
+        self.assertEqual(self.post('enable', {'filter': {'q': 'u', 'status': 'disabled'}}).json()['affected'], 5)
+
+    def test_force_logout_clears_the_session(self):
+        self.post('logout', {'user_ids': ['u2']})
+        account = UserAccount.objects.get(user_id='u2')
+        self.assertEqual((account.is_logged_in, account.current_session, account.session_key), (False, None, None))
+
+    def test_one_update_per_operation(self):
+        with self.assertNumQueries(2):  # the user_ids to invalidate, then the UPDATE
+            bulk.set_status(UserAccount.objects.filter(user_id__startswith='u'), False)
+
+    def test_delete_in_batches_with_sessions(self):
+        accounts = UserAccount.objects.filter(user_id__in=['u0', 'u1', 'u2'])
+        for account in accounts:
+            UserSession.objects.create(user_account=account, ip_address='10.0.0.1')
+        self.assertEqual(bulk.delete_accounts(accounts, batch_size=2), 3)
+        self.assertEqual(UserSession.objects.count(), 0)
+        self.assertEqual(UserAccount.objects.filter(user_id__startswith='u').count(), 2)
+
+    def test_form_post_redirects_with_count(self):
+        response = self.client.post('/bulk/enable/', {'user_ids': ['u3', 'u4']})
+        self.assertRedirects(response, '/dashboard/?msg=Enabled+2', fetch_redirect_response=False)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post('explode', {'user_ids': ['u0']}).status_code, 404)
+        self.assertEqual(self.post('disable', ['u0']).status_code, 400)
+        self.assertEqual(self.post('disable', {}).status_code, 400)
+        self.assertEqual(self.post('disable', {'user_ids': 'u0'}).status_code, 400)
+
+
+class BatchPresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for user_id in ('alice', 'bob'):
+            UserAccount.objects.create(user_id=user_id, password='x')
+        UserAccount.objects.create(user_id='carol', password='x', status=False)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('gateway', is_staff=True))
+
+    def post(self, body, content_type='application/json'):
+        return self.client.post('/api/users/presence/', body, content_type=content_type)
+
+    def results(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [item['result'] for item in response.json()['results']]
+
+    def logged_in(self):
+        return set(UserAccount.objects.filter(is_logged_in=True).values_list('user_id', flat=True))
+
+    def test_results_per_item(self):
+        body = json.dumps([{'user_id': 'alice', 'status': 'online'}, {'user_id': 'bob', 'status': 'online'},
+                           {'user_id': 'carol', 'status': 'online'}, {'user_id': 'nobody', 'status': 'online'},
+                           {'user_id': 'bob', 'status': 'away'}])
+        response = self.post(body)
+        self.assertEqual(self.results(response), ['ok', 'ok', 'disabled', 'not_found', 'invalid'])
+        self.assertEqual(response.json()['applied'], 2)
+        self.assertEqual(self.logged_in(), {'alice', 'bob'})
+
+    def test_last_update_per_user_wins(self):
+        body = json.dumps({'updates': [['alice', 'online'], ['alice', 'offline']]})
+        self.assertEqual(self.results(self.post(body)), ['superseded', 'ok'])
+        self.assertEqual(self.logged_in(), set())
+
+    def test_ndjson_body(self):
+        body = '["alice", "online"]\nnot json\n\n{"user_id": "bob", "status": "online"}\n'
+        self.assertEqual(self.results(self.post(body, 'application/x-ndjson')), ['ok', 'invalid', 'ok'])
+
+    def test_one_update_per_state(self):
+        updates = [['alice', 'online'], ['bob', 'offline']]
+        with CaptureQueriesContext(connection) as queries:
+            self.post(json.dumps(updates))
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 2)
+
+    def test_non_staff_only_updates_itself(self):
+        self.client.force_authenticate(User.objects.create_user('alice'))
+        body = json.dumps([['alice', 'online'], ['bob', 'online']])
+        self.assertEqual(self.results(self.post(body)), ['ok', 'forbidden'])
+        self.assertEqual(self.logged_in(), {'alice'})
+
+    @override_settings(PRESENCE_BATCH_MAX_ITEMS=1)
+    def test_too_many_items(self):
+        self.assertEqual(self.post(json.dumps([['alice', 'online'], ['bob', 'online']])).status_code, 413)
+
+    def test_bad_body(self):
+        self.assertEqual(self.post('{"updates": 1}').status_code, 400)
+        self.assertEqual(self.post('[').status_code, 400)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ImportUsersTests(TestCase):
+    def setUp(self):
+        UserAccount.objects.create(user_id='alice', password=hash_password('old'))
+
+    def write(self, suffix, text):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        call_command('import_users', path, *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_duplicates_in_file_and_table_are_skipped(self):
+        path = self.write('.csv', 'user_id,password,status\nalice,new,1\nbob,b1,1\nbob,b2,0\ncarol,c,no\n,x,1\n')
+        out = self.run_import(path, '--batch-size', '2')
+        self.assertIn('read=4 created=2 skipped_existing=2 invalid=1', out)
+        self.assertTrue(passwords.verify('old', UserAccount.objects.get(user_id='alice').password)[0])
+        bob = UserAccount.objects.get(user_id='bob')
+        self.assertTrue(is_hashed(bob.password))
+        self.assertTrue(passwords.verify('b1', bob.password)[0])
+        self.assertFalse(UserAccount.objects.get(user_id='carol').status)
+
+    def test_no_hash_keeps_plaintext(self):
+        path = self.write('.ndjson', '{"user_id": "bob", "password": "b1"}\n')
+        self.run_import(path, '--no-hash')
+        self.assertEqual(UserAccount.objects.get(user_id='bob').password, 'b1')
+
+    def test_line_that_is_not_an_object(self):
+        path = self.write('.ndjson', '{"user_id": "bob", "password": "b1"}\n["carol", "c"]\n')
+        with self.assertRaisesMessage(CommandError, 'Line 2 is not a JSON object'):
+            self.run_import(path)
+
+    def test_account_created_during_import_is_skipped(self):
+        path = self.write('.csv', 'user_id,password\nbob,b1\ncarol,c\n')
+        competitor = []
+
+        def hash_then_signup(password):
+            if not competitor:
+                # bob signs up between the dedupe SELECT and the INSERT
+                competitor.append(UserAccount.objects.create(user_id='bob', password='mine'))
+            return hash_password(password)
+        with mock.patch.object(import_users, 'hash_password', hash_then_signup):
+            out = self.run_import(path)
+        self.assertIn('created=1 skipped_existing=1', out)
+        self.assertEqual(UserAccount.objects.get(user_id='bob').password, 'mine')
+        self.assertTrue(UserAccount.objects.filter(user_id='carol').exists())
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class BatchLogoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for n in range(12):
+            UserAccount.objects.create(user_id=f'user{n}', password=hash_password('secret'), is_logged_in=True,
+                                       current_session=f'session{n}')
+
+    def logout(self, items):
+        return self.client.post('/api/logout/', json.dumps({'users': items}), content_type='application/json')
+
+    def test_client_batch_size_is_server_limit(self):
+        self.assertEqual(settings.LOGOUT_BATCH_MAX_ITEMS, LOGOUT_BATCH_SIZE)
+
+    def test_batch_at_limit(self):
+        response = self.logout([{'username': f'user{n}', 'password': 'secret'}
+                                for n in range(settings.LOGOUT_BATCH_MAX_ITEMS)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['logged_out'], settings.LOGOUT_BATCH_MAX_ITEMS)
+
+    def test_batch_over_limit_refused_untouched(self):
+        response = self.logout([{'username': f'user{n}', 'password': 'secret'}
+                                for n in range(settings.LOGOUT_BATCH_MAX_ITEMS + 1)])
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(UserAccount.objects.filter(is_logged_in=True).count(), 12)
+
+    @override_settings(LOGOUT_BATCH_MAX_ITEMS=2)
+    def test_limit_from_settings(self):
+        items = [{'username': f'user{n}', 'password': 'secret'} for n in range(3)]
+        self.assertEqual(self.logout(items).status_code, 413)
+        self.assertEqual(self.logout(items[:2]).status_code, 200)
+
+    def test_result_per_item(self):
+        response = self.logout([
+            {'username': 'user0', 'password': 'secret'},
+            {'username': 'user1', 'password': 'wrong'},
+            {'username': 'nobody', 'password': 'secret'},
+            {'username': 'user2'},
+            'user3',
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['logged_out'], 1)
+        self.assertEqual(response.json()['results'], [
+            {'username': 'user0', 'result': session_state.OK},
+            {'username': 'user1', 'result': session_state.INVALID_PASSWORD},
+            {'username': 'nobody', 'result': session_state.NOT_FOUND},
+            {'username': 'user2', 'result': 'invalid'},
+            {'username': None, 'result': 'invalid'},
+        ])
+        logged_in = set(UserAccount.objects.filter(is_logged_in=True).values_list('user_id', flat=True))
+        self.assertNotIn('user0', logged_in)
+        self.assertIn('user1', logged_in)
+
+    def test_body_that_is_not_an_object(self):
+        response = self.client.post('/api/logout/', '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class PanelClientBatchTests(SimpleTestCase):
+    def client_answering(self, *statuses):
+        panel = PanelClient('http://panel.invalid', retry=RetryPolicy(backoff=0))
+        body = json.dumps({'status': 'success', 'results': []}).encode()
+        panel._pool = mock.Mock()
+        panel._pool.request.side_effect = [Response(status, {}, body) for status in statuses]
+        return panel
+
+    def test_logout_many_splits_into_server_sized_batches(self):
+        panel = self.client_answering(200, 200)
+        panel.logout_many({f'user{n}': 'secret' for n in range(LOGOUT_BATCH_SIZE + 1)})
+        sizes = [len(json.loads(call.args[2])['users']) for call in panel._pool.request.call_args_list]
+        self.assertEqual(sizes, [LOGOUT_BATCH_SIZE, 1])
+
+    def test_batch_not_resent_after_gateway_error(self):
+        # The panel may still be checking the first attempt's passwords
+        panel = self.client_answering(503, 200)
+        with self.assertRaises(PanelError):
+            panel.logout_many({'user0': 'secret'})
+        self.assertEqual(panel._pool.request.call_count, 1)
+
+    def test_single_logout_still_retried(self):
+        panel = self.client_answering(503, 503, 503)
+        with self.assertRaises(PanelUnavailable):
+            panel.logout('user0', 'secret')
+        self.assertEqual(panel._pool.request.call_count, 3)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, LOGIN_THROTTLE={'ENDPOINTS': {
+    '/api/logout/': {'methods': ('GET', 'POST'), 'ip': '5/m', 'user': '2/m', 'json': True},
+}})
+class LogoutThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for n in range(6):
+            UserAccount.objects.create(user_id=f'user{n}', password=hash_password('secret'))
+
+    def logout(self, *usernames):
+        body = {'users': [{'username': name, 'password': 'wrong'} for name in usernames]}
+        return self.client.post('/api/logout/', json.dumps(body), content_type='application/json')
+
+    def test_batch_takes_an_ip_token_per_item(self):
+        self.assertEqual(self.logout('user0', 'user1', 'user2', 'user3', 'user4', 'user5').status_code, 429)
+        self.assertEqual(self.logout('user0', 'user1', 'user2', 'user3', 'user4').status_code, 200)
+        self.assertEqual(self.logout('user5').status_code, 429)
+
+    def test_repeated_username_takes_a_user_token_per_item(self):
+        self.assertEqual(self.logout('user0', 'user0', 'user0').status_code, 429)
+        self.assertEqual(self.logout('user0', 'user0').status_code, 200)
+        self.assertEqual(self.logout('user0').status_code, 429)
+
+    def test_credentialed_get_is_throttled(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/logout/', {'username': 'user0', 'password': 'wrong'}).status_code,
+                             401)
+        response = self.client.get('/api/logout/', {'username': 'user0', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, LOGIN_THROTTLE={'ENDPOINTS': {
+    '/api/logout/': {'methods': ('GET', 'POST'), 'ip': '2/m', 'user': None, 'json': True},
+}})
+class ThrottleBehindProxyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def request(self, **meta):
+        return RequestFactory().get('/', **meta)
+
+    def logout(self, **meta):
+        return self.client.get('/api/logout/', {'username': 'nobody', 'password': 'x'}, **meta).status_code
+
+    def test_client_ip_from_trusted_proxy(self):
+        self.assertEqual(throttle.client_ip(self.request(REMOTE_ADDR='127.0.0.1', HTTP_X_REAL_IP='203.0.113.5')),
+                         '203.0.113.5')
+        # nginx appends the address it saw: the last hop, not the client-supplied first one
+        self.assertEqual(throttle.client_ip(self.request(REMOTE_ADDR='127.0.0.1',
+                                                         HTTP_X_FORWARDED_FOR='10.9.9.9, 203.0.113.5')),
+                         '203.0.113.5')
+
+    def test_headers_ignored_from_other_addresses(self):
+        request = self.request(REMOTE_ADDR='198.51.100.7', HTTP_X_REAL_IP='203.0.113.5',
+                               HTTP_X_FORWARDED_FOR='203.0.113.5')
+        self.assertEqual(throttle.client_ip(request), '198.51.100.7')
+
+    def test_each_client_behind_the_proxy_has_its_own_bucket(self):
+        behind_proxy = {'REMOTE_ADDR': '127.0.0.1'}
+        for _ in range(2):
+            self.assertEqual(self.logout(HTTP_X_REAL_IP='203.0.113.5', **behind_proxy), 404)
+        self.assertEqual(self.logout(HTTP_X_REAL_IP='203.0.113.5', **behind_proxy), 429)
+        self.assertEqual(self.logout(HTTP_X_REAL_IP='203.0.113.6', **behind_proxy), 404)
+
+    def test_spoofed_header_does_not_escape_the_bucket(self):
+        for forwarded in ('203.0.113.1', '203.0.113.2'):
+            self.assertEqual(self.logout(REMOTE_ADDR='198.51.100.7', HTTP_X_FORWARDED_FOR=forwarded), 404)
+        self.assertEqual(self.logout(REMOTE_ADDR='198.51.100.7', HTTP_X_FORWARDED_FOR='203.0.113.3'), 429)
+
+
+class ThrottleConcurrencyTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches['default']
+        self.cache.clear()
+        self.throttle = throttle.Throttle({'/login/': {'ip': '5/m', 'user': None}}, self.cache, 'test:')
+        _, self.buckets, _ = self.throttle.endpoints['/login/']
+
+    def test_concurrent_checks_never_exceed_the_limit(self):
+        start = threading.Barrier(20)
+
+        def attempt(_):
+            start.wait()
+            return self.throttle.check(self.buckets, {'ip': '203.0.113.5'}, now=1000.0)
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            results = list(pool.map(attempt, range(20)))
+        self.assertEqual(results.count(None), 5)
+
+    def test_check_that_read_before_a_competitor_took_is_refused(self):
+        for _ in range(4):
+            self.assertIsNone(self.throttle.check(self.buckets, {'ip': 'a'}, now=1000.0))
+        # Another worker takes the last token between this check's read and its take
+        get_many = self.cache.get_many
+
+        def competing_get_many(keys):
+            counts = get_many(keys)
+            with mock.patch.object(self.cache, 'get_many', get_many):
+                self.assertIsNone(self.throttle.check(self.buckets, {'ip': 'a'}, now=1000.0))
+            return counts
+        with mock.patch.object(self.cache, 'get_many', competing_get_many):
+            self.assertIsNotNone(self.throttle.check(self.buckets, {'ip': 'a'}, now=1000.0))
+        # The refused check gave its token back
+        self.assertIsNotNone(self.throttle.check(self.buckets, {'ip': 'a'}, now=1000.0))
+        self.assertEqual(self.cache.get('test:/login/:ip:a:16'), 5)
@@ -0,0 +1,320 @@
+"""
+Rate limits for the endpoints that check a password
+
+Every login and credentialed logout costs a database lookup and a password
+hash comparison, so a credential-stuffing burst can tie up every worker
+and the database. LoginThrottleMiddleware sits in front of the session and
+auth middleware and gives each caller IP and each username its own bucket
+per endpoint. A request that finds an empty bucket is answered with a 429
+before a session is loaded or a query is run.
+
+Each bucket holds `limit` tokens and refills over `period` seconds. It is
+stored in Django's cache as two per-period counters (the current one and
+the previous one, weighted by how much of it is still inside the sliding
+period): the cache API offers atomic add/incr but no compare-and-set, and
+counters need nothing else. A check takes its tokens first (an add or incr
+per bucket) and decides on the counts those return, so concurrent requests
+each see the others' tokens and no more than the limit get through; a
+refused request gives its tokens back with a decr. The previous counters
+no longer change and cost one get_many. Point CACHES at a shared backend
+(memcached, redis) so all workers draw from the same buckets.
+
+A batch logout ({"users": [...]}) checks a password per item, so it takes
+one IP token per item and one token from each username's bucket.
+
+Behind nginx every request comes from 127.0.0.1, so one bucket would cover
+every caller. Requests from TRUSTED_PROXIES are keyed by the address the
+proxy reports instead: X-Real-IP, else the last hop of X-Forwarded-For
+(the one nginx appended). From anyone else those headers are ignored.
+"""
+import json
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'KEY_PREFIX': 'throttle:',
+    # REMOTE_ADDRs of reverse proxies whose X-Real-IP / X-Forwarded-For are believed
+    'TRUSTED_PROXIES': ('127.0.0.1', '::1'),
+    # META key holding the client address, read from every request; overrides
+    # the proxy headers when set (only for setups that strip it upstream)
+    'IP_HEADER': None,
+    # Usernames are only read from bodies up to this size
+    'MAX_BODY': 16384,
+    # path -> methods, 'ip' and 'user' rates ('limit/period', period s/m/h/d or
+    # seconds; None disables that bucket), and whether to answer 429s in JSON
+    'ENDPOINTS': {
+        '/login/': {'methods': ('POST',), 'ip': '30/m', 'user': '10/m', 'json': False},
+        '/app/': {'methods': ('POST',), 'ip': '30/m', 'user': '10/m', 'json': False},
+        '/app/login/': {'methods': ('POST',), 'ip': '30/m', 'user': '10/m', 'json': False},
+        '/app/api/login/': {'methods': ('POST',), 'ip': '60/m', 'user': '10/m', 'json': True},
+        '/api/token/': {'methods': ('POST',), 'ip': '60/m', 'user': '10/m', 'json': True},
+        '/api/logout/': {'methods': ('GET', 'POST'), 'ip': '60/m', 'user': '10/m', 'json': True},
+    },
+}
+
+
+def setting(name):
+    return getattr(settings, 'LOGIN_THROTTLE', {}).get(name, DEFAULTS[name])
+
+
+def parse_rate(rate):
+    """'10/m' -> (10, 60); '5/30' -> (5, 30); None -> None"""
+    if not rate:
+        return None
+    limit, period = rate.split('/')
+    period = PERIODS[period[0]] if period[0] in PERIODS else int(period)
+    return int(limit), period
+
+
+class Bucket:
+    """One endpoint's limit for one kind of key (ip or user)"""
+
+    def __init__(self, name, limit, period):
+        self.name = name
+        self.limit = limit
+        self.period = period
+
+    def keys(self, prefix, ident, now):
+        window = int(now // self.period)
+        base = f'{prefix}{self.name}:{ident}:'
+        return base + str(window), base + str(window - 1), (now % self.period) / self.period
+
+    def level(self, counts, keys):
+        """Tokens used over the sliding period ending now"""
+        current, previous, elapsed = keys
+        return counts.get(current, 0) + counts.get(previous, 0) * (1.0 - elapsed)
+
+    def retry_after(self, counts, keys):
+        # Seconds until enough of the previous window has slid out, or until
+        # the current window ends; never less than one
+        current, previous, elapsed = keys
+        used_previous = counts.get(previous, 0)
+        spare = self.limit - counts.get(current, 0)
+        if used_previous and spare > 0:
+            fraction = 1.0 - spare / used_previous
+            return max(1, int((fraction - elapsed) * self.period) + 1)
+        return max(1, int((1.0 - elapsed) * self.period) + 1)
+
+
+class Throttle:
+    """Buckets for every configured endpoint, checked against one cache"""
+
+    def __init__(self, endpoints, cache, prefix):
+        self.cache = cache
+        self.prefix = prefix
+        self.endpoints = {}
+        for path, conf in endpoints.items():
+            buckets = {}
+            for kind in ('ip', 'user'):
+                rate = parse_rate(conf.get(kind))
+                if rate:
+                    buckets[kind] = Bucket(f'{path}:{kind}', *rate)
+            methods = frozenset(method.upper() for method in conf.get('methods', ('POST',)))
+            self.endpoints[path] = (methods, buckets, conf.get('json', True))
+
+    def match(self, request):
+        endpoint = self.endpoints.get(request.path_info)
+        if endpoint is None or request.method not in endpoint[0]:
+            return None
+        return endpoint
+
+    def _plan(self, buckets, idents, now):
+        # An ident is one key (one token) or {key: tokens}
+        plan = []
+        for kind, bucket in buckets.items():
+            value = idents.get(kind)
+            for ident, cost in (value.items() if isinstance(value, dict) else [(value, 1)]):
+                if ident:
+                    plan.append((bucket, bucket.keys(self.prefix, ident, now), cost))
+        return plan
+
+    @staticmethod
+    def _refused(plan, counts):
+        """counts include this request's tokens"""
+        for bucket, keys, cost in plan:
+            if bucket.level(counts, keys) > bucket.limit:
+                # Due once there is room for this request, which gives its tokens back
+                before = dict(counts, **{keys[0]: counts[keys[0]] - cost})
+                return bucket.retry_after(before, keys)
+        return None
+
+    @staticmethod
+    def _previous(plan):
+        return [keys[1] for _, keys, _ in plan]
+
+    def _take(self, bucket, key, cost):
+        """Add cost tokens to key; returns its count including them"""
+        # Counters outlive their window by one period so they can be weighted
+        # as the previous one; add() loses to a concurrent add, incr() to expiry
+        if self.cache.add(key, cost, bucket.period * 2):
+            return cost
+        try:
+            return self.cache.incr(key, cost)
+        except ValueError:
+            self.cache.add(key, cost, bucket.period * 2)
+            return cost
+
+    async def _atake(self, bucket, key, cost):
+        if await self.cache.aadd(key, cost, bucket.period * 2):
+            return cost
+        try:
+            return await self.cache.aincr(key, cost)
+        except ValueError:
+            await self.cache.aadd(key, cost, bucket.period * 2)
+            return cost
+
+    def _give_back(self, key, cost):
+        try:
+            self.cache.decr(key, cost)
+        except ValueError:
+            pass  # expired meanwhile
+
+    async def _agive_back(self, key, cost):
+        try:
+            await self.cache.adecr(key, cost)
+        except ValueError:
+            pass
+
+    def check(self, buckets, idents, now=None):
+        """None if allowed (and counted), else seconds until a retry may pass"""
+        plan = self._plan(buckets, idents, time.time() if now is None else now)
+        if not plan:
+            return None
+        counts = self.cache.get_many(self._previous(plan))
+        for bucket, keys, cost in plan:
+            counts[keys[0]] = self._take(bucket, keys[0], cost)
+        retry_after = self._refused(plan, counts)
+        if retry_after is not None:
+            for _, keys, cost in plan:
+                self._give_back(keys[0], cost)
+        return retry_after
+
+    async def acheck(self, buckets, idents, now=None):
+        plan = self._plan(buckets, idents, time.time() if now is None else now)
+        if not plan:
+            return None
+        counts = await self.cache.aget_many(self._previous(plan))
+        for bucket, keys, cost in plan:
+            counts[keys[0]] = await self._atake(bucket, keys[0], cost)
+        retry_after = self._refused(plan, counts)
+        if retry_after is not None:
+            for _, keys, cost in plan:
+                await self._agive_back(keys[0], cost)
+        return retry_after
+
+
+def client_ip(request):
+    """The caller's address, as reported by a trusted proxy when there is one"""
+    meta = request.META
+    remote = (meta.get('REMOTE_ADDR') or '').strip()
+    header = setting('IP_HEADER')
+    if header:
+        return (meta.get(header) or remote).split(',')[0].strip()
+    if remote in setting('TRUSTED_PROXIES'):
+        real_ip = (meta.get('HTTP_X_REAL_IP') or '').strip()
+        if real_ip:
+            return real_ip
+        forwarded = [hop.strip() for hop in (meta.get('HTTP_X_FORWARDED_FOR') or '').split(',') if hop.strip()]
+        if forwarded:
+            return forwarded[-1]
+    return remote
+
+
+def _name(value):
+    return value.strip() if isinstance(value, str) else None
+
+
+def usernames(request):
+    """
+    The usernames a request is trying, without touching the session or DB:
+    one per item of a batch logout, else at most one. Batch items without
+    a username still count (as None).
+    """
+    if request.method == 'GET':
+        return [_name(request.GET.get('username'))]
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return [None]
+    if not length or length > setting('MAX_BODY'):
+        return [None]
+    content_type = request.content_type
+    if content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return [None]
+        if not isinstance(data, dict):
+            return [None]
+        if isinstance(data.get('users'), list):
+            return [_name(item.get('username')) if isinstance(item, dict) else None
+                    for item in data['users']] or [None]
+        return [_name(data.get('username'))]
+    if content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        return [_name(request.POST.get('username'))]
+    return [None]
+
+
+def idents(request):
+    """Bucket keys and tokens for a request: a token per username tried"""
+    names = usernames(request)
+    return {'ip': {client_ip(request): len(names)}, 'user': Counter(name for name in names if name)}
+
+
+def too_many(as_json, retry_after):
+    message = f'Too many login attempts. Try again in {retry_after} seconds.'
+    if as_json:
+        # Carries the fields of both API contracts (users and main_app)
+        response = JsonResponse({
+            'success': False,
+            'status': 'error',
+            'error': message,
+            'message': message,
+            'code': 'RATE_LIMITED',
+        }, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+class LoginThrottleMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = setting('ENABLED')
+        self.throttle = Throttle(setting('ENDPOINTS'), caches[setting('CACHE')], setting('KEY_PREFIX'))
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        endpoint = self.throttle.match(request) if self.enabled else None
+        if endpoint is not None:
+            _, buckets, as_json = endpoint
+            retry_after = self.throttle.check(buckets, idents(request))
+            if retry_after is not None:
+                return too_many(as_json, retry_after)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        endpoint = self.throttle.match(request) if self.enabled else None
+        if endpoint is not None:
+            _, buckets, as_json = endpoint
+            retry_after = await self.throttle.acheck(buckets, idents(request))
+            if retry_after is not None:
+                return too_many(as_json, retry_after)
+        return await self.get_response(request)
@@ -9,15 +9,19 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/events/', views.dashboard_events, name='dashboard_events'),
     path('create/', views.create_user, name='create_user'),
     path('enable/<str:user_id>/', views.enable_user, name='enable_user'),
     path('disable/<str:user_id>/', views.disable_user, name='disable_user'),
     path('delete/<str:user_id>/', views.delete_user, name='delete_user'),
+    path('bulk/<str:action>/', views.bulk_action, name='bulk_action'),
     # API endpoint for AI Mailer Pro automatic logout
     path('api/logout/', views.api_logout_user, name='api_logout'),
     # JWT + API endpoints
     path('api/token/', SingleSessionTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/me/', views.api_me, name='api_me'),
+    path('api/heartbeat/', views.api_heartbeat, name='api_heartbeat'),
+    path('api/users/presence/', views.api_batch_presence, name='api_batch_presence'),
     path('api/users/<int:user_id>/presence/', views.api_user_presence, name='api_user_presence'),
 ]
@@ -2,115 +2,179 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.utils import timezone
-from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
+import logging
+from internet_art_tools.replicas import read_only
 from .models import UserAccount
+from .presence import invalidate_presence
+from .backends import shadow_user
+from .passwords import hash_password
+from . import events, heartbeat, session_state, throttle
+from . import bulk
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
 
 def login_view(request):
     if request.method == 'POST':
         username = request.POST.get('username')
         password = request.POST.get('password')
         
-        print(f"DEBUG: Login attempt for username: {username}")
+        logger.debug("Login attempt for username: %s", username)
         
-        try:
-            # Check if user exists in UserAccount model
-            user_account = UserAccount.objects.get(user_id=username)
-            print(f"DEBUG: User account found: {user_account.user_id}")
-            
-            # Check if user is active
-            if not user_account.status:
-                print("DEBUG: User account is disabled")
-                messages.error(request, 'Account is disabled. Please contact administrator.')
-                return redirect('login')
-            
-            # Check if user is already logged in (single session enforcement)
-            if user_account.is_logged_in and user_account.current_session:
-                print("DEBUG: User already logged in from another session")
-                messages.error(request, 'User is already logged in from another session. Please logout first.')
-                return redirect('login')
-            
-            # Check password (simple comparison for demo)
-            if user_account.password == password:
-                print("DEBUG: Password matches")
-                
-                # Create or get Django User for session management
-                django_user, created = User.objects.get_or_create(
-                    username=username,
-                    defaults={'email': f'{username}@example.com'}
-                )
-                print(f"DEBUG: Django user created: {created}, username: {django_user.username}")
-                
-                # Always set password for Django user to match UserAccount
-                django_user.set_password(password)
-                django_user.save()
-                print("DEBUG: Django user password set")
-                
-                # Login the Django user for session management
-                login(request, django_user)
-                print(f"DEBUG: Django login called, user authenticated: {request.user.is_authenticated}")
-                
-                # Update UserAccount with login info and session tracking
-                user_account.is_logged_in = True
-                user_account.last_login = timezone.now()
-                
-                # Get real IP from Nginx headers
-                x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-                if x_forwarded_for:
-                    user_account.device_ip = x_forwarded_for.split(',')[0]
-                else:
-                    user_account.device_ip = request.META.get('REMOTE_ADDR')
-                
-                user_account.current_session = request.session.session_key
-                user_account.session_key = request.session.session_key
-                user_account.save()
-                print(f"DEBUG: UserAccount updated, session key: {request.session.session_key}")
-                
-                # Debug: Check if user is authenticated after login
-                if request.user.is_authenticated:
-                    print("DEBUG: User is authenticated, redirecting to dashboard")
-                    return redirect('dashboard')
-                else:
-                    print("DEBUG: User not authenticated after login")
-                    messages.error(request, 'Authentication failed. Please try again.')
-                    return redirect('login')
-            else:
-                print("DEBUG: Password does not match")
-                messages.error(request, 'Invalid username or password')
-                return redirect('login')
-                
-        except UserAccount.DoesNotExist:
-            print(f"DEBUG: User account not found: {username}")
+        # Real IP from the Nginx headers (only believed from the proxy)
+        device_ip = throttle.client_ip(request)
+
+        # Verify the password hash and claim the account in one conditional
+        # UPDATE (status and single session enforcement are checked by the
+        # database). It stores the session key login() is about to switch to.
+        session_key = request.session.reserve_key()
+        claim = session_state.claim_session(username, password=password, session_id=session_key,
+                                            device_ip=device_ip)
+        logger.debug("Claim outcome for %s: %s", username, claim.outcome)
+
+        if claim.outcome == session_state.DISABLED:
+            messages.error(request, 'Account is disabled. Please contact administrator.')
+            return redirect('login')
+        if claim.outcome == session_state.ALREADY_LOGGED_IN:
+            messages.error(request, 'User is already logged in from another session. Please logout first.')
+            return redirect('login')
+        if claim.outcome != session_state.OK:
             messages.error(request, 'Invalid username or password')
             return redirect('login')
+
+        try:
+            # Shadow Django user for session management; the claim already
+            # checked the UserAccount password, so nothing is hashed again here
+            django_user = shadow_user(username)
+            logger.debug("Django user for session: %s", django_user.username)
+
+            # Login the Django user for session management
+            login(request, django_user, backend='users.backends.UserAccountBackend')
+        except Exception:
+            # Don't leave the account held by a session that never started
+            session_state.release_session(username)
+            raise
+
+        # Debug: Check if user is authenticated after login
+        if not request.user.is_authenticated:
+            logger.warning("User not authenticated after login: %s", username)
+            session_state.release_session(username)
+            messages.error(request, 'Authentication failed. Please try again.')
+            return redirect('login')
+
+        logger.info("Panel login: %s", username)
+        return redirect('dashboard')
             
     return render(request, 'users/login.html')
 
+# Columns rendered by users/dashboard.html; nothing else is loaded
+DASHBOARD_COLUMNS = ('user_id', 'status', 'is_logged_in', 'device_ip', 'last_login')
+
+def _dashboard_queryset(params):
+    """Apply the dashboard filters (status, online, q=user_id prefix)"""
+    qs = UserAccount.objects.only(*DASHBOARD_COLUMNS)
+    status_value = params.get('status')
+    if status_value in ('enabled', 'disabled'):
+        qs = qs.filter(status=(status_value == 'enabled'))
+    online = params.get('online')
+    if online in ('yes', 'no'):
+        qs = qs.filter(is_logged_in=(online == 'yes'))
+    prefix = (params.get('q') or '').strip()
+    if prefix:
+        qs = qs.filter(user_id__startswith=prefix)
+    return qs
+
+def _dashboard_page(qs, after=None, before=None, size=50):
+    """
+    Keyset pagination on user_id: fetch size+1 rows past the cursor so the
+    cost is one indexed range scan no matter how many accounts exist.
+    Returns (rows, has_prev, has_next).
+    """
+    if before:
+        rows = list(qs.filter(user_id__lt=before).order_by('-user_id')[:size + 1])
+        has_prev = len(rows) > size
+        rows = rows[:size]
+        rows.reverse()
+        return rows, has_prev, True
+
+    if after:
+        qs = qs.filter(user_id__gt=after)
+    rows = list(qs.order_by('user_id')[:size + 1])
+    has_next = len(rows) > size
+    return rows[:size], bool(after), has_next
+
 @login_required
 def dashboard(request):
-    users = UserAccount.objects.all().order_by('user_id')
+    default_size = getattr(settings, 'DASHBOARD_PAGE_SIZE', 50)
+    max_size = getattr(settings, 'DASHBOARD_MAX_PAGE_SIZE', 500)
+    try:
+        size = min(max(int(request.GET.get('size', default_size)), 1), max_size)
+    except ValueError:
+        size = default_size
+
+    qs = _dashboard_queryset(request.GET)
+    users, has_prev, has_next = _dashboard_page(
+        qs,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        size=size,
+    )
+
+    # Query string that keeps the current filters on the pager links
+    filters = request.GET.copy()
+    for key in ('after', 'before', 'msg'):
+        filters.pop(key, None)
+
     msg = request.GET.get('msg')
-    return render(request, 'users/dashboard.html', {'users': users, 'msg': msg})
+    return render(request, 'users/dashboard.html', {
+        'users': users,
+        'msg': msg,
+        'filters': request.GET,
+        'filter_query': filters.urlencode(),
+        'prev_cursor': users[0].user_id if users and has_prev else None,
+        'next_cursor': users[-1].user_id if users and has_next else None,
+    })
+
+# login_required wraps coroutine views natively from Django 5.1 (requirements.txt)
+@login_required
+async def dashboard_events(request):
+    """
+    Server-sent events with changes to the dashboard rows on screen
+    GET /dashboard/events/?u=<user_id>&u=<user_id>... (see users/events.py)
+    Only served under ASGI; a WSGI worker would be tied up for the whole stream.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'status': 'error', 'message': 'Live updates need the ASGI server'}, status=501)
+
+    user_ids = request.GET.getlist('u')
+    if not user_ids:
+        return JsonResponse({'status': 'error', 'message': 'u (user_id) required'}, status=400)
+    max_users = events.setting('MAX_USERS')
+    if len(user_ids) > max_users:
+        return JsonResponse({'status': 'error', 'message': f'At most {max_users} users per stream'}, status=400)
+
+    response = StreamingHttpResponse(events.stream(user_ids), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop Nginx from buffering the stream
+    return response
 
 @login_required
 def logout_view(request):
     # Update UserAccount logout info
     try:
         current_user = request.user.username
-        user_account = UserAccount.objects.get(user_id=current_user)
-        user_account.is_logged_in = False
-        user_account.current_session = None
-        user_account.session_key = None
-        user_account.save()
-        print(f"DEBUG: Logout - cleared session for user: {current_user}")
-    except Exception as e:
-        print(f"DEBUG: Logout error: {e}")
+        session_state.release_session(current_user)
+        logger.debug("Logout - cleared session for user: %s", current_user)
+    except Exception:
+        logger.exception("Logout failed")
     
     logout(request)
     return redirect('login')
@@ -125,7 +189,7 @@ def create_user(request):
             if UserAccount.objects.filter(user_id=uid).exists():
                 return redirect('/dashboard/?msg=User+already+exists')
             
-            UserAccount.objects.create(user_id=uid, password=pwd, status=True)
+            UserAccount.objects.create(user_id=uid, password=hash_password(pwd), status=True)
             return redirect('/dashboard/?msg=User+created')
     return redirect('/dashboard/?msg=Missing+fields')
 
@@ -134,6 +198,7 @@ def enable_user(request, user_id):
     u = get_object_or_404(UserAccount, user_id=user_id)
     u.status = True
     u.save()
+    invalidate_presence(u.user_id)
     return redirect('/dashboard/?msg=Enabled')
 
 @login_required
@@ -141,14 +206,67 @@ def disable_user(request, user_id):
     u = get_object_or_404(UserAccount, user_id=user_id)
     u.status = False
     u.save()
+    invalidate_presence(u.user_id)
     return redirect('/dashboard/?msg=Disabled')
 
 @login_required
 def delete_user(request, user_id):
     u = get_object_or_404(UserAccount, user_id=user_id)
     u.delete()
+    invalidate_presence(user_id)
     return redirect('/dashboard/?msg=Deleted')
 
+BULK_ACTIONS = {
+    'enable': ('Enabled', lambda qs: bulk.set_status(qs, True)),
+    'disable': ('Disabled', lambda qs: bulk.set_status(qs, False)),
+    'logout': ('Logged out', bulk.force_logout),
+    'delete': ('Deleted', bulk.delete_accounts),
+}
+
+@login_required
+@require_http_methods(["POST"])
+def bulk_action(request, action):
+    """
+    Apply enable/disable/logout/delete to many accounts at once
+    Form POST: user_ids=<id>&user_ids=<id>... (redirects to the dashboard)
+    JSON POST: {"user_ids": [...]} or {"filter": {"status": "enabled", "online": "yes", "q": "prefix"}}
+    """
+    if action not in BULK_ACTIONS:
+        return JsonResponse({'status': 'error', 'message': f'Unknown action: {action}'}, status=404)
+    label, apply = BULK_ACTIONS[action]
+
+    is_json = request.content_type == 'application/json'
+    if is_json:
+        try:
+            data = json.loads(request.body or '{}')
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+        user_ids = data.get('user_ids') or []
+        filters = data.get('filter') or {}
+        if not isinstance(user_ids, list) or not isinstance(filters, dict):
+            return JsonResponse({'status': 'error', 'message': 'user_ids must be a list and filter an object'},
+                                status=400)
+    else:
+        user_ids = request.POST.getlist('user_ids')
+        filters = {}
+
+    if user_ids:
+        qs = UserAccount.objects.filter(user_id__in=user_ids)
+    elif any(filters.get(key) for key in ('status', 'online', 'q')):
+        qs = _dashboard_queryset(filters)
+    else:
+        if not is_json:
+            return redirect('/dashboard/?msg=No+users+selected')
+        return JsonResponse({'status': 'error', 'message': 'user_ids or filter required'}, status=400)
+
+    affected = apply(qs)
+
+    if is_json:
+        return JsonResponse({'status': 'success', 'action': action, 'affected': affected})
+    return redirect('/dashboard/?' + urlencode({'msg': f'{label} {affected}'}))
+
 # API endpoint for AI Mailer Pro or JWT clients to logout users
 @api_view(['GET', 'POST'])
 @permission_classes([AllowAny])
@@ -158,18 +276,14 @@ def api_logout_user(request):
     GET /api/logout/?username=user_id&password=password
     POST /api/logout/
     Body: {"username": "user_id", "password": "password"}
+    Batch: {"users": [{"username": ..., "password": ...}, ...]} -> one result per item
     """
     try:
         # If JWT/Session auth present, prefer it
         if getattr(request, 'user', None) and request.user.is_authenticated:
             username = request.user.username
-            print(f"DEBUG: API Logout via token for user: {username}")
-            ua = UserAccount.objects.filter(user_id=username).first()
-            if ua:
-                ua.is_logged_in = False
-                ua.current_session = None
-                ua.session_key = None
-                ua.save()
+            logger.debug("API logout via token for user: %s", username)
+            session_state.release_session(username)
             return JsonResponse({'status': 'success', 'message': f'User {username} logged out successfully'})
 
         # Fallback to explicit credentials (GET query or POST JSON)
@@ -177,39 +291,65 @@ def api_logout_user(request):
             username = request.GET.get('username')
             password = request.GET.get('password')
         else:
+            # Bigger bodies would pass the login throttle uninspected
+            if len(request.body) > throttle.setting('MAX_BODY'):
+                return JsonResponse({'status': 'error', 'message': 'Request body too large'}, status=413)
             data = json.loads(request.body or '{}')
+            if not isinstance(data, dict):
+                return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+            if isinstance(data.get('users'), list):
+                return _logout_batch(data['users'])
             username = data.get('username')
             password = data.get('password')
 
-        print(f"DEBUG: API Logout via credentials for user: {username}")
+        logger.debug("API logout via credentials for user: %s", username)
 
         if not username or not password:
             return JsonResponse({'status': 'error', 'message': 'username and password required'}, status=400)
 
-        try:
-            user_account = UserAccount.objects.get(user_id=username)
-            if user_account.password != password:
-                return JsonResponse({'status': 'error', 'message': 'Invalid password'}, status=401)
-
-            user_account.is_logged_in = False
-            user_account.current_session = None
-            user_account.session_key = None
-            user_account.save()
-
+        # One SELECT for the hash, one UPDATE that requires it unchanged;
+        # only a refusal needs another lookup to say why
+        if session_state.release_session(username, password=password):
             return JsonResponse({'status': 'success', 'message': f'User {username} logged out successfully'})
-        except UserAccount.DoesNotExist:
-            return JsonResponse({'status': 'error', 'message': 'User not found'}, status=404)
+        if UserAccount.objects.filter(user_id=username).exists():
+            return JsonResponse({'status': 'error', 'message': 'Invalid password'}, status=401)
+        return JsonResponse({'status': 'error', 'message': 'User not found'}, status=404)
             
     except json.JSONDecodeError:
         return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
-    except Exception as e:
-        print(f"DEBUG: API Logout error: {e}")
+    except Exception:
+        logger.exception("API logout failed")
         return JsonResponse({
             'status': 'error',
             'message': 'Internal server error'
         }, status=500)
 
+def _logout_batch(items):
+    # Every password is still hashed and checked, so batches are kept small
+    max_items = settings.LOGOUT_BATCH_MAX_ITEMS
+    if len(items) > max_items:
+        return JsonResponse({'status': 'error', 'message': f'At most {max_items} users per request'}, status=413)
+
+    valid = [isinstance(item, dict) and isinstance(item.get('username'), str) and bool(item.get('username'))
+             and isinstance(item.get('password'), str) and bool(item.get('password')) for item in items]
+    credentials = {item['username']: item['password'] for item, ok in zip(items, valid) if ok}
+    logger.debug("API batch logout for %d users", len(credentials))
+    outcomes = session_state.release_many(credentials)
+
+    results = []
+    for item, ok in zip(items, valid):
+        if not ok:
+            results.append({'username': item.get('username') if isinstance(item, dict) else None, 'result': 'invalid'})
+        else:
+            results.append({'username': item['username'], 'result': outcomes[item['username']]})
+    return JsonResponse({
+        'status': 'success',
+        'logged_out': sum(1 for outcome in outcomes.values() if outcome == session_state.OK),
+        'results': results,
+    })
+
 # JWT-protected profile endpoint
+@read_only
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def api_me(request):
@@ -228,6 +368,13 @@ def api_me(request):
     except Exception:
         return JsonResponse({'detail': 'Unable to fetch profile'}, status=500)
 
+# JWT-protected heartbeat (see users/heartbeat.py); no database access
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def api_heartbeat(request):
+    heartbeat.beat(request.user.username)
+    return JsonResponse({'status': 'success', 'timeout': heartbeat.setting('TIMEOUT')})
+
 # JWT-protected presence endpoint
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
@@ -243,14 +390,100 @@ def api_user_presence(request, user_id):
             return JsonResponse({'detail': 'Forbidden'}, status=403)
 
         # Map presence to our UserAccount flags
-        ua = UserAccount.objects.filter(user_id=request.user.username).first()
-        if ua:
-            ua.is_logged_in = (status_value == 'online')
-            if status_value == 'offline':
-                ua.current_session = None
-                ua.session_key = None
-            ua.save()
+        if status_value == 'offline':
+            session_state.release_session(request.user.username)
+        else:
+            UserAccount.objects.filter(user_id=request.user.username).update(is_logged_in=True)
+            heartbeat.beat(request.user.username)
+            events.publish(request.user.username)
 
         return JsonResponse({'user_id': request.user.id, 'status': status_value})
     except json.JSONDecodeError:
         return JsonResponse({'detail': 'Invalid JSON'}, status=400)
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson')
+
+def _presence_items(request):
+    """
+    Parse a batch presence body into a list of parsed items (None for an
+    item that isn't valid JSON). JSON body: [{"user_id": ..., "status": ...}, ...]
+    or {"updates": [...]}. NDJSON body: one item per line; an item may also
+    be the compact form ["user_id", "status"].
+    """
+    if request.content_type in NDJSON_CONTENT_TYPES:
+        items = []
+        for line in request.body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                items.append(None)
+        return items
+
+    data = json.loads(request.body or '[]')
+    if isinstance(data, dict):
+        data = data.get('updates')
+    if not isinstance(data, list):
+        raise ValueError('expected a list of updates')
+    return data
+
+def _presence_item(item):
+    # (user_id, status) for a well-formed item, else None
+    if isinstance(item, dict):
+        item = (item.get('user_id'), item.get('status'))
+    if not isinstance(item, (list, tuple)) or len(item) != 2:
+        return None
+    user_id, status_value = item
+    if not isinstance(user_id, str) or not user_id or status_value not in (bulk.ONLINE, bulk.OFFLINE):
+        return None
+    return user_id, status_value
+
+# JWT-protected batch presence endpoint for gateways proxying many clients
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def api_batch_presence(request):
+    """
+    Apply many presence updates in one request
+    POST /api/users/presence/
+    Body: [{"user_id": "u1", "status": "online"}, ...] (or NDJSON, see _presence_items)
+    Returns one result per item, in order: ok, not_found, disabled, forbidden,
+    invalid, or superseded (a later item for the same user_id won).
+    Staff may update any account, everyone else only their own.
+    """
+    try:
+        items = _presence_items(request)
+    except (json.JSONDecodeError, UnicodeDecodeError, ValueError):
+        return JsonResponse({'detail': 'Invalid JSON'}, status=400)
+
+    max_items = getattr(settings, 'PRESENCE_BATCH_MAX_ITEMS', 10000)
+    if len(items) > max_items:
+        return JsonResponse({'detail': f'At most {max_items} updates per request'}, status=413)
+
+    parsed = [_presence_item(item) for item in items]
+    allowed = None if request.user.is_staff else request.user.username
+    # Last update per user wins
+    last = {}
+    for index, update in enumerate(parsed):
+        if update is not None and (allowed is None or update[0] == allowed):
+            last[update[0]] = index
+    outcomes = bulk.apply_presence({parsed[index][0]: parsed[index][1] for index in last.values()})
+
+    results = []
+    for index, update in enumerate(parsed):
+        if update is None:
+            results.append({'index': index, 'result': 'invalid'})
+            continue
+        user_id, status_value = update
+        if allowed is not None and user_id != allowed:
+            result = 'forbidden'
+        elif last[user_id] != index:
+            result = 'superseded'
+        else:
+            result = outcomes[user_id]
+        results.append({'user_id': user_id, 'status': status_value, 'result': result})
+
+    return JsonResponse({
+        'applied': sum(1 for outcome in outcomes.values() if outcome == session_state.OK),
+        'results': results,
+    })